@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+import argparse
+import csv
+import json
+import time
+from collections import defaultdict
+from typing import Dict, Optional
+
+from loguru import logger
+
+from untanngle.annotations import AttendantAnnotation, AttendantsListAnnotation, ColumnAnnotation, \
+    LineAnnotation, PageAnnotation, RepublicParagraphAnnotation, ResolutionAnnotation, ReviewedAnnotation, \
+    ScanAnnotation, SessionAnnotation, TextRegionAnnotation
+from untanngle.decoding import decoder_for
+
+annotation_class_mapper = dict(
+    attendant=AttendantAnnotation,
+    attendance_list=AttendantsListAnnotation,
+    column=ColumnAnnotation,
+    line=LineAnnotation,
+    page=PageAnnotation,
+    republic_paragraph=RepublicParagraphAnnotation,
+    resolution=ResolutionAnnotation,
+    reviewed=ReviewedAnnotation,
+    scan=ScanAnnotation,
+    session=SessionAnnotation,
+    text_region=TextRegionAnnotation
+)
+
+
+def time_decoding(decode, annotations) -> float:
+    start = time.perf_counter()
+    for a in annotations:
+        decode(a)
+    return time.perf_counter() - start
+
+
+def time_conversion(objects, canvas_idx: dict) -> float:
+    start = time.perf_counter()
+    for o in objects:
+        o.as_web_annotation(textrepo_base_url="https://textrepo.example.org",
+                            physical_version_id="physical-version-id",
+                            logical_version_id="logical-version-id",
+                            canvas_idx=canvas_idx)
+    return time.perf_counter() - start
+
+
+def read_canvas_idx(path: str) -> Dict[str, str]:
+    idx = {}
+    with open(path) as f:
+        for line in csv.reader(f):
+            idx[line[0]] = line[1]
+    return idx
+
+
+def process(path: str, repeat: int, canvas_index_path: Optional[str]):
+    canvas_idx = read_canvas_idx(canvas_index_path) if canvas_index_path else None
+    logger.info(f"<= {path}")
+    with open(path) as f:
+        annotations = json.load(f)
+    annotations_per_type = defaultdict(list)
+    for a in annotations:
+        if a.get("type") in annotation_class_mapper:
+            annotations_per_type[a["type"]].append(a)
+
+    header = f"{'type':20} {'count':>8} {'from_dict (s)':>14} {'decoder (s)':>12} {'speedup':>8}"
+    if canvas_idx is not None:
+        header += f" {'as_web_annotation (/s)':>23}"
+    print(header)
+    for a_type in sorted(annotations_per_type.keys()):
+        a_class = annotation_class_mapper[a_type]
+        typed_annotations = annotations_per_type[a_type] * repeat
+        from_dict_time = time_decoding(a_class.from_dict, typed_annotations)
+        decoder_time = time_decoding(decoder_for(a_class), typed_annotations)
+        speedup = from_dict_time / decoder_time if decoder_time else float("inf")
+        line = f"{a_type:20} {len(typed_annotations):8} {from_dict_time:14.3f} {decoder_time:12.3f} {speedup:7.1f}x"
+        if canvas_idx is not None:
+            objects = [decoder_for(a_class)(a) for a in typed_annotations]
+            conversion_time = time_conversion(objects, canvas_idx)
+            line += f" {len(objects) / conversion_time:23.0f}"
+        print(line)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Measure, per annotation type, the time needed to decode the annotations in an un-t-ann-gle "
+                    "annotationstore file with dataclass_json's from_dict and with the decoders from "
+                    "untanngle.decoding, and (optionally) the throughput of their conversion to web annotations",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("inputfile",
+                        help="The un-t-ann-gle annotationstore file",
+                        type=str)
+    parser.add_argument("-r",
+                        "--repeat",
+                        help="How many times to decode every annotation",
+                        type=int,
+                        default=1)
+    parser.add_argument("-c",
+                        "--canvas-index",
+                        help="A csv file linking image urls to the corresponding canvas url; "
+                             "when given, the conversion to web annotations is measured too",
+                        type=str,
+                        metavar="canvas_index_file")
+    args = parser.parse_args()
+    return args
+
+
+@logger.catch
+def main():
+    args = parse_args()
+    process(args.inputfile, args.repeat, args.canvas_index)
+
+
+if __name__ == '__main__':
+    main()
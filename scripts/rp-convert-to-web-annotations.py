@@ -3,8 +3,11 @@ import argparse
 import csv
 import json
 import random
-from itertools import groupby
-from typing import List, Dict
+from collections import defaultdict
+from functools import cache
+from itertools import chain, groupby
+from multiprocessing import Pool
+from typing import List, Dict, Iterable, Iterator
 
 from icecream import ic
 from loguru import logger
@@ -12,7 +15,8 @@ from rdflib import Graph
 
 from untanngle.annotations import AttendantAnnotation, AttendantsListAnnotation, ColumnAnnotation, \
     LineAnnotation, PageAnnotation, RepublicParagraphAnnotation, ResolutionAnnotation, ReviewedAnnotation, \
-    ScanAnnotation, SessionAnnotation, TextRegionAnnotation, VolumeAnnotation
+    ScanAnnotation, SessionAnnotation, TextRegionAnnotation, VolumeAnnotation, InventoryBoundsAggregator
+from untanngle.decoding import decoder_for
 
 annotation_class_mapper = dict(
     attendant=AttendantAnnotation,
@@ -34,7 +38,7 @@ def as_web_annotation(annotation: dict, textrepo_url: str,
     try:
         a_type = annotation.get('type')
         a_class = annotation_class_mapper[a_type]
-        return a_class.from_dict(annotation).as_web_annotation(
+        return decoder_for(a_class)(annotation).as_web_annotation(
             textrepo_base_url=textrepo_url,
             physical_version_id=physical_version_id,
             logical_version_id=logical_version_id,
@@ -66,44 +70,94 @@ def normalize_annotation(annotation: dict, scanpage_iiif: dict) -> dict:
 
 def convert_annotations(annotations, scanpage_iiif_uri_map, textrepo_url: str,
                         physical_version_id: str, logical_version_id: str,
-                        canvas_idx):
+                        canvas_idx, workers: int = 1, chunk_size: int = 1000) -> Iterator[dict]:
     num_annotations = len(annotations)
     print(f'> converting {num_annotations} annotations...')
-    web_annotations = [
+    context = dict(scanpage_iiif_uri_map=scanpage_iiif_uri_map, textrepo_url=textrepo_url,
+                   physical_version_id=physical_version_id, logical_version_id=logical_version_id,
+                   canvas_idx=canvas_idx)
+    if workers > 1:
+        print(f'> using {workers} worker processes, chunk size {chunk_size}')
+        with Pool(processes=workers, initializer=init_conversion_worker, initargs=(context,)) as pool:
+            for converted_chunk in pool.imap(convert_chunk, chunked(annotations, chunk_size)):
+                yield from converted_chunk
+    else:
+        init_conversion_worker(context)
+        for chunk in chunked(annotations, chunk_size):
+            yield from convert_chunk(chunk)
+    print()
+
+
+def chunked(annotations: List[dict], chunk_size: int) -> Iterator[List[dict]]:
+    for i in range(0, len(annotations), chunk_size):
+        yield annotations[i:i + chunk_size]
+
+
+conversion_context = {}
+
+
+def init_conversion_worker(context: dict):
+    conversion_context.update(context)
+
+
+def convert_chunk(annotations: List[dict]) -> List[dict]:
+    c = conversion_context
+    return [
         as_web_annotation(
-            normalize_annotation(annotation, scanpage_iiif_uri_map),
-            textrepo_url, physical_version_id, logical_version_id, canvas_idx
+            normalize_annotation(annotation, c["scanpage_iiif_uri_map"]),
+            c["textrepo_url"], c["physical_version_id"], c["logical_version_id"], c["canvas_idx"]
         )
         for annotation in annotations
     ]
-    print()
-    return web_annotations
 
 
-def export_to_file(web_annotations, export_path: str):
+def export_to_file(web_annotations: Iterable[dict], export_path: str):
     out_file = f"{export_path}/web_annotations.json"
     print(f'> exporting to {out_file} ...')
+    # streaming equivalent of json.dump(list(web_annotations), out, indent=4, ensure_ascii=False)
     with open(out_file, 'w') as out:
-        json.dump(web_annotations, out, indent=4, ensure_ascii=False)
+        out.write('[')
+        separator = '\n'
+        for web_annotation in web_annotations:
+            out.write(separator)
+            out.write('    ' + json.dumps(web_annotation, indent=4, ensure_ascii=False).replace('\n', '\n    '))
+            separator = ',\n'
+        if separator != '\n':
+            out.write('\n')
+        out.write(']')
+
+
+class TypeSampler:
+    """Keeps one randomly chosen annotation per body type, for a stream of web annotations (reservoir sampling)"""
+
+    def __init__(self):
+        self.counts = defaultdict(int)
+        self.samples = {}
+
+    def add(self, web_annotation: dict):
+        a_type = web_annotation["body"]["type"]
+        self.counts[a_type] += 1
+        if random.randrange(self.counts[a_type]) == 0:
+            self.samples[a_type] = web_annotation
+
+    def sample(self) -> List[Dict]:
+        sample = list(self.samples.values())
+        random.shuffle(sample)
+        return sample
 
 
 def get_sample(web_annotations: List[Dict]) -> List[Dict]:
-    sampled_types = set()
-    sample = []
-    random.shuffle(web_annotations)
+    sampler = TypeSampler()
     for a in web_annotations:
-        a_type = a["body"]["type"]
-        if a_type not in sampled_types:
-            sampled_types.add(a_type)
-            sample.append(a)
-    return sample
+        sampler.add(a)
+    return sampler.sample()
 
 
-def export_sample(web_annotations, export_path: str):
+def export_sample(sample: List[Dict], export_path: str):
     out_file = f'{export_path}/sample.json'
     print(f'> exporting to {out_file} ...')
     with open(out_file, 'w') as out:
-        json.dump(get_sample(web_annotations), out, indent=4, ensure_ascii=False)
+        json.dump(sample, out, indent=4, ensure_ascii=False)
 
 
 def print_example_conversions(annotations, scanpage_iiif: dict, textrepo_base_url: str):
@@ -129,11 +183,15 @@ def print_example_conversions(annotations, scanpage_iiif: dict, textrepo_base_ur
         print("----")
 
 
-def get_manifest_url(inventory_id: str) -> str:
-    with open("data/republic-volumes.csv") as f:
+@cache
+def read_manifest_idx(path: str = "data/republic-volumes.csv") -> Dict[str, str]:
+    with open(path) as f:
         reader = csv.DictReader(f)
-        manifest_idx = {r["inventory_id"]: r["manifest"] for r in reader}
-    return manifest_idx[inventory_id]
+        return {r["inventory_id"]: r["manifest"] for r in reader}
+
+
+def get_manifest_url(inventory_id: str) -> str:
+    return read_manifest_idx()[inventory_id]
 
 
 def create_volume_annotation(
@@ -160,31 +218,37 @@ def create_volume_annotation(
 
 def sanity_check(web_annotations):
     for a in web_annotations:
-        body_id = a['body']['id']
-        targets = a['target']
-        errors = []
-        text_targets_with_selector = [t for t in targets if t['type'] == 'Text' and 'selector' in t]
-        for t in text_targets_with_selector:
-            start = t['selector']['start']
-            end = t['selector']['end']
-            if start > end:
-                errors.append(f"  start ({start}) > end ({end}) for Text target")
-        logical_text_targets_with_selector = [t for t in targets if t['type'] == 'LogicalText' and 'selector' in t]
-        for t in logical_text_targets_with_selector:
-            start = t['selector']['start']
-            end = t['selector']['end']
-            if start > end:
-                errors.append(f"  start ({start}) > end ({end}) for LogicalText target")
-        if errors:
-            logger.error(f"target errors for body.id {body_id}:")
-            for e in errors:
-                logger.error(e)
+        sanity_check_annotation(a)
+
+
+def sanity_check_annotation(a: dict):
+    body_id = a['body']['id']
+    targets = a['target']
+    errors = []
+    text_targets_with_selector = [t for t in targets if t['type'] == 'Text' and 'selector' in t]
+    for t in text_targets_with_selector:
+        start = t['selector']['start']
+        end = t['selector']['end']
+        if start > end:
+            errors.append(f"  start ({start}) > end ({end}) for Text target")
+    logical_text_targets_with_selector = [t for t in targets if t['type'] == 'LogicalText' and 'selector' in t]
+    for t in logical_text_targets_with_selector:
+        start = t['selector']['start']
+        end = t['selector']['end']
+        if start > end:
+            errors.append(f"  start ({start}) > end ({end}) for LogicalText target")
+    if errors:
+        logger.error(f"target errors for body.id {body_id}:")
+        for e in errors:
+            logger.error(e)
 
 
 def convert(annotation_store_path: str, textrepo_url: str,
             physical_version_id: str, logical_version_id: str,
             canvas_index_path: str,
-            export_path: str) -> None:
+            export_path: str,
+            workers: int = 1,
+            chunk_size: int = 1000) -> None:
     print(f'> importing {annotation_store_path} ...')
     with open(annotation_store_path) as f:
         annotations = json.load(f)
@@ -193,31 +257,33 @@ def convert(annotation_store_path: str, textrepo_url: str,
 
     canvas_idx = read_canvas_idx(canvas_index_path)
     web_annotations = convert_annotations(annotations, "", textrepo_url, physical_version_id, logical_version_id,
-                                          canvas_idx)
-
-    inventory_ids = {a["inventory_id"] for a in annotations if "inventory_id" in a}
-    for inventory_id in inventory_ids:
-        inventory_annotations = [a for a in annotations if "inventory_id" in a and a["inventory_id"] == inventory_id]
-        begin_anchor = min(a["begin_anchor"] for a in inventory_annotations)
-        end_anchor = max(a["end_anchor"] for a in inventory_annotations)
-        logical_begin_anchor = 0
-        logical_end_anchor = max(
-            a["logical_end_anchor"]
-            for a in inventory_annotations
-            if "logical_end_anchor" in a)
-        volume_annotation = create_volume_annotation(begin_anchor=begin_anchor, end_anchor=end_anchor,
-                                                     logical_begin_anchor=logical_begin_anchor,
-                                                     logical_end_anchor=logical_end_anchor,
+                                          canvas_idx, workers=workers, chunk_size=chunk_size)
+
+    inventory_bounds = InventoryBoundsAggregator()
+    inventory_bounds.add_all(annotations)
+    volume_annotations = []
+    for inventory_id, bounds in inventory_bounds.bounds.items():
+        if bounds.logical_end_anchor is None:
+            raise ValueError(f"no logical_end_anchor found in the annotations for inventory {inventory_id}")
+        volume_annotation = create_volume_annotation(begin_anchor=bounds.begin_anchor, end_anchor=bounds.end_anchor,
+                                                     logical_begin_anchor=0,
+                                                     logical_end_anchor=bounds.logical_end_anchor,
                                                      inventory_id=inventory_id,
                                                      textrepo_base_url=textrepo_url,
                                                      version_id=physical_version_id,
                                                      logical_version_id=logical_version_id)
-        web_annotations.append(volume_annotation)
+        volume_annotations.append(volume_annotation)
+
+    sampler = TypeSampler()
 
-    sanity_check(web_annotations)
+    def checked_and_sampled(all_web_annotations: Iterable[dict]) -> Iterator[dict]:
+        for web_annotation in all_web_annotations:
+            sanity_check_annotation(web_annotation)
+            sampler.add(web_annotation)
+            yield web_annotation
 
-    export_to_file(web_annotations, export_path)
-    export_sample(web_annotations, export_path)
+    export_to_file(checked_and_sampled(chain(web_annotations, volume_annotations)), export_path)
+    export_sample(sampler.sample(), export_path)
 
     print('> done!')
 
@@ -272,6 +338,15 @@ def parse_args():
                         required=True,
                         help="The directory to put the output files into",
                         type=str)
+    parser.add_argument("-w",
+                        "--workers",
+                        help="The number of worker processes to use for the conversion",
+                        type=int,
+                        default=1)
+    parser.add_argument("--chunk-size",
+                        help="The number of annotations per chunk passed to a worker process",
+                        type=int,
+                        default=1000)
     args = parser.parse_args()
     return args
 
@@ -282,7 +357,7 @@ def main():
     if args.textrepo_base_url.endswith('/'):
         args.textrepo_base_url = args.textrepo_base_url[0:-1]
     convert(args.inputfile, args.textrepo_base_url, args.physical_version_id, args.logical_version_id,
-            args.canvas_index, args.output_directory)
+            args.canvas_index, args.output_directory, workers=args.workers, chunk_size=args.chunk_size)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+import argparse
+import tempfile
+
+from loguru import logger
+
+import untanngle.synthetic_tf_export as synthetic
+import untanngle.textfabric as tf
+from untanngle.instrumentation import profilers
+
+
+def process(args):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        data_path = args.data_path
+        if not data_path:
+            data_path = f"{tmp_dir}/tf"
+            export = synthetic.SyntheticTFExport(texts=args.texts, pages_per_text=args.pages,
+                                                 paragraphs_per_page=args.paragraphs, tokens_per_paragraph=args.tokens,
+                                                 seed=args.seed)
+            export.write(data_path)
+            print(f"synthetic export: {export.annotation_count} tf annotations")
+        config = tf.TFUntangleConfig(
+            project_name=args.project_name,
+            data_path=data_path,
+            export_path=args.export_path or f"{tmp_dir}/out",
+            tier0_type=args.tier0_type or synthetic.tier0_type,
+            excluded_types=args.excluded_types if args.excluded_types is not None else synthetic.excluded_types,
+            textrepo_base_uri_external="https://textrepo.example.org",
+            editem_project=True,
+            profile=True,
+            profiler=args.profiler
+        )
+        errors = tf.untangle_tf_export(config)
+        for e in errors:
+            logger.error(e)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Measure the time and peak memory of the stages of untangle_tf_export, on a text-fabric export "
+                    "or (by default) on a synthetic export of the given size. The stage report is written to "
+                    "untangle-stages.json in the export dir, which is a temporary dir unless --export-path is given.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("-d",
+                        "--data-path",
+                        help="The text-fabric export to untangle, instead of a synthetic one",
+                        type=str)
+    parser.add_argument("-o",
+                        "--export-path",
+                        help="Where to write the output, and the stage report and profile",
+                        type=str)
+    parser.add_argument("-n",
+                        "--project-name",
+                        help="The project name",
+                        type=str,
+                        default="synthetic")
+    parser.add_argument("--tier0-type",
+                        help=f"The tier0 type (default: {synthetic.tier0_type})",
+                        type=str)
+    parser.add_argument("-x",
+                        "--excluded-types",
+                        help=f"The body types to leave out of the web annotations "
+                             f"(default: {' '.join(synthetic.excluded_types)})",
+                        nargs="*",
+                        type=str)
+    parser.add_argument("-p",
+                        "--profiler",
+                        help="Also profile the export with this profiler",
+                        choices=profilers)
+    parser.add_argument("--texts",
+                        help="The number of texts in the synthetic export",
+                        type=int,
+                        default=4)
+    parser.add_argument("--pages",
+                        help="The number of pages per text in the synthetic export",
+                        type=int,
+                        default=50)
+    parser.add_argument("--paragraphs",
+                        help="The number of paragraphs per page in the synthetic export",
+                        type=int,
+                        default=10)
+    parser.add_argument("--tokens",
+                        help="The number of words per paragraph in the synthetic export",
+                        type=int,
+                        default=50)
+    parser.add_argument("--seed",
+                        help="The seed for the random words of the synthetic export",
+                        type=int,
+                        default=0)
+    return parser.parse_args()
+
+
+@logger.catch
+def main():
+    process(parse_args())
+
+
+if __name__ == '__main__':
+    main()
@@ -8,10 +8,20 @@ date=$(date '+%Y.%m.%d')
 year=$1
 envfile=$2
 startstage=$3
+previousdir=$4
 if [[ -z "$startstage" ]]; then
   startstage=1
 fi
 
+usage(){
+  echo "usage: $0 <year> <envfile> [startstage] [previous-harvest-dir]"
+  echo
+  echo "  startstage            the stage (1-7) to start at (default: 1)"
+  echo "  previous-harvest-dir  the out/<yymmdd> dir of an earlier run of this pipeline, to only re-untanngle the"
+  echo "                        sessions of <year> that changed since (default: the latest earlier one that has"
+  echo "                        an untanngle manifest for <year>)"
+}
+
 check_env_var_is_set(){
   name=$1
   var=$2
@@ -27,9 +37,19 @@ harvestdir=out/$(date +"%y%m%d")
 check_env_var_is_set "envfile" $envfile
 check_env_var_is_set "year" $year
 if [ ${some_variables_not_set} ]; then
+  usage
   exit 1
 fi
 
+if [[ -z "$previousdir" ]]; then
+  for dir in $(ls -d out/[0-9][0-9][0-9][0-9][0-9][0-9] 2>/dev/null | sort -r); do
+    if [[ $dir != "$harvestdir" && -f $dir/$year/untanngle-manifest-$year.json ]]; then
+      previousdir=$dir
+      break
+    fi
+  done
+fi
+
 # shellcheck disable=SC1090
 source $envfile
 check_env_var_is_set "ANNO_URL" $ANNO_URL
@@ -50,8 +70,10 @@ fi
 
 if [[ $startstage -le 2 ]]; then
   echo "${txtylw}[2/7] untanngling caf harvest${txtwht}"
-  echo "poetry run scripts/ut-untanngle-republic.py -d $harvestdir $year"
-  poetry run scripts/ut-untanngle-republic.py -d $harvestdir $year
+  # with the output of a previous harvest, only the sessions that changed since are untanngled again
+  previousopt=${previousdir:+-p $previousdir}
+  echo "poetry run scripts/ut-untanngle-republic.py -d $harvestdir $previousopt $year"
+  poetry run scripts/ut-untanngle-republic.py -d $harvestdir $previousopt $year
   echo
 fi
 
@@ -67,7 +89,13 @@ if [[ $startstage -le 3 ]]; then
   echo
 fi
 
-if [[ $startstage -le 4 ]]; then
+# the conversion only depends on the annotationstore and the textstore version ids: when neither textstore was
+# uploaded again in stage 3 and the annotationstore is older than the web annotations, those are still up to date
+if [[ $startstage -le 3 && -f $harvestdir/$year/textstores-unchanged \
+      && $harvestdir/$year/web_annotations.json -nt $harvestdir/$year/annotationstore-$year.json ]]; then
+  echo "${txtylw}[4/7] textstores and annotationstore unchanged, keeping $harvestdir/$year/web_annotations.json${txtwht}"
+  echo
+elif [[ $startstage -le 4 ]]; then
   phys_version=$(jq -r ".[\"$year\"].phys" out/version_id_idx.json)
   log_version=$(jq -r ".[\"$year\"].log" out/version_id_idx.json)
   echo "${txtylw}[4/7] converting annotationstore to web annotations${txtwht}"
@@ -90,8 +118,8 @@ fi
 
 if [[ $startstage -le 6 ]]; then
   echo "${txtylw}[6/7] uploading web annotations to annorepo server${txtwht}"
-  echo "poetry run scripts/ut-upload-web-annotations.py -a $ANNO_URL -c republic-$date -k $ANNO_KEY $harvestdir/$year/web_annotations.json"
-  poetry run scripts/ut-upload-web-annotations.py -a $ANNO_URL -c republic-$date -k $ANNO_KEY $harvestdir/$year/web_annotations.json
+  echo "poetry run scripts/ut-upload-web-annotations.py -a $ANNO_URL -c republic-$date -k $ANNO_KEY -i body.metadata.sessionDate:ascending $harvestdir/$year/web_annotations.json"
+  poetry run scripts/ut-upload-web-annotations.py -a $ANNO_URL -c republic-$date -k $ANNO_KEY -i body.metadata.sessionDate:ascending $harvestdir/$year/web_annotations.json
   echo
 fi
 
@@ -4,23 +4,27 @@ import datetime
 import glob
 import json
 import logging
+import os
 import re
 import sys
 import time
-import uuid
+from bisect import bisect_left, bisect_right
 from collections import defaultdict
 from dataclasses import dataclass
 from enum import Enum
 from functools import cache
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple, NamedTuple, Sequence
 
 from alive_progress import alive_bar
 from loguru import logger
-from stam import AnnotationStore, Selector, Offset, TextSelectionOperator
 
 from untanngle.annotation import asearch
+from untanngle.annotations import parse_iiif_url
+from untanngle.checkpoints import CheckpointStore, file_digest, file_digests, fingerprint, module_digests
+from untanngle.instrumentation import StageTimer
 from untanngle.textservice import segmentedtext
 from untanngle.textservice.segmentedtext import IndexedSegmentedText
+from untanngle.utils import read_json
 
 # untanngle process
 
@@ -28,7 +32,6 @@ from untanngle.textservice.segmentedtext import IndexedSegmentedText
 attendant_classes = ('president', 'delegate', 'raadpensionaris')
 
 # constants used for compilation of iiif urls
-region_pattern = re.compile(r'(.jpg/)(\d+),(\d+),(\d+),(\d+)')
 image_id_pattern = re.compile(r'(images.diginfra.net/iiif/)(.*)(/)(\d+),(\d+),(\d+),(\d+)')
 iiif_base = 'https://images.diginfra.net/iiif/'
 iiif_extension = '/max/0/default.jpg'
@@ -39,33 +42,18 @@ session_es_index = "https://annotation.republic-caf.diginfra.org/elasticsearch/s
 logical_anchor_range_for_line_anchor = defaultdict(lambda: LogicalAnchorRange(0, 0, 0, 0))
 
 
-class AnnotationsWrapper:
-    def __init__(self, annotations: List):
-        self.annotation_idx = {a["id"]: a for a in annotations}
-        max_anchor = max([a['end_anchor'] for a in annotations]) + 1
-        store = AnnotationStore(id=uuid.uuid4())
-        resource = store.add_resource(id="dummy", text="*" * max_anchor)
-        annotation_set = store.add_annotationset(id="type_set")
-        annotation_set.add_key("type")
-        for a in annotations:
-            a_type = a['type']
-            type_data = annotation_set.add_data(key="type", value=a_type)
-            store.annotate(
-                id=a['id'],
-                target=Selector.textselector(resource, Offset.simple(a['begin_anchor'], a['end_anchor'] + 1)),
-                data=type_data
-            )
-        # store.set_filename("out/store.json")
-        # store.save()
-        self.resource = resource
+class ImageRegion(NamedTuple):
+    image_url: str
+    left: int
+    top: int
+    right: int
+    bottom: int
+
 
-    @cache
-    def get_annotations_overlapping_with_anchor_range(self, begin_anchor, end_anchor):
-        selection = self.resource.textselection(Offset.simple(begin_anchor, end_anchor + 1))
-        overlapping = [self.annotation_idx[a.id()] for a in
-                       selection.find_annotations(TextSelectionOperator.overlaps())]
-        exact = [self.annotation_idx[a.id()] for a in selection.annotations()]
-        return overlapping + exact
+# maps line anchor to the ImageRegion of that line
+image_region_for_line_anchor: Dict[int, ImageRegion] = {}
+# maps text_region id to the ImageRegion of its iiif_url, and the suffix of that url
+image_region_for_text_region: Dict[str, Tuple[ImageRegion, str]] = {}
 
 
 @dataclass
@@ -104,6 +92,21 @@ line_ids_to_anchors = {}
 line_ids_vs_occurrences = {}
 resolution_annotations = []
 
+# maps session id to the range of line anchors [begin, end) of its session file
+line_range_for_session: Dict[str, Tuple[int, int]] = {}
+# maps session id to the range [begin, end) in resolution_annotations of the annotations from its resolution file
+resolution_range_for_session: Dict[str, Tuple[int, int]] = {}
+
+
+def reset_state():
+    all_annotations.clear()
+    resolution_annotations.clear()
+    for module_dict in (line_ids_to_anchors, line_ids_vs_occurrences, line_range_for_session,
+                        resolution_range_for_session,
+                        logical_anchor_range_for_line_anchor, image_region_for_line_anchor,
+                        image_region_for_text_region):
+        module_dict.clear()
+
 
 def text_region_handler(text_region, begin_index, end_index, annotations, resource_id: str):
     # text_region['metadata'] contains enough info to construct annotations for page and scan.
@@ -403,11 +406,106 @@ def get_res_root_element(file):
     return resolution_data['hits']['hits']
 
 
-def collect_attendant_info(span, paras, paragraph_anchor: Dict[str, int]):
+@dataclass
+class LinePosition:
+    line_begin: int
+    line_end: int
+    line_anchor: int
+    line_start: int
+    paragraph_index: int
+
+
+class AttendanceListTextMap:
+    """
+    Maps the character offsets used in the attendance_spans of an attendance_list, which count over the
+    concatenated texts of its republic_paragraphs, to line anchors and paragraphs.
+    Built once per attendance_list, so each span can be resolved with a binary search.
+    """
+
+    def __init__(self, attlist_id: str, paras: List[Dict[str, Any]], paragraph_anchor: Dict[str, int]):
+        self.paras = paras
+        self.paragraph_anchor = paragraph_anchor
+        positions = []
+        line_ids_not_in_index = set()
+        char_ptr = 0
+        last_end = 0
+        for paragraph_index, p in enumerate(paras):
+            char_ptr += last_end
+            for lr in p['line_ranges']:
+                last_end = lr['end']
+                if lr['line_id'] in line_ids_to_anchors:
+                    positions.append(LinePosition(
+                        line_begin=lr['start'] + char_ptr - 1,
+                        line_end=lr['end'] + char_ptr,
+                        line_anchor=line_ids_to_anchors[lr['line_id']],
+                        line_start=lr['start'],
+                        paragraph_index=paragraph_index
+                    ))
+                else:
+                    line_ids_not_in_index.add(lr['line_id'])
+            char_ptr += 1  # paragraphs are concatenated with space in between
+        if line_ids_not_in_index:
+            logging.warning(f"attendance_list {attlist_id}: {len(line_ids_not_in_index)} `line_id`s missing"
+                            f" from line_ids_vs_indexes: {sorted(line_ids_not_in_index)}")
+        self.positions = positions
+        self.line_begins = [lp.line_begin for lp in positions]
+        self.line_ends = [lp.line_end for lp in positions]
+        self.sorted_offsets = all(
+            positions[i].line_begin <= positions[i + 1].line_begin and
+            positions[i].line_end <= positions[i + 1].line_end
+            for i in range(len(positions) - 1)
+        )
+
+    def end_position(self, att_end: int) -> Optional[int]:
+        """the index of the first line with line_begin <= att_end <= line_end"""
+        if self.sorted_offsets:
+            i = bisect_left(self.line_ends, att_end)
+            if i < len(self.positions) and self.line_begins[i] <= att_end:
+                return i
+            return None
+        for i, lp in enumerate(self.positions):
+            if lp.line_begin <= att_end <= lp.line_end:
+                return i
+        return None
+
+    def begin_positions(self, att_begin: int, end_position: int) -> Optional[Tuple[int, int]]:
+        """the indexes of the first and the last line up to end_position with line_begin <= att_begin < line_end"""
+        if self.sorted_offsets:
+            last = min(bisect_right(self.line_begins, att_begin) - 1, end_position)
+            if last >= 0 and self.line_begins[last] <= att_begin < self.line_ends[last]:
+                return bisect_right(self.line_ends, att_begin), last
+            return None
+        matching = [i for i in range(end_position + 1)
+                    if self.line_begins[i] <= att_begin < self.line_ends[i]]
+        if matching:
+            return matching[0], matching[-1]
+        return None
+
+    def logical_offsets(self, pattern: str, first_position: int, end_position: int) -> Tuple[int, int]:
+        first_paragraph_text = self.paras[self.positions[first_position].paragraph_index]['text']
+        if pattern in first_paragraph_text:
+            # the concatenated paragraph texts start with this text, so the pattern is found there first
+            p_start_offset = first_paragraph_text.index(pattern)
+        else:
+            par_text = '\n'.join(self.paras[lp.paragraph_index]['text']
+                                 for lp in self.positions[first_position:end_position + 1])
+            if pattern in par_text:
+                p_start_offset = par_text.index(pattern)
+            else:
+                p_start_offset = par_text.replace("\n", " ").index(pattern.replace("\n", " "))
+
+        if '\n' in pattern:
+            parts = pattern.split('\n')
+            p_end_offset = len(parts[-1])
+        else:
+            p_end_offset = p_start_offset + len(pattern)
+        return p_start_offset, p_end_offset
+
+
+def collect_attendant_info(span, text_map: AttendanceListTextMap):
     result = None
 
     pattern = span['pattern'].strip()
-    # ic(span['pattern'], span['offset'], span['end'], [(p['id'], p['text']) for p in paras])
     att_begin = span['offset']
     att_end = span['end']
     if att_begin < 0:
@@ -418,102 +516,54 @@ def collect_attendant_info(span, paras, paragraph_anchor: Dict[str, int]):
         logging.warning(f"span {span}: span['end'] ({span['end']}) < 0")
         return result
 
-    char_ptr = 0
-    last_end = 0
-    line_ids_not_in_index = set()
-    begin_anchor = 0
-    begin_char_offset = 0
-    start_paragraph_id = None
-    relevant_paragraph_texts = []
-
-    for p in paras:
-        # ic(p['text'])
-        if result is not None:  # bit ugly, to break out of both loops when result is reached
-            break
-        char_ptr += last_end
-
-        for lr in p['line_ranges']:
-            last_end = lr['end']
-            line_begin = lr['start'] + char_ptr - 1
-            line_end = lr['end'] + char_ptr
-
-            if lr['line_id'] in line_ids_to_anchors:
-                anchor = line_ids_to_anchors[lr['line_id']]
-                # ic(anchor)
-                # ic(line_begin, att_begin, line_end)
-                if line_begin <= att_begin < line_end:
-                    begin_anchor = anchor  # TODO: find out why begin_anchor == 0 for some attendants
-                    begin_char_offset = att_begin - lr['start']
-                    start_paragraph_id = p['id']
-                # ic(start_paragraph_id)
-                if start_paragraph_id:
-                    relevant_paragraph_texts.append(p['text'])
-                if line_begin <= att_end <= line_end:
-                    end_anchor = anchor
-                    end_char_offset = att_end - lr['start']
-                    par_text = '\n'.join(relevant_paragraph_texts)
-
-                    # p_start_offset = p['metadata']['start_offset'] - (
-                    #             p['metadata']['paragraph_index'] * 2)  # because of double(?) space between paragraphs
-                    # ic(par_text, pattern)
-                    if pattern in par_text:
-                        p_start_offset = par_text.index(pattern)
-                    else:
-                        p_start_offset = par_text.replace("\n", " ").index(pattern.replace("\n", " "))
-
-                    if '\n' in pattern:
-                        parts = pattern.split('\n')
-                        p_end_offset = len(parts[-1])
-                    else:
-                        p_end_offset = p_start_offset + len(pattern)
-                    result = {
-                        'begin_anchor': begin_anchor,
-                        'begin_char_offset': begin_char_offset,
-                        'end_anchor': end_anchor,
-                        'end_char_offset': end_char_offset,
-                        'logical_begin_anchor': paragraph_anchor[start_paragraph_id],
-                        'logical_end_anchor': paragraph_anchor[p['id']],
-                        'logical_begin_char_offset': p_start_offset,
-                        'logical_end_char_offset': p_end_offset
-                    }
-                    if result['logical_begin_anchor'] > result['logical_end_anchor']:
-                        logging.error(
-                            f"logical_begin_anchor ({result['logical_begin_anchor']}) > logical_end_anchor ({result['logical_end_anchor']})")
-                    if (result['logical_begin_anchor'] == result['logical_end_anchor']) and (
-                            result['logical_begin_char_offset'] >= result['logical_end_char_offset']):
-                        logging.error(
-                            f"logical_begin_char_offset ({result['logical_begin_char_offset']}) >="
-                            f" logical_end_char_offset ({result['logical_end_char_offset']}) ")
-                        logging.info(relevant_paragraph_texts)
-                    logging.debug(
-                        f"result! for: l_begin: {line_begin}, l_end: {line_end}, att_begin: {att_begin}, att_end: {att_end}")
-                    break
-                else:
-                    logging.debug(
-                        f"no result for: l_begin: {line_begin}, l_end: {line_end}, att_begin: {att_begin}, att_end: {att_end}")
-
-            else:
-                line_ids_not_in_index.add(lr['line_id'])
-                logging.warning(f"span {span}: {lr['line_id']} not found in line_ids_vs_indexes")
-        char_ptr += 1  # paragraphs are concatenated with space in between
-    if line_ids_not_in_index:
-        logging.warning(f"span {span}: {len(line_ids_not_in_index)} `line_id`s missing from line_ids_vs_indexes")
+    end_position = text_map.end_position(att_end)
+    if end_position is None:
+        logging.debug(f"no result for: att_begin: {att_begin}, att_end: {att_end}")
+        return result
+    begin_positions = text_map.begin_positions(att_begin, end_position)
+    if begin_positions is None:
+        logging.error(f"span {span}: no line found containing span['offset'] ({att_begin})")
+        return result
+    first_begin_position, begin_position = begin_positions
+
+    begin_line = text_map.positions[begin_position]
+    end_line = text_map.positions[end_position]
+    p_start_offset, p_end_offset = text_map.logical_offsets(pattern, first_begin_position, end_position)
+    result = {
+        'begin_anchor': begin_line.line_anchor,  # TODO: find out why begin_anchor == 0 for some attendants
+        'begin_char_offset': att_begin - begin_line.line_start,
+        'end_anchor': end_line.line_anchor,
+        'end_char_offset': att_end - end_line.line_start,
+        'logical_begin_anchor': text_map.paragraph_anchor[text_map.paras[begin_line.paragraph_index]['id']],
+        'logical_end_anchor': text_map.paragraph_anchor[text_map.paras[end_line.paragraph_index]['id']],
+        'logical_begin_char_offset': p_start_offset,
+        'logical_end_char_offset': p_end_offset
+    }
+    if result['logical_begin_anchor'] > result['logical_end_anchor']:
+        logging.error(
+            f"logical_begin_anchor ({result['logical_begin_anchor']}) > logical_end_anchor ({result['logical_end_anchor']})")
+    if (result['logical_begin_anchor'] == result['logical_end_anchor']) and (
+            result['logical_begin_char_offset'] >= result['logical_end_char_offset']):
+        logging.error(
+            f"logical_begin_char_offset ({result['logical_begin_char_offset']}) >="
+            f" logical_end_char_offset ({result['logical_end_char_offset']}) ")
+        logging.info([text_map.paras[lp.paragraph_index]['text']
+                      for lp in text_map.positions[first_begin_position:end_position + 1]])
+    logging.debug(
+        f"result! for: l_begin: {end_line.line_begin}, l_end: {end_line.line_end}, att_begin: {att_begin}, att_end: {att_end}")
     return result
 
 
 def create_attendants_for_attlist(attlist, session_id, resource_id, provenance_source: str,
-                                  paragraph_anchor: Dict[str, int]):
+                                  paragraph_anchor: Dict[str, int], paragraph_index: asearch.OverlapIndex):
     attendant_annots = []
 
     spans = attlist['attendance_spans']
 
-    # sess = asearch.get_annotation_by_id(session_id, all_annotations)
-    paras = list(asearch.get_annotations_of_type_overlapping('republic_paragraph',
-                                                             attlist['begin_anchor'],
-                                                             attlist['end_anchor'],
-                                                             all_annotations,
-                                                             resource_id))
+    paras = paragraph_index.get_annotations_overlapping_with(attlist['begin_anchor'], attlist['end_anchor'],
+                                                             resource_id)
     logging.debug(f"{len(paras)} republic_paragraphs found")
+    text_map = AttendanceListTextMap(attlist['id'], paras, paragraph_anchor)
     for index, span in enumerate(spans):
         if span['class'] in attendant_classes:
             attendant = {
@@ -524,7 +574,7 @@ def create_attendants_for_attlist(attlist, session_id, resource_id, provenance_s
                 'metadata': span
             }
 
-            a_info = collect_attendant_info(span, paras, paragraph_anchor)
+            a_info = collect_attendant_info(span, text_map)
             if a_info is None:  # span not matching with text of paras
                 logging.error(f"span {span}: does not match for session {session_id}")
             else:
@@ -544,45 +594,6 @@ def create_attendants_for_attlist(attlist, session_id, resource_id, provenance_s
     return attendant_annots
 
 
-# assume that iiif_urls refer to the same image resource
-def union_of_iiif_urls(urls):
-    # check if urls contain same image_identifier
-    img_id = image_id_pattern.search(urls[0]).group(2)
-
-    # Initialize the bounding region coordinates
-    min_left, max_right, min_top, max_bottom = float('inf'), float('-inf'), float('inf'), float('-inf')
-
-    # for each url, find left, right, top, bottom
-    for url in urls:
-        if not image_id_pattern.search(url):
-            logging.error(f"{url} doesn't match expected pattern, skipping")
-        else:
-            if image_id_pattern.search(url).group(2) != img_id:
-                # print(f'\t{urls[0]}')
-                logging.error(f"{url} refers to other image than {img_id}")
-                break
-
-            region_string = region_pattern.search(url)
-            left, top, width, height = map(int, region_string.groups()[1:5])
-            right = left + width
-            bottom = top + height
-
-            # Update the bounding region coordinates
-            min_left = min(min_left, left)
-            max_right = max(max_right, right)
-            min_top = min(min_top, top)
-            max_bottom = max(max_bottom, bottom)
-
-    height = max_bottom - min_top
-    width = max_right - min_left
-
-    # Construct the IIIF URL by replacing the coordinate part in the first input URL
-    bounding_region_str = f"{min_left},{min_top},{width},{height}"
-    bounding_url = re.sub(r'\d+,\d+,\d+,\d+', bounding_region_str, urls[0])
-
-    return bounding_url
-
-
 def get_bounding_box_for_coords(coords):
     min_left = min([crd[0] for crd in coords])
     max_right = max([crd[0] for crd in coords])
@@ -665,8 +676,62 @@ def add_logical_anchors(annotations):
     return [with_logical_anchors(a) for a in annotations]
 
 
-def untanngle_year(year: int, data_dir: str):
+# the stages of untanngle_year that can be resumed from; the state after each but the last is checkpointed
+untanngle_stages = ['traversal', 'resolutions', 'attendants', 'region_links']
+
+
+@cache
+def code_digest() -> str:
+    # this script and the untanngle modules it uses: checkpoints and manifests made by other code are not reused
+    return fingerprint(module_digests('untanngle'), file_digest(__file__))
+
+
+def input_digests(datadir: str, sessions_folder: str, resolutions_folder: str) -> Dict[str, str]:
+    input_files = get_session_files(f'{datadir}/{sessions_folder}') + \
+                  get_resolution_files(f'{datadir}/{resolutions_folder}')
+    return file_digests(input_files, datadir)
+
+
+def checkpoint_state(**local_state) -> Dict[str, Any]:
+    # pickle the module state together, so annotations shared between the lists stay shared
+    return {
+        'all_annotations': all_annotations,
+        'resolution_annotations': resolution_annotations,
+        'line_ids_to_anchors': line_ids_to_anchors,
+        'line_ids_vs_occurrences': line_ids_vs_occurrences,
+        'logical_anchor_range_for_line_anchor': dict(logical_anchor_range_for_line_anchor),
+        'line_range_for_session': line_range_for_session,
+        'resolution_range_for_session': resolution_range_for_session,
+        'local': local_state
+    }
+
+
+def restore_state(state: Dict[str, Any]) -> Dict[str, Any]:
+    all_annotations[:] = state['all_annotations']
+    resolution_annotations[:] = state['resolution_annotations']
+    for name in ('line_ids_to_anchors', 'line_ids_vs_occurrences', 'logical_anchor_range_for_line_anchor',
+                 'line_range_for_session', 'resolution_range_for_session'):
+        module_dict = globals()[name]
+        module_dict.clear()
+        module_dict.update(state[name])
+    return state['local']
+
+
+def untanngle_year(year: int, data_dir: str, start_stage: str = 'auto', previous_data_dir: Optional[str] = None):
     datadir = f"{data_dir}/{year}"
+    sessions_folder = f'sessions/'
+    resolutions_folder = f'resolutions/'
+    text_store = f'textstore-{year}.json'
+    annotation_store = f'annotationstore-{year}.json'
+    stage_report = f'untanngle-republic-{year}-stages.json'
+    resource_id = f'volume-{year}'
+
+    digests = input_digests(datadir, sessions_folder, resolutions_folder)
+    checkpoints = CheckpointStore(f'{datadir}/checkpoints', fingerprint(digests, code_digest()))
+    if start_stage == 'auto' and checkpoints.is_valid('done') and os.path.exists(f'{datadir}/{annotation_store}'):
+        logger.info(f"input for {year} is unchanged since the last run, skipping")
+        return
+
     logfile = f'{datadir}/untanngle-republic-{year}.log'
     logger.info(f"logging to {logfile}")
     logging.basicConfig(filename=logfile,
@@ -674,81 +739,361 @@ def untanngle_year(year: int, data_dir: str):
                         filemode='w',
                         format='%(asctime)s | %(levelname)s | %(message)s',
                         level=logging.INFO)
+    timer = StageTimer(metadata={"year": year})
+
+    if start_stage == 'auto':
+        last_stage = checkpoints.latest_valid(untanngle_stages[:-1])
+        if last_stage is None and previous_data_dir:
+            with timer.stage("splice_changed_sessions"):
+                spliced = splice_changed_sessions(year, datadir, f"{previous_data_dir}/{year}", digests, resource_id)
+            if spliced:
+                checkpoints.save('done')
+                timer.write_report(f'{datadir}/{stage_report}')
+                return
+            logger.warning(f"can't splice changed sessions into the previous untanngle result, doing a full rebuild")
+            reset_state()
+        start_index = untanngle_stages.index(last_stage) + 1 if last_stage else 0
+    else:
+        start_index = untanngle_stages.index(start_stage)
+        if start_index > 0 and not checkpoints.is_valid(untanngle_stages[start_index - 1]):
+            raise ValueError(f"no valid checkpoint for stage '{untanngle_stages[start_index - 1]}' in"
+                             f" {checkpoints.directory}, can't start at stage '{start_stage}'")
+    local_state = {}
+    if start_index > 0:
+        logger.info(f"resuming at stage '{untanngle_stages[start_index]}'")
+        local_state = restore_state(checkpoints.load(untanngle_stages[start_index - 1]))
+    line_anchor_idx = local_state.get('line_anchor_idx')
+    paragraph_anchor_idx = local_state.get('paragraph_anchor_idx')
+
+    if start_index <= untanngle_stages.index('traversal'):
+        with timer.stage("traverse_session_files") as stage:
+            all_textlines, line_anchor_idx = traverse_session_files(f'{datadir}/{sessions_folder}', resource_id)
+            stage.items = len(all_annotations)
+        with timer.stage("store_segmented_text") as stage:
+            stage.items = all_textlines.len()
+            store_segmented_text(all_textlines, f'{datadir}/{text_store}')
+
+        with timer.stage("deduplicate_annotations") as stage:
+            deduplicate_annotations(all_annotations, AnnTypes.SCAN)
+            logging.info(f"after removing duplicate scan annotations: {len(all_annotations)} annotations")
+
+            deduplicate_annotations(all_annotations, AnnTypes.PAGE)
+            logging.info(f"after removing duplicate page annotations: {len(all_annotations)} annotations")
+            stage.items = len(all_annotations)
+
+        with timer.stage("checkpoint_traversal"):
+            checkpoints.save('traversal', checkpoint_state(line_anchor_idx=line_anchor_idx))
+
+    if start_index <= untanngle_stages.index('resolutions'):
+        logging.info(f"traverse_resolution_files({resolutions_folder},{resource_id})")
+        with timer.stage("traverse_resolution_files") as stage:
+            traverse_resolution_files(f'{datadir}/{resolutions_folder}', resource_id)
+            stage.items = len(all_annotations)
+
+        logging.info(f"index_line_annotations({resource_id})")
+        with timer.stage("index_line_annotations") as stage:
+            index_line_annotations(resource_id)
+            stage.items = len(line_ids_to_anchors)
+
+        logging.info("sanity_check_line_id_occurrences()")
+        with timer.stage("sanity_check_line_id_occurrences"):
+            sanity_check_line_id_occurrences()
+
+        logging.info("set_anchors_in_resolution_annotations()")
+        with timer.stage("set_anchors_in_resolution_annotations"):
+            set_anchors_in_resolution_annotations()
+
+        logging.info(f"check_for_missing_attendance_lists_in_session_annotations({resource_id})")
+        with timer.stage("check_for_missing_attendance_lists_in_session_annotations"):
+            check_for_missing_attendance_lists_in_session_annotations(resource_id)
+
+        with timer.stage("checkpoint_resolutions"):
+            checkpoints.save('resolutions', checkpoint_state(line_anchor_idx=line_anchor_idx))
+
+    if start_index <= untanngle_stages.index('attendants'):
+        with timer.stage("extract_paragraph_text") as stage:
+            paragraph_anchor_idx = extract_paragraph_text(datadir, year, line_anchor_idx)
+            stage.items = len(paragraph_anchor_idx)
+
+        logging.info(f"add_attendant_annotations({resource_id})")
+        with timer.stage("add_attendant_annotations") as stage:
+            add_attendant_annotations(resource_id, paragraph_anchor_idx)
+            stage.items = len(all_annotations)
+
+        with timer.stage("check_annotations") as stage:
+            check_annotations(all_annotations)
+            stage.items = len(all_annotations)
+
+        with timer.stage("checkpoint_attendants"):
+            checkpoints.save('attendants', checkpoint_state(line_anchor_idx=line_anchor_idx,
+                                                            paragraph_anchor_idx=paragraph_anchor_idx))
+
+    _annotations = add_region_links_and_logical_anchors(resource_id, timer)
 
-    sessions_folder = f'sessions/'
-    resolutions_folder = f'resolutions/'
-    text_store = f'textstore-{year}.json'
-    annotation_store = f'annotationstore-{year}.json'
-    resource_id = f'volume-{year}'
+    # logging.info("add_provenance()")
+    # add_provenance()
 
-    all_textlines, line_anchor_idx = traverse_session_files(f'{datadir}/{sessions_folder}', resource_id)
-    store_segmented_text(all_textlines, f'{datadir}/{text_store}')
+    with timer.stage("store_annotations") as stage:
+        stage.items = len(_annotations)
+        store_annotations(_annotations, f'{datadir}/{annotation_store}')
+    store_manifest(build_manifest(digests), f'{datadir}/{manifest_name(year)}')
+    checkpoints.save('done')
+
+    timer.write_report(f'{datadir}/{stage_report}')
+
+
+def manifest_name(year: int) -> str:
+    return f'untanngle-manifest-{year}.json'
+
+
+def build_manifest(digests: Dict[str, str]) -> Dict[str, Any]:
+    """
+    Record, per session, the digests of its input files and the ranges of physical and logical anchors
+    its text was given, so a later run can splice re-untanngled sessions into this result.
+    """
+    session_ids = sorted(line_range_for_session, key=lambda sid: line_range_for_session[sid][0])
+    logical_ranges = logical_range_for_sessions(session_ids)
+    sessions = []
+    for session_id in session_ids:
+        begin_anchor, end_anchor = line_range_for_session[session_id]
+        logical_begin_anchor, logical_end_anchor = logical_ranges.get(session_id, (0, 0)) if logical_ranges else (0, 0)
+        sessions.append({
+            'session_id': session_id,
+            'session_digest': digests.get(f'sessions/{session_id}.json'),
+            'resolutions_digest': digests.get(f'resolutions/{session_id}-resolutions.json'),
+            'begin_anchor': begin_anchor,
+            'end_anchor': end_anchor,
+            'logical_begin_anchor': logical_begin_anchor,
+            'logical_end_anchor': logical_end_anchor
+        })
+    return {
+        'code_digest': code_digest(),
+        'spliceable': logical_ranges is not None and resolutions_within_sessions(),
+        'sessions': sessions
+    }
 
-    deduplicate_annotations(all_annotations, AnnTypes.SCAN)
-    logging.info(f"after removing duplicate scan annotations: {len(all_annotations)} annotations")
 
-    deduplicate_annotations(all_annotations, AnnTypes.PAGE)
-    logging.info(f"after removing duplicate page annotations: {len(all_annotations)} annotations")
+def logical_range_for_sessions(session_ids: List[str]) -> Optional[Dict[str, Tuple[int, int]]]:
+    """
+    The range of logical anchors [begin, end) of the paragraphs starting in each session,
+    or None when the paragraphs of the sessions are not in consecutive logical anchor ranges.
+    """
+    session_begins = [line_range_for_session[sid][0] for sid in session_ids]
+    paragraph_anchors = defaultdict(list)
+    for a in all_annotations:
+        if a['type'] in (AnnTypes.RESOLUTION_REVIEW.value, AnnTypes.PARAGRAPH.value):
+            first_line_anchor = line_ids_to_anchors.get(a['line_ranges'][0]['line_id'])
+            if first_line_anchor is None:
+                return None
+            session_id = session_ids[bisect_right(session_begins, first_line_anchor) - 1]
+            paragraph_anchors[session_id].append(a['logical_begin_anchor'])
+    logical_ranges = {}
+    next_anchor = 0
+    for session_id in session_ids:
+        anchors = sorted(paragraph_anchors[session_id])
+        if anchors != list(range(next_anchor, next_anchor + len(anchors))):
+            return None
+        logical_ranges[session_id] = (next_anchor, next_anchor + len(anchors))
+        next_anchor += len(anchors)
+    return logical_ranges
+
+
+def resolutions_within_sessions() -> bool:
+    for session_id, (begin, end) in resolution_range_for_session.items():
+        if session_id not in line_range_for_session:
+            return False
+        begin_anchor, end_anchor = line_range_for_session[session_id]
+        for res in resolution_annotations[begin:end]:
+            if not (begin_anchor <= res['begin_anchor'] <= res['end_anchor'] < end_anchor):
+                return False
+    return True
+
+
+def store_manifest(manifest: Dict[str, Any], store_path: str):
+    logging.info(f"=> {store_path}")
+    with open(store_path, 'w', encoding='UTF8') as filehandle:
+        json.dump(manifest, filehandle, indent=4)
 
-    logging.info(f"traverse_resolution_files({resolutions_folder},{resource_id})")
-    traverse_resolution_files(f'{datadir}/{resolutions_folder}', resource_id)
 
-    logging.info(f"index_line_annotations({resource_id})")
+def untanngle_sessions(session_files: List[str], resolution_files: List[str], resource_id: str,
+                       anchor_offset: int, logical_offset: int) -> (IndexedSegmentedText, List[str], List[Any], int):
+    """
+    Untanngle the given session files (and their resolution files) on their own, with their physical and logical
+    anchors starting at the given offsets, returning the text lines, paragraph texts, annotations and the number
+    of line ids in the resolutions that were not found in these sessions.
+    """
+    textlines, line_anchor_idx = traverse_session_file_list(session_files, resource_id, anchor_offset)
+    deduplicate_annotations(all_annotations, AnnTypes.SCAN)
+    deduplicate_annotations(all_annotations, AnnTypes.PAGE)
+    traverse_resolution_file_list(resolution_files, resource_id)
     index_line_annotations(resource_id)
+    num_errors = set_anchors_in_resolution_annotations()
+    paragraph_anchor_idx, paragraph_texts = index_paragraphs(line_anchor_idx, logical_offset)
+    add_attendant_annotations(resource_id, paragraph_anchor_idx)
+    annotations = add_region_links_and_logical_anchors(resource_id, StageTimer())
+    return textlines, paragraph_texts, annotations, num_errors
+
+
+def splice_annotations(annotations: List[Dict[str, Any]], session_annotations: List[Dict[str, Any]],
+                       begin_anchor: int, end_anchor: int) -> Optional[List[Dict[str, Any]]]:
+    """
+    Replace the annotations within the anchor range [begin_anchor, end_anchor) with the session_annotations.
+    Scans and pages extending beyond the range are kept, instead of their counterparts in session_annotations;
+    returns None when annotations of other types extend beyond the range.
+    """
+    last_anchor = end_anchor - 1
+    spliced = []
+    kept = set()
+    for a in annotations:
+        begin_inside = begin_anchor <= a['begin_anchor'] <= last_anchor
+        end_inside = begin_anchor <= a['end_anchor'] <= last_anchor
+        if begin_inside and end_inside:
+            continue
+        if begin_inside or end_inside or (a['begin_anchor'] < begin_anchor and a['end_anchor'] > last_anchor):
+            if a['type'] not in (AnnTypes.SCAN.value, AnnTypes.PAGE.value):
+                logging.warning(f"{a['type']} {a['id']} extends beyond anchor range [{begin_anchor},{end_anchor})")
+                return None
+            kept.add((a['type'], a['id']))
+        spliced.append(a)
+    spliced.extend(a for a in session_annotations if (a['type'], a['id']) not in kept)
+    return spliced
+
+
+def splice_changed_sessions(year: int, datadir: str, previous_datadir: str, digests: Dict[str, str],
+                            resource_id: str) -> bool:
+    """
+    Untanngle only the sessions whose session or resolution file differs from the previous run in previous_datadir,
+    and splice them into its text stores and annotation store.
+    Returns False, without writing anything, when that would shift the anchors of other sessions.
+    """
+    previous_manifest_path = f'{previous_datadir}/{manifest_name(year)}'
+    if not os.path.exists(previous_manifest_path):
+        logging.warning(f"no manifest found at {previous_manifest_path}")
+        return False
+    previous_manifest = read_json(previous_manifest_path)
+    if previous_manifest['code_digest'] != code_digest():
+        logging.warning(f"{previous_manifest_path} was made by a different version of this script or of untanngle")
+        return False
+    if not previous_manifest['spliceable']:
+        logging.warning(f"{previous_manifest_path}: sessions can't be spliced separately")
+        return False
+
+    session_files = get_session_files(f'{datadir}/sessions/')
+    resolution_file_for_session = {session_id_for_file(f): f for f in get_resolution_files(f'{datadir}/resolutions/')}
+    previous_sessions = previous_manifest['sessions']
+    session_ids = [session_id_for_file(f) for f in session_files]
+    if session_ids != [ps['session_id'] for ps in previous_sessions]:
+        logging.warning("sessions were added or removed since the previous run")
+        return False
+    if not resolution_file_for_session.keys() <= set(session_ids):
+        logging.warning("there are resolution files without a session file")
+        return False
+
+    text_store = read_json(f'{previous_datadir}/textstore-{year}.json')
+    logical_text_store = read_json(f'{previous_datadir}/logical-textstore-{year}.json')
+    annotations = read_json(f'{previous_datadir}/annotationstore-{year}.json')
+    sessions = []
+    for session_file, ps in zip(session_files, previous_sessions):
+        session_id = ps['session_id']
+        session = {**ps,
+                   'session_digest': digests.get(f'sessions/{session_id}.json'),
+                   'resolutions_digest': digests.get(f'resolutions/{session_id}-resolutions.json')}
+        sessions.append(session)
+        if session['session_digest'] == ps['session_digest'] and \
+                session['resolutions_digest'] == ps['resolutions_digest']:
+            continue
+
+        logging.info(f"re-untanngling changed session {session_id}")
+        reset_state()
+        resolution_files = [resolution_file_for_session[session_id]] if session_id in resolution_file_for_session \
+            else []
+        textlines, paragraph_texts, session_annotations, num_errors = untanngle_sessions(
+            [session_file], resolution_files, resource_id, ps['begin_anchor'], ps['logical_begin_anchor'])
+        if textlines.len() != ps['end_anchor'] - ps['begin_anchor']:
+            logging.warning(f"the number of lines in {session_id} changed")
+            return False
+        if len(paragraph_texts) != ps['logical_end_anchor'] - ps['logical_begin_anchor']:
+            logging.warning(f"the number of paragraphs in {session_id} changed")
+            return False
+        if num_errors > 0 or not resolutions_within_sessions():
+            logging.warning(f"the resolutions of {session_id} refer to lines outside of the session")
+            return False
+        annotations = splice_annotations(annotations, session_annotations, ps['begin_anchor'], ps['end_anchor'])
+        if annotations is None:
+            return False
+        text_store['_ordered_segments'][ps['begin_anchor']:ps['end_anchor']] = textlines._ordered_segments
+        logical_text_store['_ordered_segments'][ps['logical_begin_anchor']:ps['logical_end_anchor']] = paragraph_texts
+
+    # pages extending beyond a changed session may now enclose different text_regions
+    reset_state()
+    all_annotations.extend(annotations)
+    add_region_links_to_page_annotations(resource_id)
 
-    logging.info("sanity_check_line_id_occurrences()")
+    # the checks of a full run, on the spliced year
+    index_line_annotations(resource_id)
     sanity_check_line_id_occurrences()
-
-    logging.info("set_anchors_in_resolution_annotations()")
-    set_anchors_in_resolution_annotations()
-
-    logging.info(f"check_for_missing_attendance_lists_in_session_annotations({resource_id})")
     check_for_missing_attendance_lists_in_session_annotations(resource_id)
+    check_annotations(annotations)
 
-    paragraph_anchor_idx = extract_paragraph_text(datadir, year, line_anchor_idx)
-
-    logging.info(f"add_attendant_annotations({resource_id})")
-    add_attendant_annotations(resource_id, paragraph_anchor_idx)
+    logging.info(f"=> {datadir}/textstore-{year}.json")
+    with open(f'{datadir}/textstore-{year}.json', 'w', encoding='UTF8') as filehandle:
+        json.dump(text_store, filehandle, indent=4, ensure_ascii=False)
+    store_paragraph_text(logical_text_store['_ordered_segments'], f'{datadir}/logical-textstore-{year}.json')
+    store_annotations(annotations, f'{datadir}/annotationstore-{year}.json')
+    store_manifest({**previous_manifest, 'sessions': sessions}, f'{datadir}/{manifest_name(year)}')
+    return True
 
-    check_annotations(all_annotations)
 
+def add_region_links_and_logical_anchors(resource_id: str, timer: StageTimer) -> List[Dict[str, Any]]:
     logging.info(f"add_region_links_to_page_annotations({resource_id})")
-    add_region_links_to_page_annotations(resource_id)
+    with timer.stage("add_region_links_to_page_annotations"):
+        add_region_links_to_page_annotations(resource_id)
 
     logging.info(f"add_region_links_to_session_annotations({resource_id})")
-    add_region_links_to_session_annotations(resource_id)
+    with timer.stage("add_region_links_to_session_annotations"):
+        add_region_links_to_session_annotations(resource_id)
 
     logging.info(f"add_region_links_to_line_annotations({resource_id})")
-    add_region_links_to_line_annotations(resource_id)
+    with timer.stage("add_region_links_to_line_annotations") as stage:
+        add_region_links_to_line_annotations(resource_id)
+        stage.items = len(image_region_for_line_anchor)
 
     # with open(f"{datadir}/ut_annotations.json", "w") as f:
     #     json.dump(all_annotations, f, indent=2)
     logging.info(f"process_line_based_types()")
-    process_line_based_types()
+    with timer.stage("process_line_based_types"):
+        process_line_based_types()
 
     logging.info(f"add_region_links_to_text_region_annotations({resource_id})")
-    add_region_links_to_text_region_annotations(resource_id)
+    with timer.stage("add_region_links_to_text_region_annotations"):
+        add_region_links_to_text_region_annotations(resource_id)
 
     logging.info(f"fix_scan_annotations({resource_id})")
-    fix_scan_annotations(resource_id)
+    with timer.stage("fix_scan_annotations"):
+        fix_scan_annotations(resource_id)
 
     logging.info(f"add_logical_anchors()")
-    _annotations = add_logical_anchors(all_annotations)
+    with timer.stage("add_logical_anchors") as stage:
+        _annotations = add_logical_anchors(all_annotations)
+        stage.items = len(_annotations)
 
-    # logging.info("add_provenance()")
-    # add_provenance()
-
-    store_annotations(_annotations, f'{datadir}/{annotation_store}')
+    return _annotations
 
 
 def extract_paragraph_text(datadir, year, line_anchor_idx) -> Dict[str, int]:
-    paragraph_anchor_idx = {}
     logical_text_store = f'logical-textstore-{year}.json'
+    paragraph_anchor_idx, all_paragraph_texts = index_paragraphs(line_anchor_idx)
+    store_paragraph_text(all_paragraph_texts, f'{datadir}/{logical_text_store}')
+    return paragraph_anchor_idx
+
+
+def index_paragraphs(line_anchor_idx, logical_offset: int = 0) -> (Dict[str, int], List[str]):
+    paragraph_anchor_idx = {}
     all_paragraph_texts = []
     paragraph_annotations = [a for a in all_annotations if
                              a['type'] in [AnnTypes.RESOLUTION_REVIEW.value, AnnTypes.PARAGRAPH.value]]
     for pa in sorted(paragraph_annotations, key=lambda a: line_anchor_idx[a['line_ranges'][0]['line_id']]):
-        anchor = len(all_paragraph_texts)
+        anchor = logical_offset + len(all_paragraph_texts)
         paragraph_anchor_idx[pa['id']] = anchor
         pa['logical_begin_anchor'] = anchor
         pa['logical_end_anchor'] = anchor
@@ -760,15 +1105,19 @@ def extract_paragraph_text(datadir, year, line_anchor_idx) -> Dict[str, int]:
             logical_anchor_range_for_line_anchor[line_anchor] = LogicalAnchorRange(
                 begin_logical_anchor=anchor, begin_char_offset=start, end_logical_anchor=anchor, end_char_offset=end
             )
-    store_paragraph_text(all_paragraph_texts, f'{datadir}/{logical_text_store}')
-    return paragraph_anchor_idx
+    return paragraph_anchor_idx, all_paragraph_texts
 
 
 def traverse_session_files(sessions_folder, resource_id) -> (IndexedSegmentedText, dict[str, Any]):
+    return traverse_session_file_list(get_session_files(sessions_folder), resource_id)
+
+
+def traverse_session_file_list(session_files: List[str], resource_id: str,
+                               anchor_offset: int = 0) -> (IndexedSegmentedText, dict[str, Any]):
     line_anchor_idx = {}
     all_textlines = segmentedtext.IndexedSegmentedText(resource_id)
     # Process per file, properly concatenate results, maintaining proper referencing the baseline text elements
-    for f_name in get_session_files(sessions_folder):
+    for f_name in session_files:
         logging.info(f"<= {f_name}")
 
         source_data = get_root_tree_element(f_name)
@@ -780,9 +1129,11 @@ def traverse_session_files(sessions_folder, resource_id) -> (IndexedSegmentedTex
                  line_anchor_idx)
 
         # properly concatenate annotation info taking ongoing line indexes into account
+        begin_anchor = anchor_offset + all_textlines.len()
         for ai in annotation_array:
-            ai['begin_anchor'] += all_textlines.len()
-            ai['end_anchor'] += all_textlines.len()
+            ai['begin_anchor'] += begin_anchor
+            ai['end_anchor'] += begin_anchor
+        line_range_for_session[session_id_for_file(f_name)] = (begin_anchor, begin_anchor + text_array.len())
 
         all_textlines.extend(text_array)
         all_annotations.extend(annotation_array)
@@ -791,7 +1142,12 @@ def traverse_session_files(sessions_folder, resource_id) -> (IndexedSegmentedTex
 
 
 def traverse_resolution_files(resolutions_folder, resource_id):
-    for f_name in get_resolution_files(resolutions_folder):
+    traverse_resolution_file_list(get_resolution_files(resolutions_folder), resource_id)
+
+
+def traverse_resolution_file_list(resolution_files: List[str], resource_id: str):
+    for f_name in resolution_files:
+        begin = len(resolution_annotations)
         # get list of resolution 'hits'
         hits = get_res_root_element(f_name)
         for hit in hits:
@@ -799,6 +1155,13 @@ def traverse_resolution_files(resolutions_folder, resource_id):
             resolution = hit['_source']
             res_traverse(resolution, resource_id,
                          f"{resolution_es_index}/_doc/{resolution['id']}", )
+        resolution_range_for_session[session_id_for_file(f_name)] = (begin, len(resolution_annotations))
+
+
+def session_id_for_file(path: str) -> str:
+    # the harvested files are named <session_id>.json and <session_id>-resolutions.json
+    file_name = os.path.basename(path)
+    return file_name.removesuffix('.json').removesuffix('-resolutions')
 
 
 def sanity_check_line_id_occurrences():
@@ -837,6 +1200,7 @@ def set_anchors_in_resolution_annotations():
     if num_errors > 0:
         logging.error(f"number of lookup errors for line_indexes vs line_ids: {num_errors}")
     all_annotations.extend(resolution_annotations)
+    return num_errors
 
 
 def check_for_missing_attendance_lists_in_session_annotations(resource_id):
@@ -852,9 +1216,11 @@ def check_for_missing_attendance_lists_in_session_annotations(resource_id):
 
 def add_attendant_annotations(resource_id: str, paragraph_anchor: Dict[str, int]):
     attendant_annotations = []
+    paragraph_index = asearch.OverlapIndex(asearch.get_annotations_of_type('republic_paragraph', all_annotations))
     for al in asearch.get_annotations_of_type('attendance_list', all_annotations, resource_id):
         session_id = al['metadata']['session_id']
-        atts = create_attendants_for_attlist(al, session_id, resource_id, al['provenance_source'], paragraph_anchor)
+        atts = create_attendants_for_attlist(al, session_id, resource_id, al['provenance_source'], paragraph_anchor,
+                                             paragraph_index)
         attendant_annotations.extend(atts)
         # set_logical_text_offset(al, atts)
 
@@ -885,25 +1251,39 @@ def set_logical_text_offset(al, atts):
 def add_region_links_to_page_annotations(resource_id):
     # vraag alle page annotations op
     pg_annots = list(asearch.get_annotations_of_type('page', all_annotations, resource_id))
+    text_region_index = asearch.OverlapIndex(asearch.get_annotations_of_type('text_region', all_annotations))
     with alive_bar(len(pg_annots), title="Processing page annotations", spinner=None) as bar:
         for pa in pg_annots:
-            pa['region_links'] = calculate_region_links_for_page_annotation(pa, resource_id)
+            pa['region_links'] = calculate_region_links_for_page_annotation(pa, resource_id, text_region_index)
             bar()
 
 
-def calculate_region_links_for_page_annotation(pa, resource_id):
+def calculate_region_links_for_page_annotation(pa, resource_id, text_region_index: asearch.OverlapIndex):
     # per page, vraag alle overlappende text_regions op
-    overlapping_regions = list(
-        asearch.get_annotations_of_type_overlapping(
-            'text_region',
-            pa['begin_anchor'], pa['end_anchor'],
-            all_annotations, resource_id
-        )
-    )
-    # verzamel alle iiif_urls daarvan en unificeer die
-    urls = [tr['metadata']['iiif_url'] for tr in overlapping_regions]
-    bounding_url = union_of_iiif_urls(urls)
-    return [bounding_url]
+    overlapping_regions = text_region_index.get_annotations_overlapping_with(pa['begin_anchor'], pa['end_anchor'],
+                                                                             resource_id)
+    # verzamel de image regions daarvan en unificeer die
+    regions_with_suffix = [image_region_for_text_region_annotation(tr) for tr in overlapping_regions]
+    regions_with_suffix = [rs for rs in regions_with_suffix if rs is not None]
+    if not regions_with_suffix:
+        logger.error(f"no text_region iiif_urls found for page {pa['id']}")
+        return []
+    suffix = regions_with_suffix[0][1]
+    bounds = union_of_image_regions([region for region, _ in regions_with_suffix])
+    return [iiif_region_url(bounds, suffix)]
+
+
+def image_region_for_text_region_annotation(tr) -> Optional[Tuple[ImageRegion, str]]:
+    if tr['id'] not in image_region_for_text_region:
+        url = tr['metadata']['iiif_url']
+        parsed = parse_iiif_url(url)
+        if parsed.xywh is None:
+            logging.error(f"{url} doesn't match expected pattern, skipping")
+            return None
+        x, y, w, h = parsed.xywh
+        region = ImageRegion(image_url=parsed.image_url, left=x, top=y, right=x + w, bottom=y + h)
+        image_region_for_text_region[tr['id']] = (region, f"/{parsed.suffix}")
+    return image_region_for_text_region[tr['id']]
 
 
 def add_region_links_to_session_annotations(resource_id):
@@ -932,133 +1312,104 @@ def add_region_links_to_line_annotations(resource_id):
     with alive_bar(len(line_annots), title="Processing line annotations", spinner=None) as bar:
         # voeg iiif region_links toe aan alle line annotaties
         for line in line_annots:
-            line['region_links'] = calculate_region_links_for_line_annotation(line)
+            region = image_region_for_line_annotation(line)
+            image_region_for_line_anchor[line['begin_anchor']] = region
+            line['region_links'] = [iiif_region_url(region)]
             bar()
 
 
-def calculate_region_links_for_line_annotation(line):
-    coords = line['coords']
-    bb = get_bounding_box_for_coords(coords)
-    bb_str = f"{bb['left']},{bb['top']},{bb['width']},{bb['height']}"
+def image_region_for_line_annotation(line) -> ImageRegion:
+    bb = get_bounding_box_for_coords(line['coords'])
     scan_id = line['metadata']['scan_id']
     items = scan_id.split('_')
-    region_url = f"{iiif_base}{items[0]}_{items[1]}/{items[2]}/{scan_id}.jpg/{bb_str}{iiif_extension}"
-    return [region_url]
+    return ImageRegion(image_url=f"{iiif_base}{items[0]}_{items[1]}/{items[2]}/{scan_id}.jpg",
+                       left=bb['left'], top=bb['top'], right=bb['right'], bottom=bb['bottom'])
+
+
+def iiif_region_url(region: ImageRegion, suffix: str = iiif_extension) -> str:
+    bb_str = f"{region.left},{region.top},{region.right - region.left},{region.bottom - region.top}"
+    return f"{region.image_url}/{bb_str}{suffix}"
+
+
+# assume that the regions refer to the same image resource
+def union_of_image_regions(regions: Sequence[ImageRegion]) -> ImageRegion:
+    first = regions[0]
+    min_left, min_top, max_right, max_bottom = first.left, first.top, first.right, first.bottom
+    for region in regions[1:]:
+        if region.image_url != first.image_url:
+            logging.error(f"{iiif_region_url(region)} refers to other image than {first.image_url}")
+            break
+        min_left = min(min_left, region.left)
+        min_top = min(min_top, region.top)
+        max_right = max(max_right, region.right)
+        max_bottom = max(max_bottom, region.bottom)
+    return ImageRegion(image_url=first.image_url, left=min_left, top=min_top, right=max_right, bottom=max_bottom)
+
+
+class TextRegionLines:
+    """
+    The text_region annotations and the image regions of the lines, both ordered by anchor, to determine
+    for an annotation the bounding box of its lines per overlapping text_region with binary searches
+    instead of overlap queries over all annotations.
+    Text regions that are completely covered by an annotation have their bounding box computed only once.
+    """
+
+    def __init__(self, text_region_annotations, line_regions: Dict[int, ImageRegion]):
+        self.line_anchors = sorted(line_regions.keys())
+        self.line_regions = [line_regions[a] for a in self.line_anchors]
+        self.text_regions = sorted(text_region_annotations, key=lambda a: a['begin_anchor'])
+        self.text_region_begins = [tr['begin_anchor'] for tr in self.text_regions]
+        self.max_text_region_length = max(
+            (tr['end_anchor'] - tr['begin_anchor'] for tr in self.text_regions), default=0)
+        self.full_text_region_bounds = {}
+
+    def line_regions_between(self, begin_anchor: int, end_anchor: int) -> List[ImageRegion]:
+        lo = bisect_left(self.line_anchors, begin_anchor)
+        hi = bisect_right(self.line_anchors, end_anchor)
+        return self.line_regions[lo:hi]
+
+    def bounds_of_text_region(self, index: int) -> Optional[ImageRegion]:
+        if index not in self.full_text_region_bounds:
+            tr = self.text_regions[index]
+            regions = self.line_regions_between(tr['begin_anchor'], tr['end_anchor'])
+            self.full_text_region_bounds[index] = union_of_image_regions(regions) if regions else None
+        return self.full_text_region_bounds[index]
+
+    def region_links(self, ann) -> List[str]:
+        ann_region_links = []
+        begin_anchor = ann['begin_anchor']
+        end_anchor = ann['end_anchor']
+        lo = bisect_left(self.text_region_begins, begin_anchor - self.max_text_region_length)
+        hi = bisect_right(self.text_region_begins, end_anchor)
+        # bepaal bounding box voor met de annotatie overlappende lines, per text_region
+        for index in range(lo, hi):
+            tr = self.text_regions[index]
+            if tr['end_anchor'] < begin_anchor:
+                continue
+            if begin_anchor <= tr['begin_anchor'] and tr['end_anchor'] <= end_anchor:
+                bounds = self.bounds_of_text_region(index)
+            else:
+                regions = self.line_regions_between(max(begin_anchor, tr['begin_anchor']),
+                                                    min(end_anchor, tr['end_anchor']))
+                bounds = union_of_image_regions(regions) if regions else None
+            if bounds is None:
+                logger.error(f"no urls found for {tr['id']} {tr['begin_anchor']}:{tr['end_anchor']}")
+            else:
+                ann_region_links.append(iiif_region_url(bounds))
+        return ann_region_links
 
 
 def process_line_based_types():
     types = {at.value for at in line_based_types}
     relevant_annotations = [a for a in all_annotations if a['type'] in types]
     text_region_annotations = [a for a in all_annotations if a['type'] == 'text_region']
-    text_region_annotation_wrapper = AnnotationsWrapper(text_region_annotations)
-    line_annotations = [a for a in all_annotations if a['type'] == 'line']
-    line_annotation_wrapper = AnnotationsWrapper(line_annotations)
+    text_region_lines = TextRegionLines(text_region_annotations, image_region_for_line_anchor)
     with alive_bar(len(relevant_annotations), title="Processing line-based annotations", spinner=None) as bar:
         for annotation in relevant_annotations:
-            annotation['region_links'] = calculate_region_links(
-                annotation,
-                line_annotation_wrapper,
-                text_region_annotation_wrapper
-            )
+            annotation['region_links'] = text_region_lines.region_links(annotation)
             bar()
 
 
-def calculate_region_links(ann, line_annotation_wrapper, text_region_annotation_wrapper):
-    ann_region_links = []
-    # voor iedere resolutie, vraag overlappende regions
-    begin_anchor = ann['begin_anchor']
-    end_anchor = ann['end_anchor']
-    with_anchor_range = text_region_annotation_wrapper.get_annotations_overlapping_with_anchor_range(begin_anchor,
-                                                                                                     end_anchor)
-    overlapping_regions = sorted(
-        with_anchor_range,
-        key=lambda reg_ann: reg_ann['begin_anchor']
-    )
-    lines_in_annotation = line_annotation_wrapper.get_annotations_overlapping_with_anchor_range(begin_anchor,
-                                                                                                end_anchor)
-    # bepaal bounding box voor met RESOLUTION overlappende lines, per text_region
-    for tr in overlapping_regions:
-        line_ids_in_region = {
-            a["id"] for a in
-            line_annotation_wrapper.get_annotations_overlapping_with_anchor_range(tr['begin_anchor'], tr['end_anchor'])
-        }
-        lines_in_intersection = (line_a for line_a in lines_in_annotation if line_a["id"] in line_ids_in_region)
-
-        # determine iiif url region enclosing the line boxes, assume each line has only one url
-        urls = [line['region_links'][0] for line in lines_in_intersection]
-        if not urls:
-            logger.error(f"no urls found for {tr['id']} {tr['begin_anchor']}:{tr['end_anchor']}")
-            logger.info(f"line_ids_in_region={lines_in_intersection}")
-        else:
-            region_url = union_of_iiif_urls(urls)
-            ann_region_links.append(region_url)
-
-        # # generate output to report potential issues with layout of text_regions
-        # region_string = region_pattern.search(region_url)
-        # width = int(region_string.group(4))
-        # if width > 2000:
-        #     logging.warning(
-        #         f"annotation {ann}: potential error in layout, width of text_region {tr['id']} too large: {width}")
-    return ann_region_links
-
-
-def process_line_based_types0(resource_id):
-    for ann_type in line_based_types:
-        annots = asearch.get_annotations_of_type(ann_type.value, all_annotations, resource_id)
-        logging.info(f"Processing annotation type {ann_type}")
-        for num, ann in enumerate(annots):
-            ann_region_links = []
-
-            # voor iedere resolutie, vraag overlappende regions
-            overlapping_regions = sorted(
-                asearch.get_annotations_of_type_overlapping(
-                    'text_region',
-                    ann['begin_anchor'],
-                    ann['end_anchor'],
-                    all_annotations,
-                    resource_id
-                ),
-                key=lambda reg_ann: reg_ann['begin_anchor']
-            )
-
-            lines_in_annotation = list(
-                asearch.get_annotations_of_type_overlapping(
-                    'line',
-                    ann['begin_anchor'],
-                    ann['end_anchor'],
-                    all_annotations,
-                    resource_id
-                )
-            )
-
-            # bepaal bounding box voor met RESOLUTION overlappende lines, per text_region
-            for tr in overlapping_regions:
-                line_ids_in_region = set(
-                    [a["id"] for a in asearch.get_annotations_of_type_overlapping(
-                        'line',
-                        tr['begin_anchor'],
-                        tr['end_anchor'],
-                        all_annotations,
-                        resource_id
-                    )]
-                )
-
-                lines_in_intersection = [line for line in lines_in_annotation if line["id"] in line_ids_in_region]
-
-                # determine iiif url region enclosing the line boxes, assume each line has only one url
-                urls = [line['region_links'][0] for line in lines_in_intersection]
-                region_url = union_of_iiif_urls(urls)
-                ann_region_links.append(region_url)
-
-                # generate output to report potential issues with layout of text_regions
-                region_string = region_pattern.search(region_url)
-                width = int(region_string.group(4))
-                if width > 2000:
-                    logging.warning(
-                        f"annotation {ann}: potential error in layout, width of text_region {tr['id']} too large: {width}")
-                ann['region_links'] = ann_region_links
-
-
 def add_region_links_to_text_region_annotations(resource_id):
     region_annots = list(asearch.get_annotations_of_type('text_region', all_annotations, resource_id))
     for ra in region_annots:
@@ -1094,12 +1445,23 @@ def main():
                         help="The directory where to find the downloaded CAS files",
                         required=True,
                         type=str)
+    parser.add_argument("--start-stage",
+                        help="The stage to start at, using the checkpoint of the stage before it;"
+                             " 'auto' resumes after the last valid checkpoint and skips years with unchanged input",
+                        choices=['auto'] + untanngle_stages,
+                        default='auto',
+                        type=str)
+
+    parser.add_argument("-p", "--previous-data-dir",
+                        help="The data directory of a previous run, to only re-untanngle the sessions that changed"
+                             " since, when that doesn't shift the anchors of the other sessions",
+                        type=str)
 
     args = parser.parse_args()
     years = args.year
     data_dir = args.data_dir
     for year in sorted(years):
-        untanngle_year(year, data_dir)
+        untanngle_year(year, data_dir, args.start_stage, args.previous_data_dir)
     logging.info("done!")
     toc = time.perf_counter()
     duration = str(datetime.timedelta(seconds=(toc - tic)))
@@ -2,6 +2,7 @@
 
 import argparse
 import glob
+import os
 import subprocess
 from datetime import datetime
 from os.path import exists
@@ -12,9 +13,14 @@ from provenance.client import ProvenanceClient, ProvenanceData, ProvenanceHow, P
 from textrepo.client import TextRepoClient
 from uri import URI
 
-from untanngle.utils import trim_trailing_slash, add_segmented_text_type_if_missing, read_json, write_json
+from untanngle.checkpoints import file_digest
+from untanngle.utils import trim_trailing_slash, add_file_types_if_missing, read_json, write_json, \
+    TextRepoVersionCache
 
 version_id_idx_path = "out/version_id_idx.json"
+version_cache_path = "out/textrepo-versions.json"
+# written to the year dir when neither textstore of the year was uploaded again
+unchanged_marker = "textstores-unchanged"
 
 
 def get_session_files(sessions_folder: str) -> List[str]:
@@ -50,37 +56,57 @@ def store_provenance(textrepo_version_url: str,
     logger.info(f"provenance location: {provenance_id.location} / {str(provenance_id.location).replace('/prov/', '#')}")
 
 
-def upload(year: int, data_dir: str, trc: TextRepoClient, idx, prov_url: str, prov_key: str):
+def upload(year: int, data_dir: str, trc: TextRepoClient, idx, prov_url: str, prov_key: str,
+           version_cache: TextRepoVersionCache):
     # harvest_date = data_dir.split("/")[-1]
-    export_for_text_repo(data_dir, idx, "phys",
+    phys_unchanged = export_for_text_repo(data_dir, idx, "phys",
                          f"{data_dir}/{year}/" + "textstore" + f"-{year}.json",
                          prov_key, prov_url,
                          trc,
                          'segmented_text',
-                         year)
-    export_for_text_repo(data_dir, idx, "log",
+                         year,
+                         version_cache)
+    log_unchanged = export_for_text_repo(data_dir, idx, "log",
                          f"{data_dir}/{year}/" + "logical-textstore" + f"-{year}.json",
                          prov_key, prov_url,
                          trc,
                          'logical_segmented_text',
-                         year)
-
-
-def export_for_text_repo(data_dir, idx, phys_log, path, prov_key, prov_url, trc, type_name, year):
+                         year,
+                         version_cache)
+    # with both version ids unchanged, the pipeline can keep the web annotations converted using them
+    marker_path = f"{data_dir}/{year}/{unchanged_marker}"
+    if phys_unchanged and log_unchanged:
+        logger.info(f"textstores of {year} unchanged, => {marker_path}")
+        open(marker_path, 'w').close()
+    elif exists(marker_path):
+        os.remove(marker_path)
+
+
+def export_for_text_repo(data_dir, idx, phys_log, path, prov_key, prov_url, trc, type_name, year,
+                         version_cache: TextRepoVersionCache) -> bool:
+    """Upload the textstore unless it is unchanged since its previous upload, and return whether it was unchanged."""
     if exists(path):
-        logger.info(f"<= {path}")
-        with open(path) as f:
-            contents = f.read()
         external_id = f"volume-{year}"
-        version_id = trc.import_version(external_id=external_id,
-                                        type_name=type_name,
-                                        contents=contents,
-                                        allow_new_document=True,
-                                        as_latest_version=True)
-        if year not in idx:
-            idx[year] = {}
-        idx[year][phys_log] = version_id.version_id
-        write_json(idx)
+        digest = file_digest(path)
+        cached_version_id = version_cache.version_id(external_id, type_name, digest)
+        if cached_version_id and idx.get(str(year), {}).get(phys_log) == cached_version_id:
+            # the textstore is byte-identical to the latest upload, so the version id (and everything
+            # converted using it) stays valid
+            logger.info(f"{path} unchanged, keeping version {cached_version_id}")
+            return True
+        logger.info(f"<= {path}")
+        with open(path, 'rb') as f:
+            version_id = trc.import_version(external_id=external_id,
+                                            type_name=type_name,
+                                            contents=f,
+                                            allow_new_document=True,
+                                            as_latest_version=True)
+        version_cache.update(external_id, type_name, digest, version_id.version_id)
+        version_cache.save()
+        if str(year) not in idx:
+            idx[str(year)] = {}
+        idx[str(year)][phys_log] = version_id.version_id
+        write_json(idx, version_id_idx_path)
         logger.info(f"verify: {trc.base_uri}/view/versions/{version_id.version_id}/segments/index/0/39")
         store_provenance(textrepo_version_url=f"{trc.base_uri}/rest/versions/{version_id.version_id}",
                          session_files_path=f"{data_dir}/{year}/sessions",
@@ -89,6 +115,7 @@ def export_for_text_repo(data_dir, idx, phys_log, path, prov_key, prov_url, trc,
                          provenance_api_key=prov_key)
     else:
         logger.error(f"file not found: {path}")
+    return False
 
 
 def load_version_id_idx(version_id_idx_path: str):
@@ -139,12 +166,13 @@ def main():
     years = args.year
     data_dir = trim_trailing_slash(args.data_dir)
     version_id_idx = load_version_id_idx(version_id_idx_path)
+    version_cache = TextRepoVersionCache(version_cache_path)
     trc = TextRepoClient(args.textrepo_base_url, verbose=True)
-    add_segmented_text_type_if_missing(trc)
+    add_file_types_if_missing(trc, ['segmented_text', 'logical_segmented_text'])
     prov_url = args.provenance_base_url
     prov_key = args.provenance_api_key
     for year in sorted(years):
-        upload(year, data_dir, trc, version_id_idx, prov_url, prov_key)
+        upload(year, data_dir, trc, version_id_idx, prov_url, prov_key, version_cache)
     logger.info("done!")
 
 
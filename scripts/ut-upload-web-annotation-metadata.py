@@ -1,81 +1,106 @@
 #!/usr/bin/env python3
 import argparse
+import asyncio
 import json
+import os
 import random
-from time import sleep
 
 import requests
 from icecream import ic
 from loguru import logger
 
-from untanngle.utils import chunk_list
+from untanngle.utils import iter_chunks
 
 url = "https://switch.sd.di.huc.knaw.nl/textanno"
-chunk_size = 1_000_000
+max_chunk_size = 1_000_000
 
 
-def process(path: str):
+def process(path: str, max_concurrent_chunks: int):
     logger.debug(f"<= {path}")
     with open(path) as f:
         annotations = json.load(f)
 
-    chunked_annotations = chunk_list(annotations, chunk_size)
+    # sizing the chunks by their json encoding would encode every annotation twice, for a bound that is hardly ever hit
+    chunked_annotations = list(iter_chunks(annotations, max_chunk_size))
     noc = len(chunked_annotations)
     logger.debug(f"uploading {len(annotations)} annotations in {noc} chunk(s):")
-    for i, chunk in enumerate(chunked_annotations):
-        logger.debug(f"chunk {i + 1}/{noc}")
-        upload_and_save_ref(annotations, chunk, path)
+    metadata_map = asyncio.run(upload_chunks(chunked_annotations, max_concurrent_chunks))
+    add_metadata_urls(annotations, metadata_map)
+    store_annotations(annotations, path)
 
 
-def upload_and_save_ref(annotations, chunk, path):
+async def upload_chunks(chunked_annotations, max_concurrent_chunks: int) -> dict:
+    semaphore = asyncio.Semaphore(max_concurrent_chunks)
+    noc = len(chunked_annotations)
+
+    async def upload(i, chunk):
+        async with semaphore:
+            logger.debug(f"chunk {i + 1}/{noc}")
+            return await upload_and_get_metadata_urls(chunk)
+
+    metadata_maps = await asyncio.gather(*(upload(i, chunk) for i, chunk in enumerate(chunked_annotations)))
+    metadata_map = {}
+    for m in metadata_maps:
+        metadata_map.update(m)
+    return metadata_map
+
+
+async def upload_and_get_metadata_urls(chunk) -> dict:
     logger.debug(f"POST {url}")
-    response = requests.post(url=url, json=chunk)
-    # ic(response.request.headers)
-    # ic(response.headers)
+    response = await asyncio.to_thread(requests.post, url=url, json=chunk)
     if not response.status_code == 202:
         logger.error(f"response={response}")
         raise Exception(f"server returned error: {response.text}")
     status_url = response.headers["Location"]
-    ready = False
     retry_count = 0
-    while not ready:
-        sleep_time = calc_next_delay(retry_count)
+    while True:
         logger.debug(f"GET {status_url}")
-        status_response = requests.get(status_url, allow_redirects=False)
-        # logger.debug(f'<{status_response.status_code}>')
+        status_response = await asyncio.to_thread(requests.get, status_url, allow_redirects=False)
         match status_response.status_code:
             case 302:
-                ready = True
+                break
             case 200:
-                ready = False
-                sleep(sleep_time)
+                await asyncio.sleep(calc_next_delay(retry_count))
                 retry_count += 1
             case _:
                 ic(status_response)
-                raise Exception(f"unexpected response: {response.headers}")
+                raise Exception(f"unexpected response: {status_response.status_code} {status_response.headers}")
     result_location = status_response.headers["Location"]
     logger.debug(f"GET {result_location}")
-    result_response = requests.get(result_location)
-    if result_response.status_code == 200:
-        metadata_map = result_response.json()
-        for a in annotations:
-            body_id = a["body"]["id"]
-            if "metadata" in a["body"] and body_id in metadata_map:
-                a["body"]["metadata"]["rp:metadataUrl"] = metadata_map[body_id]
-        logger.debug(f"=> {path}")
-        with open(f"{path}", "w") as f:
-            json.dump(annotations, f)
-    else:
-        ic(chunk)
+    result_response = await asyncio.to_thread(requests.get, result_location)
+    if result_response.status_code != 200:
         ic(result_response, result_response.content)
-        exit(result_response.status_code)
+        raise Exception(f"GET {result_location} returned {result_response.status_code}")
+    return result_response.json()
+
 
+def add_metadata_urls(annotations, metadata_map: dict):
+    for a in annotations:
+        body_id = a["body"]["id"]
+        if "metadata" in a["body"] and body_id in metadata_map:
+            a["body"]["metadata"]["rp:metadataUrl"] = metadata_map[body_id]
 
-def calc_next_delay(retry_count):
+
+def store_annotations(annotations, path: str):
+    logger.debug(f"=> {path}")
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write("[")
+        for i, a in enumerate(annotations):
+            if i:
+                f.write(",")
+            f.write(json.dumps(a))
+        f.write("]")
+    os.replace(tmp_path, path)
+
+
+def calc_next_delay(retry_count: int) -> float:
     max_delay = 60.0
-    base_delay = 1
+    base_delay = 1.0
     factor = 2
-    return min(max_delay, random.uniform(base_delay * factor ^ retry_count, max_delay))
+    delay = min(max_delay, base_delay * factor ** retry_count)
+    # jitter, so concurrent pollers don't all hit the server at the same moment
+    return random.uniform(delay / 2, delay)
 
 
 def parse_args():
@@ -86,6 +111,10 @@ def parse_args():
     parser.add_argument(
         "inputfile", help="The json file with the web-annotations", type=str
     )
+    parser.add_argument(
+        "-c", "--concurrent-chunks", help="The maximum number of chunks to process concurrently", type=int,
+        default=4
+    )
     args = parser.parse_args()
     return args
 
@@ -93,7 +122,7 @@ def parse_args():
 @logger.catch
 def main():
     args = parse_args()
-    process(args.inputfile)
+    process(args.inputfile, args.concurrent_chunks)
 
 
 if __name__ == "__main__":
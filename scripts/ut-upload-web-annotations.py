@@ -45,27 +45,32 @@ def main():
                         "--overwrite-existing-container",
                         help="Add this argument to clear the container with the given container-id if one exists already.",
                         action='store_true')
+    parser.add_argument("-i",
+                        "--index",
+                        help="An extra index to create on the container, as field:type[,field:type...] "
+                             "(example: body.metadata.sessionDate:ascending). Can be repeated.",
+                        action='append',
+                        type=str,
+                        default=[],
+                        metavar="index_spec")
+    parser.add_argument("--no-bulk-load",
+                        help="Create the indexes and set read access before adding the annotations, "
+                             "instead of after (for adding annotations to a container in use).",
+                        action='store_true')
     args = parser.parse_args()
     annorepo_base_url = trim_trailing_slash(args.annorepo_base_url)
-    if args.container_label:
-        ar.upload(
-            annorepo_base_url,
-            args.container_id,
-            args.input,
-            args.container_label,
-            api_key=args.api_key,
-            overwrite_container=args.overwrite_existing_container,
-            show_progress=True
-        )
-    else:
-        ar.upload(
-            annorepo_base_url,
-            args.container_id,
-            args.input,
-            api_key=args.api_key,
-            overwrite_container=args.overwrite_existing_container,
-            show_progress=True
-        )
+    optional_args = {'container_label': args.container_label} if args.container_label else {}
+    ar.upload(
+        annorepo_base_url,
+        args.container_id,
+        args.input,
+        api_key=args.api_key,
+        overwrite_container=args.overwrite_existing_container,
+        show_progress=True,
+        bulk_load=not args.no_bulk_load,
+        index_specs=[ar.parse_index_spec(spec) for spec in args.index],
+        **optional_args
+    )
 
 
 if __name__ == '__main__':
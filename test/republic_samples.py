@@ -0,0 +1,200 @@
+"""Minimal, but complete, examples of the annotations in a Republic annotationstore, one per annotation type."""
+import copy
+
+scan_id = "NL-HaNA_1.01.02_3783_0285"
+iiif_base = f"https://iiif.globalise.huygens.knaw.nl/iiif/2/{scan_id}.jpg"
+page_id = f"{scan_id}-page-568"
+text_region_id = f"{page_id}-col-1-tr-1"
+line_id = f"{text_region_id}-line-4"
+line_coords = [[1500, 1000], [2200, 1000], [2200, 1050], [1500, 1050]]
+text_region_coords = [[1500, 900], [2300, 900], [2300, 1400], [1500, 1400]]
+
+_anchors = {
+    "begin_anchor": 10,
+    "end_anchor": 20,
+    "logical_begin_anchor": 5,
+    "logical_begin_char_offset": 0,
+    "logical_end_anchor": 7,
+    "logical_end_char_offset": 12,
+}
+_region_links = [
+    f"{iiif_base}/1500,900,800,500/full/0/default.jpg",
+    f"{iiif_base}/1500,1000,700,50/full/0/default.jpg",
+]
+
+_samples = {
+    "attendant": {
+        "id": "delegate-1", "type": "attendant", "resource_id": "resource-1", "provenance_source": "source-1",
+        "metadata": {"offset": 3, "end": 12, "class": "attendant", "pattern": "Van Essen", "delegate_id": 42,
+                     "delegate_name": "Van Essen", "delegate_score": 1},
+        "begin_anchor": 10, "begin_char_offset": 3, "end_anchor": 10, "end_char_offset": 12,
+        "logical_begin_anchor": 5, "logical_begin_char_offset": 3, "logical_end_anchor": 5,
+        "logical_end_char_offset": 12, "region_links": _region_links[1:],
+    },
+    "attendance_list": {
+        "id": "session-1705-01-02-num-1-attendance_list", "type": "attendance_list", "resource_id": "resource-1",
+        "inventory_id": "3760", "provenance_source": "source-1", **_anchors,
+        "metadata": {"id": "session-1705-01-02-num-1-attendance_list", "type": "attendance_list",
+                     "inventory_num": 3760, "source_id": "source-1", "session_date": "1705-01-02",
+                     "session_id": "session-1705-01-02-num-1", "session_num": 1, "session_year": 1705,
+                     "session_month": 1, "session_day": 2, "session_weekday": "Veneris", "text_page_num": [1],
+                     "page_num": [568], "index_timestamp": "2023-04-13T10:00:00", "code_commit": "abc123",
+                     "page_ids": [page_id]},
+        "attendance_spans": [{"offset": 3, "end": 12, "class": "attendant", "pattern": "Van Essen",
+                              "delegate_id": 42, "delegate_name": "Van Essen", "delegate_score": 1}],
+        "region_links": _region_links,
+    },
+    "column": {
+        "label": "column", "id": f"{page_id}-col-1", "provenance_source": "source-1", **_anchors,
+        "resource_id": "resource-1", "inventory_id": "3760",
+        "image_coords": {"left": 1500, "right": 2300, "top": 900, "bottom": 1400, "height": 500, "width": 800},
+        "image_range": [], "region_links": _region_links[:1],
+    },
+    "line": {
+        "id": line_id, "type": "line", "resource_id": "resource-1", "inventory_id": "3760",
+        "provenance_source": "source-1",
+        "metadata": {"type": "line", "parent_type": "text_region", "parent_id": text_region_id, "scan_id": scan_id,
+                     "page_id": page_id, "text_region_id": text_region_id, "column_id": f"{page_id}-col-1",
+                     "reading_order": {"index": "4"},
+                     "height": {"max": 60, "min": 40, "mean": 50, "median": 50}},
+        **_anchors,
+        "baseline": [[1500, 1040], [2200, 1040]], "coords": line_coords, "region_links": _region_links[1:],
+    },
+    "page": {
+        "id": page_id, "type": "page", "resource_id": "resource-1", **_anchors,
+        "metadata": {"page_id": page_id, "scan_id": scan_id},
+        "coords": text_region_coords, "region_links": _region_links[:1],
+    },
+    "republic_paragraph": {
+        "id": "paragraph-1", "type": "republic_paragraph", "resource_id": "resource-1", "inventory_id": "3760",
+        "provenance_source": "source-1", "begin_anchor": 10, "end_anchor": 20, "logical_begin_anchor": 5,
+        "logical_end_anchor": 7,
+        "metadata": {"id": "paragraph-1", "type": "republic_paragraph", "inventory_num": 3760,
+                     "source_id": "source-1", "text_page_num": [1], "page_num": [568], "start_offset": 0,
+                     "iiif_url": f"{iiif_base}/full/max/0/default.jpg", "doc_id": "doc-1", "lang": "nl",
+                     "paragraph_index": 0, "page_ids": [page_id]},
+        "line_ranges": [{"start": 0, "end": 12, "line_id": line_id, "page_num": 568, "text_page_num": 1}],
+        "text": "Van Essen.", "region_links": _region_links,
+    },
+    "resolution": {
+        "id": "resolution-1", "type": "resolution", "resource_id": "resource-1", "inventory_id": "3760",
+        "provenance_source": "source-1", **_anchors, "region_links": _region_links,
+        "metadata": {"type": "resolution", "proposition_type": "missive"},
+        "evidence": [{"type": "phrase_match", "phrase": "Ontfangen", "variant": "Ontfangen", "string": "Ontfangen",
+                      "offset": 0, "label": "proposition_opening", "ignorecase": True, "text_id": "paragraph-1",
+                      "match_scores": {"char_match": 1.0, "ngram_match": 1.0, "levenshtein_similarity": 1.0}}],
+    },
+    "reviewed": {
+        "id": "reviewed-1", "type": "reviewed", "resource_id": "resource-1", "inventory_id": "3760",
+        "provenance_source": "source-1", **_anchors,
+        "metadata": {"type": "reviewed", "inventory_num": 3760, "source_id": "source-1", "text_page_num": [1],
+                     "page_num": [568], "start_offset": 0, "iiif_url": f"{iiif_base}/full/max/0/default.jpg",
+                     "doc_id": "doc-1", "lang": "nl", "paragraph_index": 0, "page_ids": [page_id]},
+        "line_ranges": [{"start": 0, "end": 12, "line_id": line_id, "page_num": 568}],
+        "text": "Van Essen.", "region_links": _region_links,
+    },
+    "scan": {
+        "id": scan_id, "type": "scan", "resource_id": "resource-1", "iiif_url": f"{iiif_base}/full/max/0/default.jpg",
+        **_anchors, "metadata": {"volume": "NL-HaNA_1.01.02_3783", "opening": 285}, "region_links": [],
+    },
+    "session": {
+        "id": "session-1705-01-02-num-1", "type": "session", "resource_id": "resource-1", "inventory_id": "3760",
+        **_anchors,
+        "evidence": [],
+        "metadata": {"id": "session-1705-01-02-num-1", "type": "session", "date_shift_status": "quarantined",
+                     "has_session_date_element": True, "index_timestamp": "2023-04-13T10:00:00",
+                     "inventory_num": 3760, "inventory_id": "3760", "is_workday": True,
+                     "lines_include_rest_day": False, "resolution_ids": ["resolution-1"],
+                     "session_date": "1705-01-02", "session_day": 2, "session_month": 1, "session_num": 1,
+                     "session_weekday": "Veneris", "session_year": 1705, "text_page_num": [1], "page_ids": [page_id],
+                     "code_commit": "abc123", "president": "Van Essen"},
+        "provenance_source": "source-1", "region_links": _region_links,
+    },
+    "text_region": {
+        "id": text_region_id, "type": "text_region", "resource_id": "resource-1", "inventory_id": "3760",
+        "provenance_source": "source-1",
+        "metadata": {"type": ["main", "resolution"], "parent_type": "page", "parent_id": page_id,
+                     "scan_id": scan_id, "page_id": page_id, "iiif_url": f"{iiif_base}/full/max/0/default.jpg",
+                     "page_num": 568, "reading_order": {"index": "1"}, "structure": {"type": "resolution"}},
+        **_anchors, "coords": text_region_coords, "region_links": _region_links[:1],
+    },
+}
+
+annotation_types = list(_samples.keys())
+
+
+def sample_annotation(annotation_type: str) -> dict:
+    return copy.deepcopy(_samples[annotation_type])
+
+
+def canvas_index() -> dict:
+    return {f"{iiif_base}": f"https://example.org/canvas/{scan_id}"}
+
+
+def caf_session(day: int, line_texts: list) -> dict:
+    """
+    A harvested session file of the session on the given day of january 1705, on a page of its own, with a
+    text_region per list of line texts.
+    """
+    session_id = f"session-1705-01-{day:02d}-num-1"
+    day_scan_id = f"NL-HaNA_1.01.02_3783_{day:04d}"
+    day_page_id = f"{day_scan_id}-page-{2 * day}"
+    text_regions = []
+    for tr_index, texts in enumerate(line_texts):
+        tr_id = f"{day_page_id}-col-1-tr-{tr_index}"
+        top = 100 + 400 * tr_index
+        lines = []
+        for line_index, text in enumerate(texts):
+            line_top = top + 40 * line_index
+            lines.append({"id": f"{tr_id}-line-{line_index}",
+                          "metadata": {"scan_id": day_scan_id, "page_id": day_page_id},
+                          "baseline": [[100, line_top + 30], [900, line_top + 30]],
+                          "coords": [[100, line_top], [900, line_top], [900, line_top + 30], [100, line_top + 30]],
+                          "text": text})
+        text_regions.append({
+            "id": tr_id,
+            "metadata": {"scan_id": day_scan_id, "page_id": day_page_id,
+                         "iiif_url": f"https://images.diginfra.net/iiif/NL-HaNA_1.01.02/3783/{day_scan_id}.jpg/"
+                                     f"100,{top},800,{40 * len(texts)}/max/0/default.jpg"},
+            "coords": [[100, top], [900, top], [900, top + 40 * len(texts)], [100, top + 40 * len(texts)]],
+            "lines": lines})
+    return {"_source": {"id": session_id,
+                        "metadata": {"session_id": session_id, "page_ids": [day_page_id]},
+                        "evidence": [],
+                        "text_regions": text_regions}}
+
+
+def caf_resolutions(session: dict, paragraph_lines: list) -> dict:
+    """
+    A harvested resolutions file for a caf_session, with an attendance_list of the first paragraph, naming the
+    president in its first line, and a resolution with the other paragraphs. Every paragraph is given as the
+    list of (text_region index, line index) of its lines.
+    """
+    source = session["_source"]
+    lines = {(tr_index, line_index): line
+             for tr_index, tr in enumerate(source["text_regions"])
+             for line_index, line in enumerate(tr["lines"])}
+    metadata = {"session_id": source["id"], "page_ids": source["metadata"]["page_ids"]}
+
+    def paragraph(index: int, line_keys: list) -> dict:
+        line_ranges = []
+        texts = []
+        start = 0
+        for key in line_keys:
+            line = lines[key]
+            line_ranges.append({"line_id": line["id"], "start": start, "end": start + len(line["text"])})
+            texts.append(line["text"])
+            start += len(line["text"]) + 1
+        return {"id": f"{source['id']}-para-{index}", "type": ["republic_paragraph"], "metadata": metadata,
+                "line_ranges": line_ranges, "text": " ".join(texts)}
+
+    paragraphs = [paragraph(i, keys) for i, keys in enumerate(paragraph_lines)]
+    president = lines[paragraph_lines[0][0]]["text"]
+    attendance_list = {"id": f"{source['id']}-attendance_list", "type": ["attendance_list"], "metadata": metadata,
+                       "paragraphs": paragraphs[:1],
+                       "attendance_spans": [{"offset": 0, "end": len(president), "class": "president",
+                                             "pattern": president, "delegate_id": 42,
+                                             "delegate_name": president, "delegate_score": 1}]}
+    resolution = {"id": f"{source['id']}-resolution-1", "type": ["resolution"], "metadata": metadata,
+                  "evidence": [], "paragraphs": paragraphs[1:]}
+    return {"hits": {"hits": [{"_source": attendance_list}, {"_source": resolution}]}}
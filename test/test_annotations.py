@@ -1,7 +1,8 @@
 from unittest import TestCase
 
 from annotations import recursively_get_jsonld_fields
-from untanngle.annotations import force_iri_values, is_iri, resource_target, selection_view_target
+from untanngle.annotations import InventoryBoundsAggregator, force_iri_values, is_iri, parse_iiif_url, \
+    resource_target, selection_view_target
 
 
 class Test(TestCase):
@@ -9,6 +10,45 @@ class Test(TestCase):
         self.assertEqual(is_iri("urn:bla"), True)
         self.assertEqual(is_iri("bla"), False)
         self.assertEqual(is_iri("http://example.com/id"), True)
+        self.assertEqual(is_iri("NL-HaNA_1.01.02_3783_0285"), False)
+        self.assertEqual(is_iri("3783:0285"), False)
+        self.assertEqual(is_iri("urn:republic:not an iri"), False)
+
+    def test_parse_iiif_url(self):
+        url = "https://iiif.example.org/iiif/2/NL-HaNA_1.01.02_3783_0285.jpg/1500,900,800,500/full/0/default.jpg"
+        parsed = parse_iiif_url(url)
+        self.assertEqual(parsed.base, "https://iiif.example.org/iiif/2/NL-HaNA_1.01.02_3783_0285.jpg")
+        self.assertEqual(parsed.region, "1500,900,800,500")
+        self.assertEqual(parsed.suffix, "full/0/default.jpg")
+        self.assertEqual(parsed.image_url, "https://iiif.example.org/iiif/2/NL-HaNA_1.01.02_3783_0285.jpg")
+        self.assertEqual(parsed.xywh, (1500, 900, 800, 500))
+        self.assertEqual(parsed.full_region_url,
+                         "https://iiif.example.org/iiif/2/NL-HaNA_1.01.02_3783_0285.jpg/full/full/0/default.jpg")
+
+    def test_parse_iiif_url_without_xywh_region(self):
+        url = "https://iiif.example.org/iiif/2/NL-HaNA_1.01.02_3783_0285.jpg/full/max/0/default.jpg"
+        parsed = parse_iiif_url(url)
+        self.assertEqual(parsed.region, "full")
+        self.assertIsNone(parsed.xywh)
+        self.assertFalse(parsed.has_xywh_region)
+        self.assertEqual(parsed.full_region_url, url)
+
+    def test_inventory_bounds_aggregator(self):
+        aggregator = InventoryBoundsAggregator()
+        aggregator.add_all([
+            {"inventory_id": "3760", "begin_anchor": 5, "end_anchor": 10, "logical_end_anchor": 3},
+            {"inventory_id": "3761", "begin_anchor": 11, "end_anchor": 20},
+            {"inventory_id": "3760", "begin_anchor": 2, "end_anchor": 8},
+            {"begin_anchor": 0, "end_anchor": 100, "logical_end_anchor": 80},
+            {"inventory_id": "3761", "begin_anchor": 12, "end_anchor": 30, "logical_end_anchor": 25},
+        ])
+        self.assertEqual({"3760", "3761"}, set(aggregator.bounds.keys()))
+        bounds_3760 = aggregator.bounds["3760"]
+        self.assertEqual((2, 10, 3),
+                         (bounds_3760.begin_anchor, bounds_3760.end_anchor, bounds_3760.logical_end_anchor))
+        bounds_3761 = aggregator.bounds["3761"]
+        self.assertEqual((11, 30, 25),
+                         (bounds_3761.begin_anchor, bounds_3761.end_anchor, bounds_3761.logical_end_anchor))
 
     def test_force_iri_values(self):
         dict_in = {
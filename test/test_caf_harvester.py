@@ -0,0 +1,176 @@
+import json
+import os
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import TestCase
+
+from untanngle.caf_harvester import CAFHarvester
+from untanngle.utils import read_json
+
+
+class MockElasticsearch:
+    """In-memory stand-in for the parts of the Elasticsearch search api used by the CAFHarvester."""
+
+    def __init__(self, indexes, support_pit=True):
+        self.indexes = indexes
+        self.support_pit = support_pit
+        self.pits = {}
+        self.search_requests = 0
+
+    def matches(self, doc, query):
+        if "bool" in query:
+            return all(self.matches(doc, q) for q in query["bool"]["filter"])
+        if "term" in query:
+            (path, value), = query["term"].items()
+            return str(self.value(doc, path)) == str(value)
+        if "range" in query:
+            (path, bounds), = query["range"].items()
+            value = self.value(doc, path)
+            if "gt" in bounds and not value > bounds["gt"]:
+                return False
+            return bounds.get("gte", value) <= value <= bounds.get("lte", value)
+        return True
+
+    @staticmethod
+    def value(doc, path):
+        for key in path.split("."):
+            doc = doc[key]
+        return doc
+
+    def sort_key(self, hit, sort):
+        key = []
+        for s in sort:
+            (path, _), = s.items()
+            key.append(hit["_id"] if path == "_id" else self.value(hit["_source"], path))
+        return key
+
+    def search(self, index, body):
+        self.search_requests += 1
+        if "pit" in body:
+            index = self.pits[body["pit"]["id"]]
+        sort = body["sort"] + ([] if "pit" not in body else [{"_id": "asc"}])
+        hits = [{"_id": doc["id"], "_source": doc} for doc in self.indexes[index] if self.matches(doc, body["query"])]
+        for hit in hits:
+            hit["sort"] = self.sort_key(hit, sort)
+        hits.sort(key=lambda h: h["sort"])
+        if "search_after" in body:
+            hits = [h for h in hits if h["sort"] > body["search_after"]]
+        result = {"hits": {"hits": hits[:body["size"]]}}
+        if "pit" in body:
+            result["pit_id"] = body["pit"]["id"]
+        return result
+
+
+class MockElasticsearchHandler(BaseHTTPRequestHandler):
+    es: MockElasticsearch = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def body(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length)) if length else {}
+
+    def respond(self, status, data):
+        payload = json.dumps(data).encode("utf8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        path = self.path.split("?")[0].strip("/").split("/")
+        if path[-1] == "_pit":
+            if not self.es.support_pit:
+                return self.respond(400, {"error": "no pit"})
+            pit_id = f"pit-{len(self.es.pits)}"
+            self.es.pits[pit_id] = path[0]
+            return self.respond(200, {"id": pit_id})
+        index = path[0] if len(path) > 1 else None
+        return self.respond(200, self.es.search(index, self.body()))
+
+    def do_DELETE(self):
+        self.es.pits.pop(self.body()["id"])
+        self.respond(200, {"succeeded": True})
+
+
+def session(num, date, index_timestamp="2023-04-13T10:00:00"):
+    return {"id": f"session-{date}-num-{num}", "metadata": {"session_date": date, "session_year": int(date[:4]),
+                                                            "index_timestamp": index_timestamp}}
+
+
+def resolution(num, date, index_timestamp="2023-04-13T10:00:00"):
+    return {"id": f"resolution-{date}-{num}", "metadata": {"session_date": date, "index_timestamp": index_timestamp}}
+
+
+class TestCAFHarvester(TestCase):
+    def setUp(self):
+        dates = [f"1705-{month:02d}-{day:02d}" for month in (1, 2, 3) for day in (3, 4, 17)]
+        sessions = [session(1, d) for d in dates] + [session(1, "1706-01-03")]
+        resolutions = [resolution(n, d) for d in dates[:-1] for n in range(7)] + [resolution(1, "1706-01-03")]
+        self.es = MockElasticsearch({"session_metadata": sessions, "full_resolutions": resolutions})
+        handler = type("Handler", (MockElasticsearchHandler,), {"es": self.es})
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.es_url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmp_dir.cleanup()
+
+    def harvest(self, **kwargs):
+        harvester = CAFHarvester(es_url=self.es_url, page_size=4, workers=3, **kwargs)
+        harvester.harvest_year("1705", self.tmp_dir.name)
+        sessions_dir = f"{self.tmp_dir.name}/sessions"
+        resolutions_dir = f"{self.tmp_dir.name}/resolutions"
+        return sorted(os.listdir(sessions_dir)), {
+            f: read_json(f"{resolutions_dir}/{f}") for f in os.listdir(resolutions_dir)
+        }
+
+    def test_harvest_year_pages_through_all_results(self):
+        session_files, resolution_files = self.harvest()
+        self.assertEqual(9, len(session_files))
+        self.assertEqual("session-1705-01-03-num-1.json", session_files[0])
+        # the last session has no resolutions
+        self.assertEqual(8, len(resolution_files))
+        resolutions = resolution_files["session-1705-02-04-num-1-resolutions.json"]
+        self.assertEqual([f"resolution-1705-02-04-{n}" for n in range(7)], sorted(r["id"] for r in resolutions))
+        self.assertEqual({}, self.es.pits)
+
+    def test_harvest_year_without_point_in_time(self):
+        self.es.support_pit = False
+        session_files, resolution_files = self.harvest()
+        self.assertEqual(9, len(session_files))
+        self.assertEqual(7, len(resolution_files["session-1705-03-04-num-1-resolutions.json"]))
+
+    def test_output_is_compact(self):
+        self.harvest()
+        with open(f"{self.tmp_dir.name}/sessions/session-1705-01-03-num-1.json") as f:
+            content = f.read()
+        self.assertNotIn("\n", content)
+        self.assertNotIn(", ", content)
+
+    def test_incremental_harvest_only_rewrites_changed_sessions(self):
+        harvester = CAFHarvester(es_url=self.es_url, page_size=4, workers=3)
+        state = harvester.harvest_year_incrementally("1705", self.tmp_dir.name, {})
+        self.assertEqual("2023-04-13T10:00:00", state["resolutions_indexed_since"])
+        self.assertEqual(9, len(state["session_dates"]))
+        for sub_dir in ("sessions", "resolutions"):
+            for f in os.listdir(f"{self.tmp_dir.name}/{sub_dir}"):
+                os.remove(f"{self.tmp_dir.name}/{sub_dir}/{f}")
+
+        self.es.indexes["full_resolutions"].append(resolution(8, "1705-02-17", "2023-05-01T09:00:00"))
+        self.es.indexes["session_metadata"].append(session(2, "1705-03-17", "2023-05-02T09:00:00"))
+        state = harvester.harvest_year_incrementally("1705", self.tmp_dir.name, state)
+
+        self.assertEqual("2023-05-02T09:00:00", state["sessions_indexed_since"])
+        self.assertEqual("2023-05-01T09:00:00", state["resolutions_indexed_since"])
+        self.assertEqual(["session-1705-03-17-num-2.json"], os.listdir(f"{self.tmp_dir.name}/sessions"))
+        resolution_files = sorted(os.listdir(f"{self.tmp_dir.name}/resolutions"))
+        self.assertEqual(["session-1705-02-17-num-1-resolutions.json"], resolution_files)
+        with open(f"{self.tmp_dir.name}/resolutions/{resolution_files[0]}") as f:
+            self.assertEqual(8, len(json.load(f)))
@@ -0,0 +1,59 @@
+import os
+import tempfile
+from unittest import TestCase
+
+import untanngle.checkpoints
+from untanngle.checkpoints import CheckpointStore, file_digests, fingerprint, module_digests
+
+
+class TestCheckpoints(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.dir = self.tmp_dir.name
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write(self, name: str, content: str) -> str:
+        path = f"{self.dir}/{name}"
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def test_fingerprint_changes_with_content(self):
+        a = self.write("a.json", "[1]")
+        b = self.write("b.json", "[2]")
+        digests = file_digests([b, a], self.dir)
+        self.assertEqual(["a.json", "b.json"], list(digests.keys()))
+        fp1 = fingerprint(digests, "v1")
+        self.assertEqual(fp1, fingerprint(file_digests([a, b], self.dir), "v1"))
+        self.assertNotEqual(fp1, fingerprint(digests, "v2"))
+        self.write("b.json", "[3]")
+        self.assertNotEqual(fp1, fingerprint(file_digests([a, b], self.dir), "v1"))
+
+    def test_checkpoint_is_only_valid_for_same_fingerprint(self):
+        checkpoint_dir = f"{self.dir}/checkpoints"
+        store = CheckpointStore(checkpoint_dir, "fp-1")
+        shared = {"id": "a-1"}
+        store.save("first", {"all": [shared], "some": [shared]})
+        self.assertTrue(store.is_valid("first"))
+        self.assertFalse(store.is_valid("second"))
+        self.assertEqual("first", store.latest_valid(["first", "second"]))
+
+        state = store.load("first")
+        self.assertIs(state["all"][0], state["some"][0])
+
+        other_store = CheckpointStore(checkpoint_dir, "fp-2")
+        self.assertFalse(other_store.is_valid("first"))
+        self.assertIsNone(other_store.latest_valid(["first", "second"]))
+        with self.assertRaises(ValueError):
+            other_store.load("first")
+        self.assertFalse(os.path.exists(f"{store.path('first')}.tmp"))
+
+    def test_module_digests(self):
+        digests = module_digests('untanngle')
+        self.assertIn('untanngle.checkpoints', digests)
+        self.assertEqual(file_digests([untanngle.checkpoints.__file__])[untanngle.checkpoints.__file__],
+                         digests['untanngle.checkpoints'])
+        self.assertEqual(sorted(digests), list(digests))
+        self.assertEqual({}, module_digests('no_such_package'))
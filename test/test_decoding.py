@@ -0,0 +1,51 @@
+from unittest import TestCase
+
+from dataclasses_json.undefined import UndefinedParameterError
+
+from untanngle.annotations import AttendantAnnotation, AttendantsListAnnotation, ColumnAnnotation, \
+    LineAnnotation, PageAnnotation, RepublicParagraphAnnotation, ResolutionAnnotation, ReviewedAnnotation, \
+    ScanAnnotation, SessionAnnotation, TextRegionAnnotation
+from untanngle.decoding import decode
+from test.republic_samples import sample_annotation
+
+annotation_classes = dict(
+    attendant=AttendantAnnotation,
+    attendance_list=AttendantsListAnnotation,
+    column=ColumnAnnotation,
+    line=LineAnnotation,
+    page=PageAnnotation,
+    republic_paragraph=RepublicParagraphAnnotation,
+    resolution=ResolutionAnnotation,
+    reviewed=ReviewedAnnotation,
+    scan=ScanAnnotation,
+    session=SessionAnnotation,
+    text_region=TextRegionAnnotation
+)
+
+
+class Test(TestCase):
+    def test_decode_is_equivalent_to_from_dict(self):
+        for a_type, a_class in annotation_classes.items():
+            with self.subTest(a_type):
+                expected = a_class.from_dict(sample_annotation(a_type))
+                decoded = decode(a_class, sample_annotation(a_type))
+                self.assertEqual(expected, decoded)
+                self.assertEqual(expected.to_dict(), decoded.to_dict())
+
+    def test_decode_raises_on_undefined_fields(self):
+        annotation = sample_annotation("line")
+        annotation["unexpected"] = 1
+        with self.assertRaises(UndefinedParameterError):
+            decode(LineAnnotation, annotation)
+
+    def test_decode_raises_on_undefined_nested_fields(self):
+        annotation = sample_annotation("line")
+        annotation["metadata"]["reading_order"]["unexpected"] = 1
+        with self.assertRaises(UndefinedParameterError):
+            decode(LineAnnotation, annotation)
+
+    def test_decode_raises_on_missing_fields(self):
+        annotation = sample_annotation("line")
+        annotation.pop("coords")
+        with self.assertRaises(KeyError):
+            decode(LineAnnotation, annotation)
@@ -0,0 +1,118 @@
+import json
+import os
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import TestCase
+
+from untanngle.elucidate_export import ElucidateExporter, AcknowledgedIndexes
+
+
+class StubElucidate:
+    """In-memory stand-in for the container and annotation creation of the Elucidate w3c api."""
+
+    def __init__(self):
+        self.containers = set()
+        self.annotations = {}
+        self.posts = 0
+        self.fail_after = None
+        self.lock = threading.Lock()
+
+
+class StubElucidateHandler(BaseHTTPRequestHandler):
+    elucidate: StubElucidate = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def respond(self, status, data=None, headers=None):
+        payload = json.dumps(data or {}).encode("utf8")
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        container = self.path.strip("/").split("/")[-1]
+        return self.respond(200 if container in self.elucidate.containers else 404)
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        slug = self.headers["Slug"]
+        # /annotation/w3c/ or /annotation/w3c/{container}/
+        path = self.path.strip("/").split("/")[1:]
+        with self.elucidate.lock:
+            if len(path) == 1:
+                self.elucidate.containers.add(slug)
+                return self.respond(201)
+            self.elucidate.posts += 1
+            if self.elucidate.fail_after is not None and self.elucidate.posts > self.elucidate.fail_after:
+                return self.respond(500)
+            key = (path[1], slug)
+            if key in self.elucidate.annotations:
+                return self.respond(409)
+            self.elucidate.annotations[key] = body
+        return self.respond(201, body, {"Location": f"http://localhost/{path[1]}/{slug}", "ETag": 'W/"1"'})
+
+
+class TestElucidateExporter(TestCase):
+    def setUp(self):
+        self.elucidate = StubElucidate()
+        handler = type("Handler", (StubElucidateHandler,), {"elucidate": self.elucidate})
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.exporter = ElucidateExporter(base_url=f"http://127.0.0.1:{self.server.server_address[1]}/annotation",
+                                          container_name="test", workers=4,
+                                          checkpoint_path=f"{self.tmp_dir.name}/last_uploaded.json",
+                                          checkpoint_every=5)
+        self.web_annotations = [{"@context": "http://www.w3.org/ns/anno.jsonld", "id": f"urn:test:{i}",
+                                 "type": "Annotation", "body": {"n": i}, "target": "urn:target"}
+                                for i in range(50)]
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmp_dir.cleanup()
+
+    def uploaded_bodies(self):
+        return sorted(a["body"]["n"] for a in self.elucidate.annotations.values())
+
+    def test_export(self):
+        self.assertEqual(50, self.exporter.export(self.web_annotations))
+        self.assertEqual({"test"}, self.elucidate.containers)
+        self.assertEqual(list(range(50)), self.uploaded_bodies())
+        self.assertNotIn("id", next(iter(self.elucidate.annotations.values())))
+        self.assertFalse(os.path.exists(self.exporter.checkpoint_path))
+
+    def test_resume_after_failure_uploads_every_annotation_once(self):
+        self.elucidate.fail_after = 23
+        with self.assertRaises(Exception):
+            self.exporter.export(self.web_annotations)
+        with open(self.exporter.checkpoint_path) as f:
+            checkpoint = AcknowledgedIndexes.from_checkpoint(json.load(f))
+        self.assertEqual(23, len(checkpoint))
+
+        # forget part of the progress, as if the process died before its last checkpoint
+        self.exporter.write_checkpoint(AcknowledgedIndexes(10))
+        self.elucidate.fail_after = None
+        self.exporter.export(self.web_annotations)
+        self.assertEqual(list(range(50)), self.uploaded_bodies())
+
+    def test_resume_from_old_checkpoint_format(self):
+        with open(self.exporter.checkpoint_path, "w") as f:
+            json.dump(39, f)
+        self.assertEqual(10, self.exporter.export(self.web_annotations))
+        self.assertEqual(list(range(40, 50)), self.uploaded_bodies())
+
+    def test_acknowledged_indexes(self):
+        acknowledged = AcknowledgedIndexes()
+        for i in (2, 0, 3, 5):
+            acknowledged.add(i)
+        self.assertEqual({"watermark": 1, "above_watermark": [2, 3, 5]}, acknowledged.to_dict())
+        acknowledged.add(1)
+        self.assertEqual({"watermark": 4, "above_watermark": [5]}, acknowledged.to_dict())
+        self.assertIn(5, acknowledged)
+        self.assertNotIn(4, acknowledged)
@@ -0,0 +1,59 @@
+import json
+import os
+import pstats
+import tempfile
+from unittest import TestCase
+
+from untanngle.instrumentation import StageTimer, profiling
+
+
+class TestStageTimer(TestCase):
+    def test_stages_are_recorded_in_order(self):
+        timer = StageTimer(metadata={"year": 1705})
+        with timer.stage("first") as stage:
+            stage.items = len([x * x for x in range(10000)])
+        with timer.stage("second"):
+            pass
+        report = timer.report()
+        self.assertEqual(1705, report["year"])
+        self.assertEqual(["first", "second"], [s["name"] for s in report["stages"]])
+        self.assertEqual(10000, report["stages"][0]["items"])
+        self.assertIsNone(report["stages"][1]["items"])
+        self.assertGreaterEqual(report["stages"][0]["wall_time"], 0.0)
+        self.assertGreaterEqual(report["stages"][0]["peak_rss_delta_kb"], 0)
+
+    def test_failing_stage_is_recorded(self):
+        timer = StageTimer()
+        with self.assertRaises(ValueError):
+            with timer.stage("failing"):
+                raise ValueError("oops")
+        self.assertEqual(["failing"], [s.name for s in timer.stages])
+
+    def test_write_report(self):
+        timer = StageTimer()
+        with timer.stage("only"):
+            pass
+        with tempfile.NamedTemporaryFile(suffix=".json") as f:
+            timer.write_report(f.name)
+            with open(f.name) as report_file:
+                report = json.load(report_file)
+        self.assertEqual("only", report["stages"][0]["name"])
+
+
+class TestProfiling(TestCase):
+    def test_cprofile(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with profiling("cProfile", f"{tmp_dir}/profile"):
+                sorted(range(1000), key=str)
+            self.assertGreater(pstats.Stats(f"{tmp_dir}/profile.prof").total_calls, 0)
+
+    def test_no_profiler(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with profiling(None, f"{tmp_dir}/profile"):
+                pass
+            self.assertEqual([], os.listdir(tmp_dir))
+
+    def test_unknown_profiler(self):
+        with self.assertRaises(ValueError):
+            with profiling("yappi", "profile"):
+                pass
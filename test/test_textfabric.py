@@ -0,0 +1,52 @@
+import json
+import os
+import tempfile
+from unittest import TestCase
+
+import untanngle.synthetic_tf_export as synthetic
+from untanngle.textfabric import _extend_tier0_annotations, untangle_tf_export, TFUntangleConfig
+
+data_dir = os.path.join(os.path.dirname(__file__), "data")
+
+
+def read_test_data(name):
+    with open(os.path.join(data_dir, name)) as f:
+        return json.load(f)
+
+
+class TestExtendTier0Annotations(TestCase):
+    def test_extend_tier0_annotations_matches_golden_file(self):
+        # tei:Letter annotations with tei:Text and tf:Page annotations (some without text, some sharing a canvas)
+        # in two texts; the expected output was made with the IntervalTree-based implementation
+        web_annotations = read_test_data("tier0-web-annotations.json")
+        expected = read_test_data("tier0-web-annotations-extended.json")
+        _extend_tier0_annotations(web_annotations, "tei:Letter")
+        self.assertEqual(expected, web_annotations)
+
+
+class TestUntangleTFExport(TestCase):
+    def test_untangle_synthetic_export_with_profile(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            synthetic.SyntheticTFExport(texts=2, pages_per_text=3, paragraphs_per_page=4,
+                                        tokens_per_paragraph=20).write(f"{tmp_dir}/tf")
+            config = TFUntangleConfig(project_name="synthetic", data_path=f"{tmp_dir}/tf", export_path=tmp_dir,
+                                      tier0_type=synthetic.tier0_type, excluded_types=synthetic.excluded_types,
+                                      textrepo_base_uri_external="https://textrepo.example.org",
+                                      editem_project=True, profile=True)
+            self.assertEqual([], untangle_tf_export(config))
+
+            web_annotations = read_test_data(f"{tmp_dir}/synthetic/web-annotations.json")
+            with open(f"{tmp_dir}/synthetic/untangle-stages.json") as f:
+                stages = json.load(f)["stages"]
+
+        # 2 texts and files, 6 pages, 24 paragraphs and 18 links between them; no tokens or line breaks
+        self.assertEqual(52, len(web_annotations))
+        self.assertEqual({"tei:Text", "tf:File", "tf:Page", "tei:P"},
+                         {a["body"]["type"] for a in web_annotations if isinstance(a["body"], dict)})
+        tier0_annotation = next(a for a in web_annotations if a["body"]["type"] == synthetic.tier0_type)
+        # a canvas and two image targets for every page of the text
+        self.assertEqual(3 * 3, len([t for t in tier0_annotation["target"] if t["type"] in ("Canvas", "Image")]))
+        self.assertEqual(["load_metadata", "load_tokens", "load_annotations", "merge", "physical_texts", "paragraphs",
+                          "logical_texts", "conversion", "tier0_extension", "link_annotations", "camel_case",
+                          "sanity_check", "store"], [s["name"] for s in stages])
+        self.assertEqual(52, stages[-1]["items"])
@@ -0,0 +1,246 @@
+import json
+import tempfile
+import threading
+import uuid
+from collections import Counter
+from email import message_from_bytes
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import TestCase, mock
+from urllib.parse import urlparse, parse_qs
+
+import untanngle.synthetic_tf_export as synthetic
+from untanngle.textfabric import untangle_tf_export, TFUntangleConfig
+from textrepo.client import TextRepoClient
+
+from untanngle.utils import upload_to_tr, TextRepoVersionCache, _MultipartFileBody
+
+
+class StubTextRepo:
+    """In-memory stand-in for the parts of the TextRepo api used by upload_to_tr."""
+
+    def __init__(self, file_types=("segmented_text",)):
+        self.file_types = [{"id": i, "name": name, "mimetype": "application/json"}
+                           for i, name in enumerate(file_types)]
+        self.documents = {}
+        self.metadata = {}
+        self.versions = {}
+        # the external ids of the documents for which importing a version fails
+        self.failing = set()
+        self.requests = Counter()
+        self.lock = threading.Lock()
+
+    def document(self, doc_id, external_id):
+        return {"id": doc_id, "externalId": external_id, "createdAt": "2024-01-01T00:00:00"}
+
+
+class StubTextRepoHandler(BaseHTTPRequestHandler):
+    tr: StubTextRepo = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def respond(self, status, data):
+        payload = json.dumps(data).encode("utf8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def body(self):
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def multipart_contents(self):
+        message = message_from_bytes(f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode() + self.body())
+        part, = message.get_payload()
+        return part.get_payload(decode=True).decode("utf8")
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        with self.tr.lock:
+            self.tr.requests["GET " + url.path] += 1
+        if url.path == "/rest/types":
+            return self.respond(200, self.tr.file_types)
+        if url.path == "/rest/documents":
+            external_id = parse_qs(url.query)["externalId"][0]
+            items = [self.tr.document(doc_id, external_id)
+                     for doc_id, eid in self.tr.documents.items() if eid == external_id]
+            return self.respond(200, {"items": items, "page": {"limit": 10, "offset": 0}, "total": len(items)})
+        return self.respond(404, {})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        path = url.path.strip("/").split("/")
+        with self.tr.lock:
+            self.tr.requests["POST /" + "/".join(path[:2])] += 1
+            if url.path == "/rest/types":
+                file_type = json.loads(self.body())
+                file_type["id"] = len(self.tr.file_types)
+                self.tr.file_types.append(file_type)
+                return self.respond(201, file_type)
+            if url.path == "/rest/documents":
+                external_id = json.loads(self.body())["externalId"]
+                if external_id in self.tr.documents.values():
+                    return self.respond(409, {})
+                doc_id = str(uuid.uuid4())
+                self.tr.documents[doc_id] = external_id
+                return self.respond(201, self.tr.document(doc_id, external_id))
+        if path[:3] == ["task", "import", "documents"]:
+            external_id, type_name = path[3:5]
+            contents = self.multipart_contents()
+            if external_id in self.tr.failing:
+                return self.respond(500, {})
+            version_id = str(uuid.uuid4())
+            with self.tr.lock:
+                self.tr.versions[version_id] = (external_id, type_name, contents)
+            return self.respond(201, {"documentId": external_id, "fileId": f"{external_id}/{type_name}",
+                                      "versionId": version_id, "contentsSha": "", "newVersion": True})
+        return self.respond(404, {})
+
+    def do_PUT(self):
+        path = self.path.strip("/").split("/")
+        with self.tr.lock:
+            self.tr.requests["PUT /rest/documents/metadata"] += 1
+            self.tr.metadata[(path[2], path[4])] = self.body().decode("utf8")
+        return self.respond(200, {path[4]: self.tr.metadata[(path[2], path[4])]})
+
+
+class TestUploadToTextRepo(TestCase):
+    def setUp(self):
+        self.tr = StubTextRepo()
+        handler = type("Handler", (StubTextRepoHandler,), {"tr": self.tr})
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.textrepo_url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmp_dir.cleanup()
+
+    def text_files(self, n):
+        paths = []
+        for i in range(n):
+            for kind in ("physical", "logical"):
+                path = f"{self.tmp_dir.name}/textstore-{kind}-{i}.json"
+                with open(path, "w") as f:
+                    json.dump({"_ordered_segments": [f"{kind} text {i}"]}, f)
+                paths.append(path)
+        return paths
+
+    def test_upload_to_tr(self):
+        versions = upload_to_tr(self.textrepo_url, "proj", self.text_files(5), workers=3)
+
+        self.assertEqual({str(i) for i in range(5)}, set(versions.keys()))
+        logical_version = self.tr.versions[versions["3"]["logical"]]
+        self.assertEqual(("proj-3", "logical_segmented_text"), logical_version[:2])
+        self.assertEqual({"_ordered_segments": ["logical text 3"]}, json.loads(logical_version[2]))
+        physical_version = self.tr.versions[versions["3"]["physical"]]
+        self.assertEqual(("proj-3", "segmented_text"), physical_version[:2])
+
+        self.assertEqual({"segmented_text", "logical_segmented_text"}, {t["name"] for t in self.tr.file_types})
+        self.assertEqual(1, self.tr.requests["GET /rest/types"])
+        # one existence check and one creation per document
+        self.assertEqual(5, self.tr.requests["GET /rest/documents"])
+        self.assertEqual(5, self.tr.requests["POST /rest/documents"])
+        self.assertEqual(["proj"] * 5, list(self.tr.metadata.values()))
+
+    def test_upload_to_tr_with_existing_documents(self):
+        files = self.text_files(2)
+        upload_to_tr(self.textrepo_url, "proj", files)
+        versions = upload_to_tr(self.textrepo_url, "proj", files)
+
+        self.assertEqual(2, len(self.tr.documents))
+        self.assertEqual(2, self.tr.requests["POST /rest/documents"])
+        self.assertEqual(8, len(self.tr.versions))
+        self.assertEqual(2, len(versions["1"]))
+
+    def test_upload_to_tr_skips_unchanged_files(self):
+        files = self.text_files(3)
+        version_cache = TextRepoVersionCache(f"{self.tmp_dir.name}/textrepo-versions.json")
+        versions = upload_to_tr(self.textrepo_url, "proj", files, version_cache=version_cache)
+        self.assertEqual(6, len(self.tr.versions))
+
+        with open(files[3], "w") as f:
+            json.dump({"_ordered_segments": ["changed"]}, f)
+        version_cache = TextRepoVersionCache(f"{self.tmp_dir.name}/textrepo-versions.json")
+        new_versions = upload_to_tr(self.textrepo_url, "proj", files, version_cache=version_cache)
+
+        self.assertEqual(5, version_cache.hits)
+        self.assertEqual(1, version_cache.uploads)
+        self.assertFalse(version_cache.unchanged)
+        self.assertEqual(7, len(self.tr.versions))
+        self.assertEqual(versions["0"], new_versions["0"])
+        self.assertEqual(versions["1"]["physical"], new_versions["1"]["physical"])
+        self.assertNotEqual(versions["1"]["logical"], new_versions["1"]["logical"])
+        # documents without changed files are not looked up
+        self.assertEqual(4, self.tr.requests["GET /rest/documents"])
+
+    def test_upload_to_tr_keeps_the_uploaded_versions_when_a_document_fails(self):
+        files = self.text_files(3)
+        self.tr.failing.add("proj-1")
+        version_cache = TextRepoVersionCache(f"{self.tmp_dir.name}/textrepo-versions.json")
+        created, closed = [], []
+
+        class RecordingClient(TextRepoClient):
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs)
+                created.append(self)
+
+            def close(self):
+                closed.append(self)
+                super().close()
+
+        with mock.patch("untanngle.utils.TextRepoClient", RecordingClient):
+            with self.assertRaises(Exception):
+                upload_to_tr(self.textrepo_url, "proj", files, workers=2, version_cache=version_cache)
+
+        # every client is closed
+        self.assertEqual({id(c) for c in created}, {id(c) for c in closed})
+        saved = TextRepoVersionCache(f"{self.tmp_dir.name}/textrepo-versions.json")
+        self.assertEqual({"proj-0/segmented_text", "proj-0/logical_segmented_text",
+                          "proj-2/segmented_text", "proj-2/logical_segmented_text"}, set(saved.entries.keys()))
+
+    def test_multipart_file_body(self):
+        path = f"{self.tmp_dir.name}/contents.json"
+        with open(path, "w") as f:
+            f.write("x" * 10000)
+        with _MultipartFileBody("contents", path) as body:
+            blocks = list(iter(lambda: body.read(4096), b""))
+        self.assertTrue(all(len(block) == 4096 for block in blocks[:-1]))
+        data = b"".join(blocks)
+        self.assertEqual(body.len, len(data))
+        message = message_from_bytes(f"Content-Type: {body.content_type}\r\n\r\n".encode() + data)
+        part, = message.get_payload()
+        self.assertEqual('form-data; name="contents"; filename="contents.json"', part["Content-Disposition"])
+        self.assertEqual(b"x" * 10000, part.get_payload(decode=True))
+
+    def test_untangle_tf_export_keeps_web_annotations_when_nothing_changed(self):
+        synthetic.SyntheticTFExport(texts=2, pages_per_text=2, paragraphs_per_page=2,
+                                    tokens_per_paragraph=10).write(f"{self.tmp_dir.name}/tf")
+
+        def untangle(excluded_types):
+            config = TFUntangleConfig(project_name="synthetic", data_path=f"{self.tmp_dir.name}/tf",
+                                      export_path=self.tmp_dir.name, tier0_type=synthetic.tier0_type,
+                                      excluded_types=excluded_types, textrepo_base_uri_internal=self.textrepo_url,
+                                      editem_project=True, profile=True)
+            self.assertEqual([], untangle_tf_export(config))
+            with open(f"{self.tmp_dir.name}/synthetic/untangle-stages.json") as f:
+                stages = [s["name"] for s in json.load(f)["stages"]]
+            with open(f"{self.tmp_dir.name}/synthetic/web-annotations.json") as f:
+                return stages, f.read()
+
+        stages, web_annotations = untangle(synthetic.excluded_types)
+        self.assertIn("conversion", stages)
+        self.assertEqual(4, len(self.tr.versions))
+
+        stages, kept_web_annotations = untangle(synthetic.excluded_types)
+        self.assertEqual("textrepo_upload", stages[-1])
+        self.assertEqual(web_annotations, kept_web_annotations)
+        self.assertEqual(4, len(self.tr.versions))
+
+        # other settings give other web annotations, with the same text versions
+        stages, _ = untangle(["nlp:Token"])
+        self.assertIn("conversion", stages)
+        self.assertEqual(4, len(self.tr.versions))
@@ -0,0 +1,160 @@
+import importlib.util
+import json
+import os
+import shutil
+import sys
+import tempfile
+from unittest import TestCase, mock
+
+from test.republic_samples import caf_session, caf_resolutions
+
+script_path = os.path.join(os.path.dirname(__file__), "..", "scripts", "ut-untanngle-republic.py")
+spec = importlib.util.spec_from_file_location("ut_untanngle_republic", script_path)
+republic = importlib.util.module_from_spec(spec)
+# registered, so the checkpoints can pickle the script's classes
+sys.modules[spec.name] = republic
+spec.loader.exec_module(republic)
+
+year = 1705
+resource_id = f"volume-{year}"
+
+# three sessions: the lines of every text_region, and the (text_region, line) indexes of every paragraph
+session_lines = {
+    2: [["Praeside Van Essen", "Present de heeren"], ["Is gelesen een missive", "van den resident", "Hop"]],
+    3: [["Praeside De Wildt", "Present"], ["Ontfangen een brief", "van de gedeputeerden"]],
+    5: [["Praeside Van Heeckeren", "Present de heeren"], ["Is gehoort het rapport", "der heeren"]],
+}
+session_paragraphs = {
+    2: [[(0, 0), (0, 1)], [(1, 0), (1, 1)], [(1, 2)]],
+    3: [[(0, 0), (0, 1)], [(1, 0), (1, 1)]],
+    5: [[(0, 0), (0, 1)], [(1, 0), (1, 1)]],
+}
+
+
+def write_harvest(datadir: str, lines=None, paragraphs=None):
+    lines = {**session_lines, **(lines or {})}
+    paragraphs = {**session_paragraphs, **(paragraphs or {})}
+    os.makedirs(f"{datadir}/sessions")
+    os.makedirs(f"{datadir}/resolutions")
+    for day, line_texts in lines.items():
+        session = caf_session(day, line_texts)
+        session_id = session["_source"]["id"]
+        with open(f"{datadir}/sessions/{session_id}.json", "w") as f:
+            json.dump(session, f)
+        with open(f"{datadir}/resolutions/{session_id}-resolutions.json", "w") as f:
+            json.dump(caf_resolutions(session, paragraphs[day]), f)
+
+
+def read_stores(datadir: str):
+    stores = {}
+    for name in (f"textstore-{year}.json", f"logical-textstore-{year}.json", f"annotationstore-{year}.json"):
+        with open(f"{datadir}/{name}") as f:
+            stores[name] = json.load(f)
+    stores[f"annotationstore-{year}.json"].sort(key=lambda a: (a["type"], a["id"]))
+    return stores
+
+
+class TestSpliceChangedSessions(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.previous_dir = f"{self.tmp_dir.name}/previous"
+        write_harvest(f"{self.previous_dir}/{year}")
+        self.untanngle(self.previous_dir)
+
+    def tearDown(self):
+        republic.reset_state()
+        self.tmp_dir.cleanup()
+
+    @staticmethod
+    def untanngle(data_dir: str, previous_data_dir: str = None):
+        republic.reset_state()
+        republic.untanngle_year(year, data_dir, previous_data_dir=previous_data_dir)
+
+    def splice(self, name: str) -> bool:
+        datadir = f"{self.tmp_dir.name}/{name}/{year}"
+        republic.reset_state()
+        return republic.splice_changed_sessions(year, datadir, f"{self.previous_dir}/{year}",
+                                                republic.input_digests(datadir, "sessions/", "resolutions/"),
+                                                resource_id)
+
+    def test_unchanged_manifest_untanngles_nothing(self):
+        write_harvest(f"{self.tmp_dir.name}/current/{year}")
+        with mock.patch.object(republic, "untanngle_sessions") as untanngle_sessions:
+            self.assertTrue(self.splice("current"))
+        untanngle_sessions.assert_not_called()
+        self.assertEqual(read_stores(f"{self.previous_dir}/{year}"), read_stores(f"{self.tmp_dir.name}/current/{year}"))
+
+    def test_changed_session_is_spliced_in(self):
+        changed_lines = {3: [["Praeside De Wildt", "Absent"], ["Ontfangen twee brieven", "van de gedeputeerden"]]}
+        write_harvest(f"{self.tmp_dir.name}/current/{year}", lines=changed_lines)
+        write_harvest(f"{self.tmp_dir.name}/full/{year}", lines=changed_lines)
+        with mock.patch.object(republic, "untanngle_sessions", wraps=republic.untanngle_sessions) as untanngle:
+            self.untanngle(f"{self.tmp_dir.name}/current", self.previous_dir)
+        self.assertEqual(1, untanngle.call_count)
+        # the session of the 3rd is untanngled after the 5 lines and 3 paragraphs of the session of the 2nd
+        session_files, _, _, anchor_offset, logical_offset = untanngle.call_args.args
+        self.assertEqual(["session-1705-01-03-num-1.json"], [os.path.basename(f) for f in session_files])
+        self.assertEqual((5, 3), (anchor_offset, logical_offset))
+
+        self.untanngle(f"{self.tmp_dir.name}/full")
+        spliced = read_stores(f"{self.tmp_dir.name}/current/{year}")
+        self.assertEqual(read_stores(f"{self.tmp_dir.name}/full/{year}"), spliced)
+        self.assertEqual("Ontfangen twee brieven", spliced[f"textstore-{year}.json"]["_ordered_segments"][7])
+        anchors = {a["id"]: (a["begin_anchor"], a["end_anchor"], a["logical_begin_anchor"], a["logical_end_anchor"])
+                   for a in spliced[f"annotationstore-{year}.json"]}
+        self.assertEqual((5, 8, 3, 4), anchors["session-1705-01-03-num-1"])
+        self.assertEqual((7, 8, 4, 4), anchors["session-1705-01-03-num-1-para-1"])
+        self.assertEqual((9, 12, 5, 6), anchors["session-1705-01-05-num-1"])
+
+    def test_changed_line_count_needs_full_rebuild(self):
+        write_harvest(f"{self.tmp_dir.name}/current/{year}",
+                      lines={3: [["Praeside De Wildt", "Present", "Absent"],
+                                 ["Ontfangen een brief", "van de gedeputeerden"]]},
+                      paragraphs={3: [[(0, 0), (0, 1), (0, 2)], [(1, 0), (1, 1)]]})
+        self.assertFalse(self.splice("current"))
+        self.assertFalse(os.path.exists(f"{self.tmp_dir.name}/current/{year}/annotationstore-{year}.json"))
+
+    def test_changed_paragraph_count_needs_full_rebuild(self):
+        write_harvest(f"{self.tmp_dir.name}/current/{year}", paragraphs={3: [[(0, 0), (0, 1)], [(1, 0)], [(1, 1)]]})
+        self.assertFalse(self.splice("current"))
+
+    def test_added_session_needs_full_rebuild(self):
+        write_harvest(f"{self.tmp_dir.name}/current/{year}",
+                      lines={4: [["Praeside Van Essen", "Present"]]}, paragraphs={4: [[(0, 0), (0, 1)]]})
+        self.assertFalse(self.splice("current"))
+
+    def test_removed_session_needs_full_rebuild(self):
+        datadir = f"{self.tmp_dir.name}/current/{year}"
+        write_harvest(datadir)
+        os.remove(f"{datadir}/sessions/session-1705-01-05-num-1.json")
+        os.remove(f"{datadir}/resolutions/session-1705-01-05-num-1-resolutions.json")
+        self.assertFalse(self.splice("current"))
+
+    def test_full_rebuild_when_splicing_fails(self):
+        datadir = f"{self.tmp_dir.name}/current/{year}"
+        write_harvest(datadir)
+        shutil.copy(f"{datadir}/sessions/session-1705-01-05-num-1.json",
+                    f"{datadir}/sessions/session-1705-01-07-num-1.json")
+        with mock.patch.object(republic, "traverse_session_files",
+                               wraps=republic.traverse_session_files) as traverse_session_files:
+            self.untanngle(f"{self.tmp_dir.name}/current", self.previous_dir)
+        traverse_session_files.assert_called_once()
+
+
+class TestSpliceAnnotations(TestCase):
+    @staticmethod
+    def annotation(a_type: str, a_id: str, begin_anchor: int, end_anchor: int) -> dict:
+        return {"type": a_type, "id": a_id, "begin_anchor": begin_anchor, "end_anchor": end_anchor}
+
+    def test_splice_annotations(self):
+        annotations = [self.annotation("line", "l1", 0, 0), self.annotation("line", "l2", 1, 1),
+                       self.annotation("line", "l3", 2, 2), self.annotation("scan", "s1", 0, 2)]
+        session_annotations = [self.annotation("line", "l2b", 1, 1), self.annotation("scan", "s1", 1, 1)]
+        spliced = republic.splice_annotations(annotations, session_annotations, 1, 2)
+        # the scan extending beyond the range is kept, instead of the one of the session
+        self.assertEqual(["l1", "l3", "s1", "l2b"], [a["id"] for a in spliced])
+        self.assertEqual((0, 2), (spliced[2]["begin_anchor"], spliced[2]["end_anchor"]))
+
+    def test_splice_annotations_crossing_the_range(self):
+        annotations = [self.annotation("line", "l1", 0, 0), self.annotation("resolution", "r1", 0, 1)]
+        self.assertIsNone(republic.splice_annotations(annotations, [], 1, 2))
@@ -1,6 +1,9 @@
+import json
+import tempfile
 from unittest import TestCase
 
-from utils import transform_dict_entries
+from utils import transform_dict_entries, chunk_list, iter_chunks, iter_chunks_by_size, json_size, \
+    store_web_annotations
 
 
 class Test(TestCase):
@@ -16,3 +19,33 @@ class Test(TestCase):
 
         transformed = transform_dict_entries(dict_list, entry_filter, entry_transformer)
         self.assertEqual(expected, transformed)
+
+    def test_chunk_list_keeps_falsy_items(self):
+        items = [{}, 0, 1, "", None, 2, 3]
+        self.assertEqual([[{}, 0, 1], ["", None, 2], [3]], chunk_list(items, 3))
+
+    def test_iter_chunks_is_lazy(self):
+        chunks = iter_chunks(iter(range(1_000_000_000)), 2)
+        self.assertEqual([0, 1], next(chunks))
+        self.assertEqual([2, 3], next(chunks))
+
+    def test_iter_chunks_by_size(self):
+        items = [{"n": "x" * n} for n in (10, 10, 10, 50, 0, 0, 200, 1)]
+        chunks = list(iter_chunks_by_size(items, max_bytes=64))
+        self.assertEqual(items, [i for chunk in chunks for i in chunk])
+        for chunk in chunks:
+            self.assertTrue(len(chunk) == 1 or sum(json_size(i) for i in chunk) + 2 <= 64)
+        self.assertEqual([3, 1, 2, 1, 1], [len(c) for c in chunks])
+
+    def test_iter_chunks_by_size_with_max_items(self):
+        chunks = list(iter_chunks_by_size(range(5), max_bytes=1000, max_items=2))
+        self.assertEqual([[0, 1], [2, 3], [4]], chunks)
+
+    def test_store_web_annotations_streams_like_json_dump(self):
+        annotations = [{"id": n, "body": {"type": "tf:Page", "text": "é\n", "tags": [], "metadata": {}}}
+                       for n in range(3)]
+        for expected in (annotations, annotations[:1], []):
+            with tempfile.NamedTemporaryFile(suffix=".json") as f:
+                self.assertEqual(len(expected), store_web_annotations(iter(expected), f.name))
+                with open(f.name, encoding="utf-8") as stored:
+                    self.assertEqual(json.dumps(expected, indent=2, ensure_ascii=False), stored.read())
@@ -1,12 +1,15 @@
 import glob
 import json
 import os
+import time
 from collections import Counter
+from typing import Optional
 
 import progressbar
 from annorepo.client import AnnoRepoClient, ContainerAdapter
 
 import untanngle.utils as uu
+from untanngle.instrumentation import StageTimer
 
 
 def get_etag(ca: ContainerAdapter) -> str:
@@ -16,6 +19,24 @@ def get_etag(ca: ContainerAdapter) -> str:
     # return response.headers['etag']
 
 
+# upload requests are bounded by size, so their latency doesn't depend on the size of the annotations
+max_chunk_bytes = 4_000_000
+max_chunk_size = 500
+
+# the indexes every container gets; projects can add their own with the index_specs argument of upload
+default_index_specs = [
+    {
+        "target.type": "ascending",
+        "target.source": "ascending",
+        "target.selector.type": "ascending",
+        "target.selector.start": "ascending",
+        "target.selector.end": "ascending"
+    },
+    {"body.id": "hashed"},
+    {"body.type": "hashed"}
+]
+
+
 def upload(
         annorepo_base_url: str,
         container_id: str,
@@ -23,8 +44,22 @@ def upload(
         container_label: str = 'A Container for Web Annotations',
         api_key: str = None,
         overwrite_container: bool = False,
-        show_progress: bool = False
+        show_progress: bool = False,
+        bulk_load: bool = True,
+        index_specs: Optional[list[dict[str, str]]] = None,
+        timer: Optional[StageTimer] = None
 ):
+    """
+    Upload the web annotations in the input paths to the container.
+
+    In bulk-load mode, the indexes (default_index_specs plus index_specs), anonymous read access and the
+    distinct body type cache are only set up after all annotations are loaded, so the server doesn't have to
+    maintain the indexes while loading, and the container is not readable while it is incomplete.
+    Without bulk_load, this is done before loading, for adding annotations to a container in use.
+    The duration of the upload and post-load phases is recorded in timer (when given) and printed.
+    """
+    timer = timer if timer is not None else StageTimer()
+    index_specs = default_index_specs + (index_specs or [])
     ar = AnnoRepoClient(annorepo_base_url, verbose=False, api_key=api_key)
 
     # ar_about = ar.get_about()
@@ -40,8 +75,9 @@ def upload(
     if not ca.exists():
         print(f"container {container_url} not found, creating...")
         ca.create(label=container_label)
-        ca.set_anonymous_user_read_access(True)
-    ca.set_anonymous_user_read_access(has_read_access=True)
+
+    if not bulk_load:
+        prepare_container(ca, index_specs, timer)
 
     input_files = []
     for p in input_paths:
@@ -50,42 +86,66 @@ def upload(
         else:
             input_files.append(p)
     body_type_counter = Counter()
-    if show_progress:
-        widgets = [
-            '[',
-            progressbar.SimpleProgress(),
-            progressbar.Bar(marker='\x1b[32m#\x1b[39m'),
-            progressbar.Timer(),
-            '|',
-            progressbar.ETA(),
-            ']'
-        ]
-        with progressbar.ProgressBar(widgets=widgets, max_value=len(input_files), redirect_stdout=True) as bar:
-            for i, input_file in enumerate(input_files):
-                process_web_annotations_file(annorepo_base_url, ar, body_type_counter, container_id, input_file, True)
-                bar.update(i)
-    else:
-        for input_file in input_files:
-            process_web_annotations_file(annorepo_base_url, ar, body_type_counter, container_id, input_file, False)
+    with timer.stage("upload") as stage:
+        stage.items = 0
+        if show_progress:
+            widgets = [
+                '[',
+                progressbar.SimpleProgress(),
+                progressbar.Bar(marker='\x1b[32m#\x1b[39m'),
+                progressbar.Timer(),
+                '|',
+                progressbar.ETA(),
+                ']'
+            ]
+            with progressbar.ProgressBar(widgets=widgets, max_value=len(input_files), redirect_stdout=True) as bar:
+                for i, input_file in enumerate(input_files):
+                    stage.items += process_web_annotations_file(annorepo_base_url, ar, body_type_counter,
+                                                                container_id, input_file, True)
+                    bar.update(i)
+        else:
+            for input_file in input_files:
+                stage.items += process_web_annotations_file(annorepo_base_url, ar, body_type_counter,
+                                                            container_id, input_file, False)
 
     print_report(body_type_counter, container_url)
-    add_indexes(ca)
-    preload_distinct_body_type_cache(ca)
+    if bulk_load:
+        prepare_container(ca, index_specs, timer)
+    print_timings(timer)
     print("done!")
 
 
-def add_indexes(ca):
-    ca.create_compound_index(
-        {
-            "target.type": "ascending",
-            "target.source": "ascending",
-            "target.selector.type": "ascending",
-            "target.selector.start": "ascending",
-            "target.selector.end": "ascending"
-        }
-    )
-    ca.create_compound_index({"body.id": "hashed"})
-    ca.create_compound_index({"body.type": "hashed"})
+def prepare_container(ca: ContainerAdapter, index_specs: list[dict[str, str]], timer: StageTimer):
+    with timer.stage("indexing") as stage:
+        add_indexes(ca, index_specs)
+        stage.items = len(index_specs)
+    ca.set_anonymous_user_read_access(has_read_access=True)
+    with timer.stage("preload_cache"):
+        preload_distinct_body_type_cache(ca)
+
+
+def add_indexes(ca: ContainerAdapter, index_specs: list[dict[str, str]] = None):
+    index_specs = index_specs if index_specs is not None else default_index_specs
+    for i, index_spec in enumerate(index_specs):
+        print(f"creating index {i + 1}/{len(index_specs)}: {index_spec}")
+        start = time.perf_counter()
+        ca.create_compound_index(index_spec)
+        print(f"  created in {time.perf_counter() - start:.1f}s")
+
+
+def parse_index_spec(spec: str) -> dict[str, str]:
+    """Parse an index specification like `body.metadata.sessionDate:ascending,body.type:hashed`."""
+    index_spec = {}
+    for part in spec.split(','):
+        field, _, index_type = part.partition(':')
+        index_spec[field.strip()] = index_type.strip() or "ascending"
+    return index_spec
+
+
+def print_timings(timer: StageTimer):
+    for s in timer.stages:
+        items = f" ({s.items} items)" if s.items is not None else ""
+        print(f"{s.name}: {s.wall_time:.1f}s{items}")
 
 
 def process_web_annotations_file(
@@ -95,7 +155,7 @@ def process_web_annotations_file(
         container_id: str,
         input_file: str,
         show_progress: bool
-):
+) -> int:
     print(f"reading {input_file}...")
     with open(input_file) as f:
         annotation_list = json.load(f)
@@ -107,16 +167,14 @@ def process_web_annotations_file(
         body_type_counter.update([body_type])
     number_of_annotations = len(annotation_list)
     print(f"  {number_of_annotations} annotations found.")
-    chunk_size = 500
-    chunked_annotations = uu.chunk_list(annotation_list, chunk_size)
-    number_of_chunks = len(chunked_annotations)
     print(
         f"  uploading {number_of_annotations} annotations to {annorepo_base_url}/w3c/{container_id}"
-        f" in {number_of_chunks} chunks of at most {chunk_size} annotations ...")
+        f" in chunks of at most {max_chunk_size} annotations / {max_chunk_bytes} bytes ...")
     annotation_ids = []
+    chunked_annotations = uu.iter_chunks_by_size(annotation_list, max_bytes=max_chunk_bytes, max_items=max_chunk_size)
     for p, chunk in enumerate(chunked_annotations):
         if show_progress:
-            print(f"    chunk ({p + 1}/{number_of_chunks})", end='\r')
+            print(f"    chunk {p + 1} ({len(annotation_ids) + len(chunk)}/{number_of_annotations})", end='\r')
         # ic(chunk)
         annotation_ids.extend(ar.add_annotations(container_id, chunk))
     print()
@@ -128,6 +186,7 @@ def process_web_annotations_file(
     print(f"=> {outfile}")
     with open(outfile, "w") as f:
         json.dump(annotation_id_mapping, fp=f)
+    return number_of_annotations
 
 
 def preload_distinct_body_type_cache(ca):
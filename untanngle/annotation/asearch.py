@@ -2,6 +2,7 @@
 This module contains candidate functions for an annotation service for annotations
 that are connected to a segmented text object.
 """
+from bisect import bisect_left, bisect_right
 
 
 def get_annotations_at_anchor(anchor, annotations, label=None):
@@ -24,6 +25,14 @@ def get_annotations_of_type(type, annotations, resource_id=None):
     return [a for a in annotations_for_resource if a['type'] == type]
 
 
+def overlaps_with(a, begin_anchor, end_anchor, resource_id):
+    return a['resource_id'] == resource_id and (
+            begin_anchor <= a['begin_anchor'] < end_anchor or
+            begin_anchor < a['end_anchor'] <= end_anchor or
+            (a['begin_anchor'] <= begin_anchor and a['end_anchor'] >= end_anchor)
+    )
+
+
 def get_annotations_overlapping_with(begin_anchor, end_anchor, annotations, resource_id):
     """
     Returns all annotations that overlap with a specific text interval.
@@ -31,12 +40,7 @@ def get_annotations_overlapping_with(begin_anchor, end_anchor, annotations, reso
     This function should work for all indexes or anchors that support comparison operations.
     """
     return filter(
-        lambda a: a['resource_id'] == resource_id and
-                  (
-                          begin_anchor <= a['begin_anchor'] < end_anchor or
-                          begin_anchor < a['end_anchor'] <= end_anchor or
-                          (a['begin_anchor'] <= begin_anchor and a['end_anchor'] >= end_anchor)
-                  ),
+        lambda a: overlaps_with(a, begin_anchor, end_anchor, resource_id),
         annotations
     )
     # return (a for a in annotations if (a['resource_id'] == resource_id) and
@@ -108,3 +112,34 @@ def get_annotation_by_id(ann_id, annotations):
         if 'id' in ann and ann['id'] == ann_id:
             return ann
     return None
+
+
+class OverlapIndex:
+    """
+    Index on a fixed list of annotations with integer anchors, for repeated overlap queries.
+
+    Gives the same results, in the same order, as get_annotations_overlapping_with,
+    but only tests the annotations whose begin_anchor is within reach of the queried interval.
+    """
+
+    def __init__(self, annotations):
+        self.annotations = list(annotations)
+        # annotations with end_anchor < begin_anchor can not be bounded by their begin_anchor, so always test them
+        self.irregular_positions = []
+        regular = []
+        for position, a in enumerate(self.annotations):
+            if a['end_anchor'] < a['begin_anchor']:
+                self.irregular_positions.append(position)
+            else:
+                regular.append((a['begin_anchor'], position))
+        regular.sort()
+        self.begin_anchors = [r[0] for r in regular]
+        self.positions = [r[1] for r in regular]
+        self.max_length = max((self.annotations[p]['end_anchor'] - b for (b, p) in regular), default=0)
+
+    def get_annotations_overlapping_with(self, begin_anchor, end_anchor, resource_id):
+        lo = bisect_left(self.begin_anchors, min(begin_anchor, end_anchor) - self.max_length)
+        hi = bisect_right(self.begin_anchors, max(begin_anchor, end_anchor))
+        candidate_positions = self.positions[lo:hi] + self.irregular_positions
+        return [self.annotations[p] for p in sorted(candidate_positions)
+                if overlaps_with(self.annotations[p], begin_anchor, end_anchor, resource_id)]
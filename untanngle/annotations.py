@@ -3,7 +3,8 @@ import uuid
 from collections import defaultdict
 from dataclasses import dataclass, field
 from datetime import datetime
-from typing import Any, List, Union, Dict, Set, Optional
+from functools import lru_cache
+from typing import Any, List, Union, Dict, Set, Optional, Tuple, Iterable
 
 from dataclasses_json import dataclass_json, Undefined, config
 from loguru import logger
@@ -53,12 +54,14 @@ class Annotation:
         if hasattr(self, 'coords') and self.coords:
             if hasattr(self, 'iiif_url'):
                 iiif_url = self.iiif_url
+                image_url = parse_iiif_url(iiif_url).image_url
             else:
                 first_region_link = self.region_links[0]
                 target.append(image_target(iiif_url=first_region_link))
-                iiif_url = re.sub(r'jpg/[\d,]+/', 'jpg/full/', first_region_link)
-            img_url = re.sub(".jpg.*", ".jpg", iiif_url)
-            canvas_url = canvas_idx[img_url]
+                parsed_link = parse_iiif_url(first_region_link)
+                iiif_url = parsed_link.full_region_url
+                image_url = parsed_link.image_url
+            canvas_url = canvas_idx[image_url]
             image_coords = to_image_coords(self.coords)
             xywh = f"{image_coords.left},{image_coords.top},{image_coords.width},{image_coords.height}"
             target.append(canvas_target(canvas_url=canvas_url, xywh_list=[xywh], coords_list=[self.coords]))
@@ -67,28 +70,26 @@ class Annotation:
             regions_per_scan = defaultdict(lambda: [])
             for rl in self.region_links:
                 target.append(image_target(iiif_url=rl))
-                xywh = rl.split('/')[-4]
-                if "," in xywh:
-                    (x, y, w, h) = xywh.split(',')
-                    if x.isnumeric() and y.isnumeric() and w.isnumeric() and h.isnumeric():
-                        image_coords = ImageCoords(left=int(x), right=int(x) + int(w),
-                                                   top=int(y), bottom=int(y) + int(h),
-                                                   width=int(w), height=int(h))
+                parsed_link = parse_iiif_url(rl)
+                if parsed_link.has_xywh_region:
+                    if parsed_link.xywh:
+                        (x, y, w, h) = parsed_link.xywh
+                        image_coords = ImageCoords(left=x, right=x + w,
+                                                   top=y, bottom=y + h,
+                                                   width=w, height=h)
                         coords = [
                             [image_coords.left, image_coords.top],
                             [image_coords.right, image_coords.top],
                             [image_coords.right, image_coords.bottom],
                             [image_coords.left, image_coords.bottom]
                         ]
-                        iiif_url = re.sub(r"jpg/[\d,]+/", 'jpg/full/', rl)
-                        regions_per_scan[iiif_url].append(
-                            Region(image_coords=image_coords, coords_list=coords, xywh=xywh))
+                        regions_per_scan[parsed_link.full_region_url].append(
+                            Region(image_coords=image_coords, coords_list=coords, xywh=parsed_link.region))
                     else:
                         logger.error(f"Badly formatted region_link: {rl}")
 
             for (iiif_url, regions) in regions_per_scan.items():
-                img_url = re.sub(".jpg.*", ".jpg", iiif_url)
-                canvas_url = canvas_idx[img_url]
+                canvas_url = canvas_idx[parse_iiif_url(iiif_url).image_url]
                 xywh_list = [r.xywh for r in regions]
                 coords_list = [r.coords_list for r in regions]
                 image_coords_list = [r.image_coords for r in regions]
@@ -97,8 +98,7 @@ class Annotation:
                     image_target(iiif_url=iiif_url, image_coords_list=image_coords_list, coords_list=coords_list))
 
             if not regions_per_scan and hasattr(self, 'iiif_url'):
-                img_url = re.sub(".jpg.*", ".jpg", self.iiif_url)
-                canvas_url = canvas_idx[img_url]
+                canvas_url = canvas_idx[parse_iiif_url(self.iiif_url).image_url]
                 target.append({
                     '@context': REPUBLIC_CONTEXT,
                     'source': canvas_url,
@@ -242,6 +242,50 @@ class ImageCoords:
     width: int
 
 
+@dataclass(frozen=True)
+class IIIFUrl:
+    """
+    An IIIF image request url, split into the part before the region (`base`), the region,
+    and the size/rotation/quality.format part after it (`suffix`)
+    """
+    url: str
+    base: str
+    region: str
+    suffix: str
+    image_url: str
+    xywh: Optional[Tuple[int, int, int, int]] = None
+
+    @property
+    def has_xywh_region(self) -> bool:
+        return "," in self.region
+
+    @property
+    def full_region_url(self) -> str:
+        if self.xywh:
+            return f"{self.base}/full/{self.suffix}"
+        return self.url
+
+
+jpg_suffix_pattern = re.compile(".jpg.*")
+xywh_region_pattern = re.compile(r"(\d+),(\d+),(\d+),(\d+)")
+
+
+@lru_cache(maxsize=1 << 16)
+def parse_iiif_url(url: str) -> IIIFUrl:
+    image_url = jpg_suffix_pattern.sub(".jpg", url)
+    parts = url.rsplit('/', 4)
+    if len(parts) < 5:
+        return IIIFUrl(url=url, base=url, region="", suffix="", image_url=image_url)
+    base = parts[0]
+    region = parts[1]
+    suffix = '/'.join(parts[2:])
+    xywh = None
+    match = xywh_region_pattern.fullmatch(region)
+    if match:
+        xywh = tuple(int(g) for g in match.groups())
+    return IIIFUrl(url=url, base=base, region=region, suffix=suffix, image_url=image_url, xywh=xywh)
+
+
 @dataclass
 class Region:
     image_coords: ImageCoords
@@ -288,6 +332,46 @@ class VolumeAnnotation:
         return web_annotation(body=body, target=target)
 
 
+@dataclass
+class InventoryBounds:
+    begin_anchor: int
+    end_anchor: int
+    logical_end_anchor: Optional[int] = None
+
+
+class InventoryBoundsAggregator:
+    """
+    Collects the text anchor bounds of the (un-t-ann-gle annotationstore) annotations per inventory,
+    as needed for the VolumeAnnotations, in a single pass; annotations can be added while streaming.
+    """
+
+    def __init__(self):
+        self.bounds: Dict[str, InventoryBounds] = {}
+
+    def add(self, annotation: Dict[str, Any]):
+        inventory_id = annotation.get("inventory_id")
+        if inventory_id is None:
+            return
+        logical_end_anchor = annotation.get("logical_end_anchor")
+        bounds = self.bounds.get(inventory_id)
+        if bounds is None:
+            self.bounds[inventory_id] = InventoryBounds(begin_anchor=annotation["begin_anchor"],
+                                                        end_anchor=annotation["end_anchor"],
+                                                        logical_end_anchor=logical_end_anchor)
+            return
+        if annotation["begin_anchor"] < bounds.begin_anchor:
+            bounds.begin_anchor = annotation["begin_anchor"]
+        if annotation["end_anchor"] > bounds.end_anchor:
+            bounds.end_anchor = annotation["end_anchor"]
+        if logical_end_anchor is not None and (
+                bounds.logical_end_anchor is None or logical_end_anchor > bounds.logical_end_anchor):
+            bounds.logical_end_anchor = logical_end_anchor
+
+    def add_all(self, annotations: Iterable[Dict[str, Any]]):
+        for annotation in annotations:
+            self.add(annotation)
+
+
 @dataclass_json(undefined=Undefined.RAISE)
 @dataclass
 class ScanPageAnnotation:
@@ -1316,7 +1400,14 @@ def as_urn(id: str) -> str:
     return f"urn:republic:{id}"
 
 
+iri_scheme_pattern = re.compile(r"[A-Za-z][A-Za-z0-9+.\-]*:")
+
+
+@lru_cache(maxsize=1 << 16)
 def is_iri(value: str) -> bool:
+    # every IRI starts with a scheme, so anything without one can skip the (slow) full rfc3987 parse
+    if not iri_scheme_pattern.match(value):
+        return False
     try:
         parse(value, rule='IRI')
         return True
@@ -1324,6 +1415,7 @@ def is_iri(value: str) -> bool:
         return False
 
 
+@lru_cache(maxsize=1 << 16)
 def as_iri(value: str, prefix: str):
     if is_iri(value):
         return value
@@ -0,0 +1,225 @@
+import json
+import os
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+import requests
+from loguru import logger
+
+default_es_url = "https://annotation.republic-caf.diginfra.org/elasticsearch"
+
+
+@dataclass
+class CAFHarvester:
+    """
+    Harvests the session and resolution documents of a year from the CAF Elasticsearch indexes.
+
+    All searches are paged with search_after in a point in time (or, when the server doesn't support that,
+    with search_after on the index itself), so no result set is ever truncated.
+    Resolutions are retrieved per month of sessions, with up to `workers` months in parallel.
+    """
+    es_url: str = default_es_url
+    session_index: str = "session_metadata"
+    resolutions_index: str = "full_resolutions"
+    page_size: int = 1000
+    workers: int = 8
+    keep_alive: str = "2m"
+    _local: threading.local = field(default_factory=threading.local, init=False, repr=False)
+
+    def _http(self) -> requests.Session:
+        # requests.Session is not thread-safe, so use one per thread
+        if not hasattr(self._local, 'session'):
+            self._local.session = requests.Session()
+        return self._local.session
+
+    def _post(self, path: str, body: Dict[str, Any]) -> requests.Response:
+        return self._http().post(f"{self.es_url}/{path}", json=body)
+
+    def search_all(self, index: str, query: Dict[str, Any], sort: List[Any],
+                   source: Optional[List[str]] = None) -> Iterator[Dict[str, Any]]:
+        """Yield all hits for query on index, in sort order, optionally with only the `source` fields."""
+        response = self._http().post(f"{self.es_url}/{index}/_pit", params={"keep_alive": self.keep_alive})
+        if not response.ok:
+            logger.debug(f"no point in time for {index} ({response.status_code}), paging over the index itself")
+            yield from self._search_after(f"{index}/_search", query, sort + [{"_id": "asc"}], source, pit_id=None)
+            return
+        pit_id = response.json()["id"]
+        try:
+            yield from self._search_after("_search", query, sort, source, pit_id=pit_id)
+        finally:
+            self._http().delete(f"{self.es_url}/_pit", json={"id": pit_id})
+
+    def _search_after(self, path: str, query: Dict[str, Any], sort: List[Any], source: Optional[List[str]],
+                      pit_id: Optional[str]) -> Iterator[Dict[str, Any]]:
+        search_after = None
+        while True:
+            body = {"size": self.page_size, "query": query, "sort": sort, "track_total_hits": False}
+            if source is not None:
+                body["_source"] = source
+            if pit_id:
+                body["pit"] = {"id": pit_id, "keep_alive": self.keep_alive}
+            if search_after:
+                body["search_after"] = search_after
+            response = self._post(path, body)
+            response.raise_for_status()
+            result = response.json()
+            pit_id = result.get("pit_id", pit_id)
+            hits = result["hits"]["hits"]
+            yield from hits
+            if len(hits) < self.page_size:
+                return
+            search_after = hits[-1]["sort"]
+
+    def sessions_of_year(self, year: str, indexed_since: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        query = with_indexed_since({"term": {"metadata.session_year": year}}, indexed_since)
+        for hit in self.search_all(self.session_index, query, [{"metadata.session_date": "asc"}]):
+            yield hit["_source"]
+
+    def resolution_metadata_of_year(self, year: str, indexed_since: Optional[str] = None) -> List[Dict[str, Any]]:
+        """The session_date and index_timestamp of the resolutions of the year (indexed since the given time)."""
+        query = with_indexed_since(
+            {"range": {"metadata.session_date": {"gte": f"{year}-01-01", "lte": f"{year}-12-31"}}}, indexed_since)
+        hits = self.search_all(self.resolutions_index, query, [{"metadata.session_date": "asc"}],
+                               source=["metadata.session_date", "metadata.index_timestamp"])
+        return [hit["_source"]["metadata"] for hit in hits]
+
+    def resolutions_between(self, first_date: str, last_date: str) -> List[Dict[str, Any]]:
+        query = {"range": {"metadata.session_date": {"gte": first_date, "lte": last_date}}}
+        return [hit["_source"] for hit in
+                self.search_all(self.resolutions_index, query, [{"metadata.session_date": "asc"}])]
+
+    def resolutions_by_date(self, session_dates: Iterable[str]) -> Dict[str, List[Dict[str, Any]]]:
+        """Retrieve the resolutions for the given session dates, one query per month, grouped by session date."""
+        dates_per_month = defaultdict(set)
+        for session_date in session_dates:
+            dates_per_month[session_date[:7]].add(session_date[:10])
+        resolutions_by_date = defaultdict(list)
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            month_dates = [sorted(dates) for _, dates in sorted(dates_per_month.items())]
+            for dates, resolutions in zip(month_dates,
+                                          executor.map(lambda d: self.resolutions_between(d[0], d[-1]), month_dates)):
+                wanted = set(dates)
+                for resolution in resolutions:
+                    resolution_date = resolution["metadata"]["session_date"][:10]
+                    if resolution_date in wanted:
+                        resolutions_by_date[resolution_date].append(resolution)
+        return resolutions_by_date
+
+    def harvest_year(self, year: str, output_dir: str):
+        caf_sessions_output_dir, caf_resolutions_output_dir = create_output_dirs(output_dir)
+
+        # generate separate session json file for each session of the year
+        date_for_session_id = {}
+        for session in self.sessions_of_year(year):
+            date_for_session_id[session['id']] = session['metadata']['session_date']
+            write_compact_json(session, f"{caf_sessions_output_dir}/{session['id']}.json")
+
+        resolutions_by_date = self.resolutions_by_date(date_for_session_id.values())
+        write_resolutions(date_for_session_id, resolutions_by_date, caf_resolutions_output_dir)
+
+    def harvest_year_incrementally(self, year: str, output_dir: str, state: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Update the harvest of the year in output_dir with the sessions and resolutions indexed since the
+        index_timestamps in state (the result of the previous call for this year, or empty for a full harvest).
+        Returns the new state.
+        Only the files of sessions that changed, or that have resolutions that changed, are (re)written.
+        Documents removed from CAF are not detected.
+        """
+        caf_sessions_output_dir, caf_resolutions_output_dir = create_output_dirs(output_dir)
+        sessions_since = state.get('sessions_indexed_since')
+        resolutions_since = state.get('resolutions_indexed_since')
+        date_for_session_id = dict(state.get('session_dates', {}))
+
+        changed_dates = set()
+        session_timestamps = []
+        for session in self.sessions_of_year(year, sessions_since):
+            date_for_session_id[session['id']] = session['metadata']['session_date']
+            changed_dates.add(session['metadata']['session_date'][:10])
+            session_timestamps.append(session['metadata'].get('index_timestamp'))
+            write_compact_json(session, f"{caf_sessions_output_dir}/{session['id']}.json")
+
+        resolution_timestamps = []
+        for metadata in self.resolution_metadata_of_year(year, resolutions_since):
+            changed_dates.add(metadata['session_date'][:10])
+            resolution_timestamps.append(metadata.get('index_timestamp'))
+        logger.info(f"{year}: {len(session_timestamps)} sessions and {len(resolution_timestamps)} resolutions"
+                    f" indexed since the previous harvest, affecting {len(changed_dates)} session dates")
+
+        # resolution files hold all resolutions of the session date, so harvest those dates completely
+        resolutions_by_date = self.resolutions_by_date(changed_dates)
+        changed_sessions = {sid: d for sid, d in date_for_session_id.items() if d[:10] in changed_dates}
+        write_resolutions(changed_sessions, resolutions_by_date, caf_resolutions_output_dir)
+
+        return {
+            'sessions_indexed_since': max(filter(None, session_timestamps), default=sessions_since),
+            'resolutions_indexed_since': max(filter(None, resolution_timestamps), default=resolutions_since),
+            'session_dates': date_for_session_id
+        }
+
+    def all_years(self) -> List[int]:
+        body = {
+            "size": 0,
+            "aggs": {
+                "min_session_date": {"min": {"field": "metadata.session_date"}},
+                "max_session_date": {"max": {"field": "metadata.session_date"}}
+            }
+        }
+        response = self._post(f"{self.resolutions_index}/_search", body)
+        response.raise_for_status()
+        aggregations = response.json()["aggregations"]
+        min_year = int(aggregations["min_session_date"]["value_as_string"][:4])
+        max_year = int(aggregations["max_session_date"]["value_as_string"][:4])
+        return [y for y in range(min_year, max_year)]
+
+
+def with_indexed_since(query: Dict[str, Any], indexed_since: Optional[str]) -> Dict[str, Any]:
+    if indexed_since is None:
+        return query
+    return {"bool": {"filter": [query, {"range": {"metadata.index_timestamp": {"gt": indexed_since}}}]}}
+
+
+def create_output_dirs(output_dir: str) -> (str, str):
+    caf_sessions_output_dir = f'{output_dir}/sessions'
+    caf_resolutions_output_dir = f'{output_dir}/resolutions'
+    for directory in (caf_sessions_output_dir, caf_resolutions_output_dir):
+        if not os.path.exists(directory):
+            logger.info(f"creating {directory}")
+            os.makedirs(directory)
+    return caf_sessions_output_dir, caf_resolutions_output_dir
+
+
+def write_resolutions(date_for_session_id: Dict[str, str], resolutions_by_date: Dict[str, List[Dict[str, Any]]],
+                      caf_resolutions_output_dir: str):
+    for session_id, session_date in sorted(date_for_session_id.items()):
+        out_path = f'{caf_resolutions_output_dir}/{session_id}-resolutions.json'
+        resolutions = resolutions_by_date.get(session_date[:10], [])
+        if resolutions:
+            write_compact_json(resolutions, out_path, f" ({len(resolutions):4} resolutions)")
+        else:
+            logger.warning(f"no resolutions found for session {session_id}")
+            if os.path.exists(out_path):
+                os.remove(out_path)
+
+
+def read_harvest_state(path: str) -> Dict[str, Any]:
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_harvest_state(state: Dict[str, Any], path: str):
+    logger.info(f"=> {path}")
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f, indent=4)
+    os.replace(tmp_path, path)
+
+
+def write_compact_json(data: Any, path: str, note: str = ""):
+    logger.info(f"=> {path}{note}")
+    with open(path, 'w') as filehandle:
+        json.dump(data, filehandle, separators=(',', ':'))
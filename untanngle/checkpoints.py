@@ -0,0 +1,104 @@
+import hashlib
+import os
+import pickle
+import sys
+from typing import Any, Dict, Iterable, List, Optional
+
+from loguru import logger
+
+_read_block_size = 1 << 20
+
+
+def file_digest(path: str) -> str:
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(_read_block_size), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def file_digests(paths: Iterable[str], base_dir: Optional[str] = None) -> Dict[str, str]:
+    """
+    Return the sha256 hex digest of the contents of each of the given files, keyed by the path
+    (relative to base_dir, when given), in sorted path order.
+    """
+    digests = {}
+    for path in sorted(paths):
+        key = os.path.relpath(path, base_dir) if base_dir else path
+        digests[key] = file_digest(path)
+    return digests
+
+
+def module_digests(package: str) -> Dict[str, str]:
+    """
+    Return the sha256 hex digest of the source file of each loaded module of the package (the package itself
+    and its submodules), keyed by module name, to detect changes in the code a program runs.
+    """
+    paths = {}
+    for name, module in list(sys.modules.items()):
+        if (name == package or name.startswith(f"{package}.")) and getattr(module, '__file__', None):
+            paths[name] = module.__file__
+    return {name: file_digest(paths[name]) for name in sorted(paths)}
+
+
+def fingerprint(digests: Dict[str, str], *extra: str) -> str:
+    """Combine the file digests (and any extra strings, like a code version) into one fingerprint."""
+    sha = hashlib.sha256()
+    for key in sorted(digests):
+        sha.update(f"{key}\t{digests[key]}\n".encode('utf8'))
+    for e in extra:
+        sha.update(f"{e}\n".encode('utf8'))
+    return sha.hexdigest()
+
+
+class CheckpointStore:
+    """
+    Pickled snapshots of intermediate processing state, one file per stage, in `directory`.
+
+    Each checkpoint starts with the fingerprint of the input it was made from, so a checkpoint is only
+    considered valid when it was made from the same input, and can be checked without unpickling the state.
+    """
+
+    def __init__(self, directory: str, input_fingerprint: str):
+        self.directory = directory
+        self.fingerprint = input_fingerprint
+
+    def path(self, stage: str) -> str:
+        return f"{self.directory}/{stage}.pickle"
+
+    def save(self, stage: str, state: Any = None):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(stage)
+        tmp_path = f"{path}.tmp"
+        logger.info(f"=> {path}")
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(self.fingerprint, f, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    def is_valid(self, stage: str) -> bool:
+        path = self.path(stage)
+        if not os.path.exists(path):
+            return False
+        try:
+            with open(path, 'rb') as f:
+                return pickle.load(f) == self.fingerprint
+        except (OSError, pickle.UnpicklingError, EOFError) as e:
+            logger.warning(f"unreadable checkpoint {path}: {e}")
+            return False
+
+    def load(self, stage: str) -> Any:
+        path = self.path(stage)
+        logger.info(f"<= {path}")
+        with open(path, 'rb') as f:
+            checkpoint_fingerprint = pickle.load(f)
+            if checkpoint_fingerprint != self.fingerprint:
+                raise ValueError(f"checkpoint {path} was made from different input")
+            return pickle.load(f)
+
+    def latest_valid(self, stages: List[str]) -> Optional[str]:
+        """Return the last of the (ordered) stages that has a valid checkpoint, or None."""
+        for stage in reversed(stages):
+            if self.is_valid(stage):
+                return stage
+        return None
@@ -0,0 +1,102 @@
+from dataclasses import MISSING, fields, is_dataclass
+from types import UnionType
+from typing import Any, Callable, Dict, Optional, Union, get_args, get_origin, get_type_hints
+
+from dataclasses_json import Undefined
+from dataclasses_json.undefined import UndefinedParameterError
+
+Decoder = Callable[[Any], Any]
+
+_decoders: Dict[type, Decoder] = {}
+
+
+def decoder_for(cls: type) -> Decoder:
+    """
+    Return a function that turns a (json) dict into an instance of the dataclass `cls`.
+
+    The result is equivalent to `cls.from_dict(d)` for the dataclass_json classes in `untanngle.annotations`,
+    including the check for undefined fields on classes configured with `Undefined.RAISE`,
+    but the field layout of `cls` is only inspected once, instead of on every call.
+    """
+    decoder = _decoders.get(cls)
+    if decoder is None:
+        decoder = _build_decoder(cls)
+        _decoders[cls] = decoder
+    return decoder
+
+
+def decode(cls: type, d: dict) -> Any:
+    return decoder_for(cls)(d)
+
+
+def _build_decoder(cls: type) -> Decoder:
+    hints = get_type_hints(cls)
+    field_specs = []
+    known_keys = set()
+    for f in fields(cls):
+        if not f.init:
+            continue
+        json_key = _json_key(f)
+        alt_key = f.name if f.name != json_key else None
+        required = f.default is MISSING and f.default_factory is MISSING
+        field_specs.append((f.name, json_key, alt_key, required, _converter(hints[f.name])))
+        known_keys.add(json_key)
+        known_keys.add(f.name)
+    json_config = getattr(cls, "dataclass_json_config", None) or {}
+    strict = json_config.get("undefined") == Undefined.RAISE
+
+    def decode_dataclass(d: dict) -> Any:
+        if strict:
+            undefined_keys = d.keys() - known_keys
+            if undefined_keys:
+                undefined_args = {k: d[k] for k in d if k in undefined_keys}
+                raise UndefinedParameterError(f"Received undefined initialization arguments {undefined_args}")
+        kwargs = {}
+        for name, json_key, alt_key, required, converter in field_specs:
+            if json_key in d:
+                value = d[json_key]
+            elif alt_key is not None and alt_key in d:
+                value = d[alt_key]
+            elif required:
+                raise KeyError(json_key)
+            else:
+                continue
+            if converter is not None and value is not None:
+                value = converter(value)
+            kwargs[name] = value
+        return cls(**kwargs)
+
+    return decode_dataclass
+
+
+def _json_key(f) -> str:
+    letter_case = f.metadata.get("dataclasses_json", {}).get("letter_case")
+    return letter_case(f.name) if letter_case else f.name
+
+
+def _converter(field_type: Any) -> Optional[Decoder]:
+    """Return the conversion needed for a json value of type `field_type`, or None if it can be used as is."""
+    if is_dataclass(field_type):
+        return _lazy_decoder(field_type)
+
+    origin = get_origin(field_type)
+    args = get_args(field_type)
+    if origin in (Union, UnionType):
+        non_none_args = [a for a in args if a is not type(None)]
+        if len(non_none_args) == 1:
+            return _converter(non_none_args[0])
+        # like dataclass_json, leave values of ambiguous unions (str | List[str]) untouched
+        return None
+    if origin is list and args:
+        element_converter = _converter(args[0])
+        if element_converter is None:
+            return None
+        return lambda values: [element_converter(v) for v in values]
+    return None
+
+
+def _lazy_decoder(cls: type) -> Decoder:
+    def decode_nested(d: dict) -> Any:
+        return decoder_for(cls)(d)
+
+    return decode_nested
@@ -0,0 +1,177 @@
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from dataclasses import dataclass, field
+from http import HTTPStatus
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+import requests
+from loguru import logger
+
+anno_context = "http://www.w3.org/ns/anno.jsonld"
+jsonld_headers = {
+    'Accept': f'application/ld+json; profile="{anno_context}"',
+    'Content-Type': f'application/ld+json; profile="{anno_context}"'
+}
+
+
+class AcknowledgedIndexes:
+    """
+    The indexes of the annotations the server acknowledged, as a watermark (all indexes below it are acknowledged)
+    plus the acknowledged indexes above the watermark, since concurrent uploads complete out of order.
+    """
+
+    def __init__(self, watermark: int = 0, above_watermark: Iterable[int] = ()):
+        self.watermark = watermark
+        self.above_watermark: Set[int] = set(above_watermark)
+        self._advance()
+
+    def add(self, index: int):
+        self.above_watermark.add(index)
+        self._advance()
+
+    def _advance(self):
+        while self.watermark in self.above_watermark:
+            self.above_watermark.remove(self.watermark)
+            self.watermark += 1
+
+    def __contains__(self, index: int) -> bool:
+        return index < self.watermark or index in self.above_watermark
+
+    def __len__(self) -> int:
+        return self.watermark + len(self.above_watermark)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"watermark": self.watermark, "above_watermark": sorted(self.above_watermark)}
+
+    @staticmethod
+    def from_checkpoint(checkpoint: Any) -> 'AcknowledgedIndexes':
+        if isinstance(checkpoint, int):
+            # the old checkpoint format: the index of the last uploaded annotation
+            return AcknowledgedIndexes(checkpoint + 1)
+        return AcknowledgedIndexes(checkpoint["watermark"], checkpoint["above_watermark"])
+
+
+@dataclass
+class ElucidateExporter:
+    """
+    Uploads web annotations to an AnnotationContainer on an Elucidate server, with up to `workers` concurrent requests.
+    (Elucidate's batch services only update or delete annotations, so there is no batch endpoint to create them.)
+
+    Progress is checkpointed in checkpoint_path every checkpoint_every acknowledged annotations, or every
+    checkpoint_interval seconds, whichever comes first, and when the export stops on an error.
+    Every annotation is posted with a slug derived from its id, so an annotation that was created
+    after the last checkpoint is not created again on resume: the server answers with a conflict,
+    which counts as an acknowledgement.
+    """
+    base_url: str
+    container_name: str
+    workers: int = 8
+    checkpoint_path: str = "last_uploaded.json"
+    checkpoint_every: int = 1000
+    checkpoint_interval: float = 30.0
+    _local: threading.local = field(default_factory=threading.local, init=False, repr=False)
+
+    def _http(self) -> requests.Session:
+        # requests.Session is not thread-safe, so use one per thread
+        if not hasattr(self._local, 'session'):
+            self._local.session = requests.Session()
+        return self._local.session
+
+    @property
+    def container_url(self) -> str:
+        return f"{self.base_url.rstrip('/')}/w3c/{self.container_name}/"
+
+    def ensure_container(self):
+        response = self._http().get(self.container_url, headers=jsonld_headers)
+        if response.status_code == HTTPStatus.OK:
+            return
+        container = {"@context": anno_context, "type": "AnnotationCollection", "label": self.container_name}
+        response = self._http().post(f"{self.base_url.rstrip('/')}/w3c/",
+                                     headers={**jsonld_headers, 'Slug': self.container_name}, json=container)
+        response.raise_for_status()
+
+    def annotation_slug(self, index: int, web_annotation: Dict[str, Any]) -> str:
+        name = web_annotation.get('id', f"{self.container_name}/{index}")
+        return str(uuid.uuid5(uuid.NAMESPACE_URL, name))
+
+    def create_annotation(self, index: int, web_annotation: Dict[str, Any]) -> int:
+        annotation = {k: v for k, v in web_annotation.items() if k != 'id'}
+        annotation.setdefault('@context', anno_context)
+        headers = {**jsonld_headers, 'Slug': self.annotation_slug(index, web_annotation)}
+        response = self._http().post(self.container_url, headers=headers, json=annotation)
+        if response.status_code not in (HTTPStatus.CREATED, HTTPStatus.CONFLICT):
+            raise Exception(f"POST {self.container_url} (annotation {index}) returned "
+                            f"{response.status_code}: {response.text}")
+        return index
+
+    def read_checkpoint(self) -> AcknowledgedIndexes:
+        if not os.path.exists(self.checkpoint_path):
+            return AcknowledgedIndexes()
+        with open(self.checkpoint_path) as f:
+            return AcknowledgedIndexes.from_checkpoint(json.load(f))
+
+    def write_checkpoint(self, acknowledged: AcknowledgedIndexes):
+        tmp_path = f"{self.checkpoint_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(acknowledged.to_dict(), f)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def export(self, web_annotations: List[Dict[str, Any]]) -> int:
+        """Upload the web annotations not acknowledged in a previous run; returns the number uploaded in this run."""
+        self.ensure_container()
+        acknowledged = self.read_checkpoint()
+        if acknowledged:
+            logger.info(f"resuming upload to {self.container_url}: {len(acknowledged)} / {len(web_annotations)}"
+                        f" annotations were already uploaded")
+        else:
+            logger.info(f"uploading {len(web_annotations)} annotations to {self.container_url}")
+
+        uploaded = 0
+        unsaved = 0
+        last_save = time.monotonic()
+
+        def handle(done):
+            nonlocal uploaded, unsaved, last_save
+            error = None
+            for future in done:
+                if future.exception() is not None:
+                    error = error or future.exception()
+                    continue
+                acknowledged.add(future.result())
+                uploaded += 1
+                unsaved += 1
+            if error:
+                raise error
+            if unsaved >= self.checkpoint_every or time.monotonic() - last_save >= self.checkpoint_interval:
+                self.write_checkpoint(acknowledged)
+                unsaved = 0
+                last_save = time.monotonic()
+
+        pending = set()
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                for i, wa in enumerate(web_annotations):
+                    if i in acknowledged:
+                        continue
+                    if len(pending) >= 2 * self.workers:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        handle(done)
+                    pending.add(executor.submit(self.create_annotation, i, wa))
+                done, pending = wait(pending)
+                handle(done)
+        except BaseException:
+            # keep the acknowledgements of the requests that did complete
+            for future in pending:
+                if future.done() and not future.cancelled() and future.exception() is None:
+                    acknowledged.add(future.result())
+            self.write_checkpoint(acknowledged)
+            raise
+
+        if os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+        logger.info(f"uploaded {uploaded} annotations")
+        return uploaded
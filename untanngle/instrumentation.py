@@ -0,0 +1,111 @@
+import json
+import resource
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict, field
+from typing import Any, Dict, Iterator, List, Optional
+
+from loguru import logger
+
+
+def peak_rss_kb() -> int:
+    # on linux, ru_maxrss is in kilobytes
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+@dataclass
+class StageMeasurement:
+    name: str
+    wall_time: float = 0.0
+    cpu_time: float = 0.0
+    peak_rss_kb: int = 0
+    peak_rss_delta_kb: int = 0
+    items: Optional[int] = None
+
+
+@dataclass
+class StageTimer:
+    """
+    Records wall time, cpu time, growth of the peak resident set size and (optionally) an item count
+    for a sequence of named processing stages, to be written as a json report.
+
+    Usage:
+        timer = StageTimer()
+        with timer.stage("traverse") as stage:
+            result = traverse()
+            stage.items = len(result)
+        timer.write_report("report.json")
+    """
+    stages: List[StageMeasurement] = field(default_factory=list)
+    metadata: Dict[str, Any] = field(default_factory=dict)
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[StageMeasurement]:
+        measurement = StageMeasurement(name=name)
+        rss_before = peak_rss_kb()
+        cpu_before = time.process_time()
+        wall_before = time.perf_counter()
+        try:
+            yield measurement
+        finally:
+            measurement.wall_time = time.perf_counter() - wall_before
+            measurement.cpu_time = time.process_time() - cpu_before
+            measurement.peak_rss_kb = peak_rss_kb()
+            measurement.peak_rss_delta_kb = measurement.peak_rss_kb - rss_before
+            self.stages.append(measurement)
+            logger.debug(f"stage {name}: {measurement.wall_time:.3f}s wall, {measurement.cpu_time:.3f}s cpu, "
+                         f"+{measurement.peak_rss_delta_kb} kB peak rss")
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            **self.metadata,
+            "total_wall_time": sum(s.wall_time for s in self.stages),
+            "total_cpu_time": sum(s.cpu_time for s in self.stages),
+            "peak_rss_kb": max((s.peak_rss_kb for s in self.stages), default=peak_rss_kb()),
+            "stages": [asdict(s) for s in self.stages]
+        }
+
+    def write_report(self, path: str):
+        logger.info(f"=> {path}")
+        with open(path, 'w', encoding='UTF8') as f:
+            json.dump(self.report(), f, indent=4)
+
+
+profilers = ("cProfile", "pyinstrument")
+
+
+@contextmanager
+def profiling(profiler: Optional[str], path: str) -> Iterator[None]:
+    """
+    Profile the block with the given profiler (one of `profilers`), or not at all when profiler is None.
+    cProfile stats are written to {path}.prof (to be read with pstats or snakeviz),
+    the pyinstrument report to {path}.html; pyinstrument is not a dependency of untanngle, so it must be installed.
+    """
+    if profiler is None:
+        yield
+    elif profiler == "cProfile":
+        import cProfile
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            logger.info(f"=> {path}.prof")
+            profile.dump_stats(f"{path}.prof")
+    elif profiler == "pyinstrument":
+        try:
+            from pyinstrument import Profiler
+        except ImportError as e:
+            raise ImportError("profiling with pyinstrument requires the pyinstrument package") from e
+        profile = Profiler()
+        profile.start()
+        try:
+            yield
+        finally:
+            profile.stop()
+            logger.info(f"=> {path}.html")
+            with open(f"{path}.html", 'w', encoding='UTF8') as f:
+                f.write(profile.output_html())
+    else:
+        raise ValueError(f"unknown profiler: {profiler}, expected one of {', '.join(profilers)}")
@@ -0,0 +1,95 @@
+import os
+import random
+from dataclasses import dataclass, field
+
+from loguru import logger
+
+# the settings to untangle a synthetic export with, see untangle_tf_export
+tier0_type = "tf:File"
+excluded_types = ["nlp:Token", "tei:Lb"]
+
+words = ["lorem", "ipsum", "dolor", "sit", "amet", "consectetur", "adipiscing", "elit", "sed", "dö", "eiusmod"]
+
+
+@dataclass
+class SyntheticTFExport:
+    """
+    Writes a synthetic text-fabric export (the text, anno, anno2node and pos2node tsv files) to benchmark or test
+    untangle_tf_export without project data.
+
+    Every text has pages_per_text pages of paragraphs_per_page paragraphs of tokens_per_paragraph words
+    (each followed by a space token), with an nlp:Token annotation for every word, a tei:Lb annotation every
+    10 words, tei:P annotations with a reference link to the next paragraph on the page, tf:Page annotations with
+    canvas and image metadata, and tei:Text and tf:File (tier0) annotations spanning the text.
+    """
+    texts: int = 2
+    pages_per_text: int = 10
+    paragraphs_per_page: int = 10
+    tokens_per_paragraph: int = 50
+    seed: int = 0
+    _annotations: list[tuple[str, str, str, str, str]] = field(default_factory=list, init=False, repr=False)
+
+    @property
+    def annotation_count(self) -> int:
+        return len(self._annotations)
+
+    def write(self, data_path: str):
+        os.makedirs(data_path, exist_ok=True)
+        rnd = random.Random(self.seed)
+        self._annotations = []
+        positions = []
+        for text_num in range(self.texts):
+            tokens = self._add_text(text_num, rnd)
+            positions.extend(f"{text_num}:{anchor}" for anchor in range(len(tokens)))
+            _write_tsv(f"{data_path}/text-{text_num}.tsv", ["token"],
+                       ([t.replace("\n", "\\n").replace("\t", "\\t")] for t in tokens))
+        _write_tsv(f"{data_path}/anno-1.tsv", ["annoid", "kind", "namespace", "body", "target"], self._annotations)
+        elements = [a[0] for a in self._annotations if a[1] == "element"]
+        _write_tsv(f"{data_path}/anno2node.tsv", ["annotation", "node"],
+                   ((anno_id, node) for node, anno_id in enumerate(elements, start=len(positions) + 1)))
+        _write_tsv(f"{data_path}/pos2node.tsv", ["position", "node"],
+                   ((position, node) for node, position in enumerate(positions, start=1)))
+
+    def _add_text(self, text_num: int, rnd: random.Random) -> list[str]:
+        tokens = []
+        for page_num in range(self.pages_per_text):
+            page_begin = len(tokens)
+            paragraph_ids = []
+            for _ in range(self.paragraphs_per_page):
+                paragraph_begin = len(tokens)
+                for i in range(self.tokens_per_paragraph):
+                    self._add_element("nlp", "token", f"{text_num}:{len(tokens)}-{len(tokens) + 1}")
+                    tokens.extend([rnd.choice(words), " "])
+                    if i % 10 == 9:
+                        self._add_element("tei", "lb", f"{text_num}:{len(tokens)}")
+                tokens.append("\n")
+                paragraph_ids.append(self._add_element("tei", "p", f"{text_num}:{paragraph_begin}-{len(tokens)}"))
+            for from_id, to_id in zip(paragraph_ids, paragraph_ids[1:]):
+                self._add("edge", "tei", "link_ref", f"{from_id}->{to_id}")
+            image_url = f"https://iiif.example.org/iiif/{text_num}-{page_num}.jpg/full/max/0/default.jpg"
+            self._add_element("tf", "page", f"{text_num}:{page_begin}-{len(tokens)}",
+                              n=page_num, pageUrl=image_url, xywh="0,0,1000,1500",
+                              canvasUrl=f"https://example.org/canvas/{text_num}/{page_num}")
+        self._add_element("tei", "text", f"{text_num}:0-{len(tokens)}")
+        self._add_element("tf", "file", f"{text_num}:0-{len(tokens)}",
+                          file=f"file{text_num}", manifest=f"https://example.org/manifest/{text_num}.json")
+        return tokens
+
+    def _add(self, kind: str, namespace: str, body: str, target: str) -> str:
+        anno_id = f"a{len(self._annotations)}"
+        self._annotations.append((anno_id, kind, namespace, body, target))
+        return anno_id
+
+    def _add_element(self, namespace: str, element: str, target: str, **attributes) -> str:
+        anno_id = self._add("element", namespace, element, target)
+        for key, value in attributes.items():
+            self._add("attribute", namespace, f"{key}={value}", anno_id)
+        return anno_id
+
+
+def _write_tsv(path: str, header: list[str], rows):
+    logger.info(f"=> {path}")
+    with open(path, 'w', encoding='utf8') as f:
+        f.write("\t".join(header) + "\n")
+        for row in rows:
+            f.write("\t".join(str(v) for v in row) + "\n")
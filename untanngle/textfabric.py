@@ -1,24 +1,26 @@
-import copy
+import bisect
 import csv
 import glob
+import inspect
 import json
 import os
 import re
 import sys
 import time
 import uuid
-from collections import defaultdict
+from collections import defaultdict, Counter
 from dataclasses import dataclass, field
 from datetime import datetime
-from typing import Any, Optional, Callable
+from typing import Any, Optional, Callable, Iterable, Iterator
 
 from icecream import ic
-from intervaltree import IntervalTree
 from loguru import logger
 
 from untanngle import camel_casing as cc
 from untanngle import utils as ut
 from untanngle.annotations import simple_image_target, image_target
+from untanngle.checkpoints import CheckpointStore, file_digests, fingerprint, module_digests
+from untanngle.instrumentation import StageTimer, profiling
 
 range_target_pattern1 = re.compile(r"(\d+):(\d+)-(\d+)")
 range_target_pattern2 = re.compile(r"(\d+):(\d+)-(\d+):(\d+)")
@@ -72,9 +74,15 @@ class TFUntangleConfig:
     graphic_url_mapper: Optional[Callable[[str], str]] = None
     illustration_sizes_file: Optional[str] = None
     page_sizes_file: Optional[str] = None
+    # record the time and peak memory of every stage of the export
+    profile: bool = False
+    # also profile the export with 'cProfile' or 'pyinstrument'
+    profiler: Optional[str] = None
 
 
-@dataclass
+# tf exports have tens of millions of these, so they are slotted, and their type, namespace and text_num strings
+# are interned, to share them instead of having a copy per annotation
+@dataclass(slots=True)
 class TFAnnotation:
     id: str
     namespace: str
@@ -83,7 +91,7 @@ class TFAnnotation:
     target: str
 
 
-@dataclass
+@dataclass(slots=True)
 class IAnnotation:
     id: str = ""
     namespace: str = ""
@@ -119,17 +127,24 @@ class AnnotationTransformer:
 
     errors = set()
 
+    @staticmethod
+    def body_type(ia: IAnnotation) -> str:
+        return f"{ia.namespace}:{_as_class_name(ia.type)}"
+
+    def body_id(self, ia: IAnnotation) -> str:
+        if ia.type == "letter":
+            return f"urn:{self.project}:{ia.type}:{ia.metadata['file']}"
+        elif ia.type == "file" and ia.metadata["file"] == "introduction":
+            return f"urn:{self.project}:{ia.type}:intro"
+        else:
+            return f"urn:{self.project}:{ia.type}:{ia.tf_node}"
+
     def as_web_annotation(self, ia: IAnnotation) -> dict[str, Any]:
-        body_type = f"{ia.namespace}:{_as_class_name(ia.type)}"
+        body_type = self.body_type(ia)
         text_num = ia.text_num
         textrepo_physical_version = self.textrepo_versions[text_num]['physical']
         textrepo_logical_version = self.textrepo_versions[text_num]['logical']
-        if ia.type == "letter":
-            body_id = f"urn:{self.project}:{ia.type}:{ia.metadata["file"]}"
-        elif ia.type == "file" and ia.metadata["file"] == "introduction":
-            body_id = f"urn:{self.project}:{ia.type}:intro"
-        else:
-            body_id = f"urn:{self.project}:{ia.type}:{ia.tf_node}"
+        body_id = self.body_id(ia)
 
         logical_text_coords = self._calculate_logical_text_coords(ia)
         anno = {
@@ -365,6 +380,26 @@ def _load_graphic_dimensions(illustration_sizes_file: str, page_sizes_file: str)
 
 
 def untangle_tf_export(config: TFUntangleConfig) -> list[str]:
+    """
+    Convert the text-fabric export in config.data_path to text files and web annotations in
+    {config.export_path}/{config.project_name}, and return the errors found.
+
+    With config.profile, the wall time, cpu time and peak memory of every stage are printed and written to
+    untangle-stages.json in the export dir; with config.profiler, the export is also profiled,
+    see instrumentation.profiling.
+    """
+    export_dir = f"{config.export_path}/{config.project_name}"
+    os.makedirs(name=export_dir, exist_ok=True)
+    timer = StageTimer(metadata={"project": config.project_name})
+    with profiling(config.profiler, f"{export_dir}/untangle-profile"):
+        errors = _untangle_tf_export(config, export_dir, timer)
+    if config.profile:
+        _print_stages(timer)
+        timer.write_report(f"{export_dir}/untangle-stages.json")
+    return errors
+
+
+def _untangle_tf_export(config: TFUntangleConfig, export_dir: str, timer: StageTimer) -> list[str]:
     errors = []
     start = time.perf_counter()
     text_files = sorted(glob.glob(f'{config.data_path}/text-*.tsv'))
@@ -373,9 +408,6 @@ def untangle_tf_export(config: TFUntangleConfig) -> list[str]:
     entity_meta_path = f"{config.data_path}/entitymeta.json"
     logical_pairs_path = f"{config.data_path}/logicalpairs.tsv"
     pos_to_node_path = f"{config.data_path}/pos2node.tsv"
-    graphic_dimensions = _load_graphic_dimensions(config.illustration_sizes_file, config.page_sizes_file)
-    export_dir = f"{config.export_path}/{config.project_name}"
-    os.makedirs(name=export_dir, exist_ok=True)
 
     if not config.show_progress:
         logger.remove()
@@ -387,49 +419,82 @@ def untangle_tf_export(config: TFUntangleConfig) -> list[str]:
             os.remove(config.log_file_path)
         logger.add(config.log_file_path)
 
-    entity_metadata = _load_entity_metadata(entity_meta_path)
-    entity_for_ref, load_entities_errors = _load_entities(f"{config.apparatus_data_directory}")
-    errors.extend(load_entities_errors)
-    node_for_pos = _load_node_for_pos(pos_to_node_path)
-    # ic(node_for_pos)
-    token_subst = _read_token_substitutions(logical_pairs_path)
-    # ic(token_subst)
-
-    tokens_per_file = _read_tf_tokens(text_files)
-
-    raw_tf_annotations = []
-    for anno_file in anno_files:
-        raw_tf_annotations.extend(_read_raw_tf_annotations(anno_file))
-    ref_links, target_links, tf_annos = _merge_raw_tf_annotations(raw_tf_annotations, anno2node_path, tokens_per_file,
-                                                                  config.show_progress)
-
-    letter_id_for_tf_node = _map_tf_node_to_letter_id(tf_annos)
-    out_files = []
-    text_nums = []
-    for tsv in text_files:
-        text_num = ut.get_file_num(tsv)
-        text_nums += text_num
-        json_path = f"{export_dir}/textfile-physical-{text_num}.json"
-        segments = _read_tokens(tsv)
-        _store_segmented_text(segments=segments, store_path=json_path)
-        out_files.append(json_path)
-
-    paragraph_ranges = _determine_paragraphs(tf_annos, tokens_per_file)
-    # debug_paragraphs(paragraph_ranges, tokens_per_text)
-
-    logical_file_paths, logical_coords_for_physical_anchor_per_text = _store_logical_text_files(
-        export_dir,
-        paragraph_ranges,
-        tokens_per_file,
-        node_for_pos,
-        token_subst
-    )
-    out_files.extend(logical_file_paths)
+    with timer.stage("load_metadata"):
+        graphic_dimensions = _load_graphic_dimensions(config.illustration_sizes_file, config.page_sizes_file)
+        entity_metadata = _load_entity_metadata(entity_meta_path)
+        entity_for_ref, load_entities_errors = _load_entities(f"{config.apparatus_data_directory}")
+        errors.extend(load_entities_errors)
+        node_for_pos = _load_node_for_pos(pos_to_node_path)
+        # ic(node_for_pos)
+        token_subst = _read_token_substitutions(logical_pairs_path)
+        # ic(token_subst)
+
+    with timer.stage("load_tokens") as stage:
+        tokens_per_file = _read_tf_tokens(text_files)
+        stage.items = sum(len(tokens) for tokens in tokens_per_file.values())
+
+    with timer.stage("load_annotations") as stage:
+        raw_tf_annotations = []
+        for anno_file in anno_files:
+            raw_tf_annotations.extend(_read_raw_tf_annotations(anno_file))
+        stage.items = len(raw_tf_annotations)
+
+    with timer.stage("merge") as stage:
+        ref_links, target_links, tf_annos = _merge_raw_tf_annotations(raw_tf_annotations, anno2node_path,
+                                                                      tokens_per_file, config.show_progress)
+        # the merged annotations hold everything still needed
+        del raw_tf_annotations
+        letter_id_for_tf_node = _map_tf_node_to_letter_id(tf_annos)
+        stage.items = len(tf_annos)
+
+    with timer.stage("physical_texts") as stage:
+        out_files = []
+        for text_num, segments in tokens_per_file.items():
+            json_path = f"{export_dir}/textfile-physical-{text_num}.json"
+            _store_segmented_text(segments=segments, store_path=json_path)
+            out_files.append(json_path)
+        stage.items = len(out_files)
+
+    with timer.stage("paragraphs") as stage:
+        paragraph_ranges = _determine_paragraphs(tf_annos, tokens_per_file)
+        # debug_paragraphs(paragraph_ranges, tokens_per_text)
+        stage.items = sum(len(ranges) for ranges in paragraph_ranges.values())
+
+    with timer.stage("logical_texts") as stage:
+        logical_file_paths, logical_coords_for_physical_anchor_per_text = _store_logical_text_files(
+            export_dir,
+            paragraph_ranges,
+            tokens_per_file,
+            node_for_pos,
+            token_subst
+        )
+        out_files.extend(logical_file_paths)
+        del tokens_per_file, paragraph_ranges, node_for_pos, token_subst
+        stage.items = len(logical_file_paths)
 
+    web_annotations_path = f"{export_dir}/web-annotations.json"
+    checkpoints = None
     if config.textrepo_base_uri_internal:
-        textrepo_file_versions = ut.upload_to_tr(textrepo_base_uri=config.textrepo_base_uri_internal,
-                                                 project_name=config.project_name,
-                                                 tf_text_files=out_files)
+        with timer.stage("textrepo_upload") as stage:
+            version_cache = ut.TextRepoVersionCache(f"{export_dir}/textrepo-versions.json")
+            textrepo_file_versions = ut.upload_to_tr(textrepo_base_uri=config.textrepo_base_uri_internal,
+                                                     project_name=config.project_name,
+                                                     tf_text_files=out_files,
+                                                     version_cache=version_cache)
+            logger.info(f"{version_cache.hits}/{len(out_files)} text files unchanged since their previous upload")
+            stage.items = len(out_files)
+        # with the same text versions, input and code as the previous run, the conversion would give the same
+        # web annotations, so those are kept
+        checkpoints = CheckpointStore(f"{export_dir}/checkpoints",
+                                      _conversion_fingerprint(config, textrepo_file_versions))
+        if (version_cache.unchanged and checkpoints.is_valid("web_annotations")
+                and os.path.exists(web_annotations_path)):
+            logger.info(f"text files and input unchanged since the previous run, keeping {web_annotations_path}")
+            previous = checkpoints.load("web_annotations")
+            errors.extend(previous["errors"])
+            _print_report(config, text_files, previous["annotation_count"], previous["type_counts"], start,
+                          time.perf_counter())
+            return errors
     else:
         textrepo_file_versions = _dummy_version(text_files)
 
@@ -450,27 +515,86 @@ def untangle_tf_export(config: TFUntangleConfig) -> list[str]:
         entity_for_ref=entity_for_ref,
         letter_id_for_tf_node=letter_id_for_tf_node,
         graphic_url_mapper=config.graphic_url_mapper,
-        graphic_dimensions=graphic_dimensions
+        graphic_dimensions=graphic_dimensions,
+        excluded_types=config.excluded_types,
+        timer=timer
     )
     errors.extend(conversion_errors)
-
-    sanity_check_errors = _sanity_check1(web_annotations, config.tier0_type, config.with_facsimiles)
-    errors.extend(sanity_check_errors)
-
-    filtered_web_annotations = [
-        a for a in web_annotations if
-        ('type' in a['body'] and a['body']['type'] not in config.excluded_types)
-        or 'type' not in a['body']
-    ]
-    logger.info(f"{len(filtered_web_annotations)} annotations")
-    ut.store_web_annotations(web_annotations=filtered_web_annotations, export_path=f"{export_dir}/web-annotations.json")
+    # tf_annos was consumed by the conversion
+    del tf_annos, ref_links, target_links, logical_coords_for_physical_anchor_per_text, entity_for_ref
+
+    with timer.stage("sanity_check"):
+        sanity_check_errors = _sanity_check1(web_annotations, config.tier0_type, config.with_facsimiles)
+        errors.extend(sanity_check_errors)
+
+    with timer.stage("store") as stage:
+        if checkpoints and os.path.exists(checkpoints.path("web_annotations")):
+            # a partly written web-annotations.json must not be kept by a next run
+            os.remove(checkpoints.path("web_annotations"))
+        type_counts = Counter()
+        annotation_count = ut.store_web_annotations(
+            web_annotations=_filter_web_annotations(web_annotations, config.excluded_types, type_counts),
+            export_path=web_annotations_path
+        )
+        logger.info(f"{annotation_count} annotations")
+        stage.items = annotation_count
+        if checkpoints:
+            checkpoints.save("web_annotations", {"errors": conversion_errors + sanity_check_errors,
+                                                 "annotation_count": annotation_count,
+                                                 "type_counts": type_counts})
 
     end = time.perf_counter()
 
-    _print_report(config, text_files, filtered_web_annotations, start, end)
+    _print_report(config, text_files, annotation_count, type_counts, start, end)
     return errors
 
 
+def _conversion_fingerprint(config: TFUntangleConfig, textrepo_file_versions: dict[str, dict[str, str]]) -> str:
+    """
+    Fingerprint everything the web annotations are made from: the text-fabric export, the apparatus entities and
+    graphic sizes, the settings, the text versions they refer to, and the untanngle code.
+    """
+    paths = glob.glob(f"{config.data_path}/*.tsv") + glob.glob(f"{config.data_path}/*.json")
+    if config.apparatus_data_directory:
+        paths.extend(glob.glob(f"{config.apparatus_data_directory}/*-entity-dict.json"))
+    paths.extend(p for p in (config.illustration_sizes_file, config.page_sizes_file) if p)
+    settings = (config.project_name, config.tier0_type, sorted(config.excluded_types),
+                config.textrepo_base_uri_internal, config.textrepo_base_uri_external, config.text_in_body,
+                config.with_facsimiles, config.editem_project)
+    mapper = ""
+    if config.graphic_url_mapper:
+        try:
+            mapper = inspect.getsource(config.graphic_url_mapper)
+        except (OSError, TypeError):
+            # without its source, the mapper can't be compared to the previous one, so never keep the output
+            mapper = str(uuid.uuid4())
+    return fingerprint(file_digests(paths) | module_digests("untanngle"),
+                       repr(settings), mapper, json.dumps(textrepo_file_versions, sort_keys=True))
+
+
+def _filter_web_annotations(web_annotations: list[dict[str, Any]], excluded_types: Iterable[str],
+                            type_counts: Counter) -> Iterator[dict[str, Any]]:
+    """
+    Yield the web annotations that don't have an excluded body type, counting the body types in type_counts.
+    The web_annotations list is emptied as it is consumed, so every annotation is released once it has been written.
+    """
+    for a in _consume(web_annotations):
+        if 'type' not in a['body']:
+            yield a
+        elif a['body']['type'] not in excluded_types:
+            type_counts[a['body']['type']] += 1
+            yield a
+
+
+def _consume(items: list) -> Iterator:
+    """Yield the items of the list, dropping the list's reference to every item once it has been yielded."""
+    for i in range(len(items)):
+        item = items[i]
+        items[i] = None
+        yield item
+    items.clear()
+
+
 def _load_entities(path: str) -> (dict[str, dict[str, Any]], list[str]):
     errors = []
     entity_index = {}
@@ -567,21 +691,24 @@ def _read_raw_tf_annotations(anno_file) -> list[TFAnnotation]:
     return [
         TFAnnotation(
             id=row["annoid"],
-            type=row["kind"],
-            namespace=row["namespace"],
+            type=sys.intern(row["kind"]),
+            namespace=sys.intern(row["namespace"]),
             body=row["body"],
             target=row["target"]
         )
-        for row in _read_tsv_records(anno_file)
+        for row in _iter_tsv_records(anno_file)
     ]
 
 
 def _read_tsv_records(path: str) -> list[dict[str, Any]]:
+    return list(_iter_tsv_records(path))
+
+
+def _iter_tsv_records(path: str) -> Iterator[dict[str, Any]]:
     # csv.field_size_limit(sys.maxsize)
     logger.info(f"<= {path}")
     with open(path, encoding='utf8') as f:
-        records = [row for row in csv.DictReader(f, delimiter='\t', quoting=csv.QUOTE_NONE)]
-    return records  # type *is* correct!
+        yield from csv.DictReader(f, delimiter='\t', quoting=csv.QUOTE_NONE)
 
 
 def _read_tokens(path: str) -> list[str]:
@@ -716,7 +843,7 @@ def _merge_raw_tf_annotations(
         tokens_per_text,
         show_progress: bool
 ):
-    tf_node_for_annotation_id = {row['annotation']: row['node'] for row in _read_tsv_records(anno2node_path)}
+    tf_node_for_annotation_id = {row['annotation']: row['node'] for row in _iter_tsv_records(anno2node_path)}
     tf_annotation_idx = {}
     note_target = {}
     node_parents = {}
@@ -788,8 +915,11 @@ def _tf_annotations_to_web_annotations(
         letter_id_for_tf_node: dict[int, str] = field(default_factory=dict),
         graphic_url_mapper: Callable[[str], str] = None,
         graphic_dimensions: dict[str, Dimensions] = field(default_factory=dict),
+        excluded_types: Iterable[str] = (),
+        timer: Optional[StageTimer] = None
 ):
     errors = []
+    timer = timer if timer is not None else StageTimer()
     at = AnnotationTransformer(
         project=project,
         textrepo_url=textrepo_url,
@@ -804,37 +934,54 @@ def _tf_annotations_to_web_annotations(
     )
     logger.info("as_web_annotation")
 
-    tf_node_to_ia_id = {a.tf_node: a.id for a in tf_annos}
-    web_annotations = [at.as_web_annotation(a) for a in tf_annos]
-
-    tf_id_to_body_id = {tf_node_to_ia_id[wa["body"]["tf:textfabric_node"]]: wa["body"]["id"] for wa in web_annotations}
+    # annotations of excluded types are not converted, unless they are needed for the annotations derived below;
+    # their body ids are still registered, for the link annotations
+    skipped_types = set(excluded_types) - _required_body_types(project, project_is_editem_project, tier0_type)
+    skipped = 0
+    # tf_annos is consumed here: every IAnnotation is released as soon as it has been converted
+    tf_id_to_body_id = {}
+    web_annotations = []
+    with timer.stage("conversion") as stage:
+        for a in _consume(tf_annos):
+            tf_id_to_body_id[a.id] = at.body_id(a)
+            if at.body_type(a) in skipped_types:
+                skipped += 1
+            else:
+                web_annotations.append(at.as_web_annotation(a))
+        logger.info(f"skipped {skipped} annotations of excluded types")
+        stage.items = len(web_annotations)
 
     if project == 'suriano':
-        letter_body_annotations = _generate_suriano_letter_body_annotations(web_annotations)
-        web_annotations.extend(letter_body_annotations)
+        with timer.stage("letter_bodies") as stage:
+            letter_body_annotations = _generate_suriano_letter_body_annotations(web_annotations)
+            web_annotations.extend(letter_body_annotations)
+            stage.items = len(letter_body_annotations)
 
     if project_is_editem_project and tier0_type:
-        _extend_tier0_annotations(web_annotations, tier0_type)
-
-    # ic(ref_links)
-    logger.info("ref_annotations")
-    ref_annotations = [
-        _as_link_anno(from_ia_id, to_ia_id, "referencing", tf_id_to_body_id, project)
-        for from_ia_id, to_ia_id in ref_links
-    ]
-    web_annotations.extend(ref_annotations)
+        with timer.stage("tier0_extension"):
+            _extend_tier0_annotations(web_annotations, tier0_type)
+
+    with timer.stage("link_annotations") as stage:
+        # ic(ref_links)
+        logger.info("ref_annotations")
+        ref_annotations = [
+            _as_link_anno(from_ia_id, to_ia_id, "referencing", tf_id_to_body_id, project)
+            for from_ia_id, to_ia_id in ref_links
+        ]
+        web_annotations.extend(ref_annotations)
 
-    # ic(target_links)
-    logger.info("target_annotations")
-    target_annotations = [
-        _as_link_anno(from_ia_id, to_ia_id, "targeting", tf_id_to_body_id, project)
-        for from_ia_id, to_ia_id in target_links
-    ]
-    web_annotations.extend(target_annotations)
+        # ic(target_links)
+        logger.info("target_annotations")
+        target_annotations = [
+            _as_link_anno(from_ia_id, to_ia_id, "targeting", tf_id_to_body_id, project)
+            for from_ia_id, to_ia_id in target_links
+        ]
+        web_annotations.extend(target_annotations)
 
-    if entity_metadata:
-        entity_annotations = at.create_entity_annotations()
-        web_annotations.extend(entity_annotations)
+        if entity_metadata:
+            entity_annotations = at.create_entity_annotations()
+            web_annotations.extend(entity_annotations)
+        stage.items = len(ref_annotations) + len(target_annotations)
 
     if at.errors:
         logger.error("there were conversion errors:")
@@ -842,7 +989,22 @@ def _tf_annotations_to_web_annotations(
             logger.error(e)
             errors.append(e)
     logger.info("keys_to_camel_case")
-    return [cc.keys_to_camel_case(a) for a in web_annotations], errors
+    with timer.stage("camel_case") as stage:
+        for i, a in enumerate(web_annotations):
+            web_annotations[i] = cc.keys_to_camel_case(a)
+        stage.items = len(web_annotations)
+    return web_annotations, errors
+
+
+def _required_body_types(project: str, project_is_editem_project: bool, tier0_type: Optional[str]) -> set[str]:
+    """The body types of the tier0 annotations, and of the annotations the derived annotations depend on."""
+    # the tier0 annotations are checked by _sanity_check1
+    required = {tier0_type} if tier0_type else set()
+    if project == 'suriano':
+        required.update({'tf:File', 'tei:Div'})
+    if project_is_editem_project and tier0_type:
+        required.update({'tei:Text', 'tf:Page'})
+    return required
 
 
 def _debug_paragraphs(paragraph_ranges, tokens_per_text):
@@ -1006,13 +1168,13 @@ def _handle_element(a, tf_annotation_idx, tokens_per_text):
         logger.warning(f"annotation spanning multiple texts: {a}")
 
     elif match1:
-        text_num = match1.group(1)
+        text_num = sys.intern(match1.group(1))
         begin_anchor = int(match1.group(2))
         end_anchor = int(match1.group(3))
         text = "".join(tokens_per_text[text_num][begin_anchor:end_anchor])
         tf_annos = IAnnotation(id=a.id,
                                namespace=a.namespace,
-                               type=a.body,
+                               type=sys.intern(a.body),
                                text=text,
                                text_num=text_num,
                                begin_anchor=begin_anchor,
@@ -1020,13 +1182,13 @@ def _handle_element(a, tf_annotation_idx, tokens_per_text):
         tf_annotation_idx[a.id] = tf_annos
 
     elif match0:
-        text_num = match0.group(1)
+        text_num = sys.intern(match0.group(1))
         begin_anchor = int(match0.group(2))
         end_anchor = begin_anchor
         text = "".join(tokens_per_text[text_num][begin_anchor:end_anchor])
         tf_annos = IAnnotation(id=a.id,
                                namespace=a.namespace,
-                               type=a.body,
+                               type=sys.intern(a.body),
                                text=text,
                                text_num=text_num,
                                begin_anchor=begin_anchor,
@@ -1077,60 +1239,26 @@ def _dummy_version(text_files):
 
 def _generate_suriano_letter_body_annotations(web_annotations: list[dict[str, Any]]) -> list[dict[str, Any]]:
     file_annotations = [wa for wa in web_annotations if wa['body']['type'] == 'tf:File']
-    # ic(len(file_annotations))
-    # ic(file_annotations[42])
-
     relevant_div_annotations = [
         wa for wa in web_annotations
         if wa['body']['type'] == 'tei:Div' and wa['body']['metadata']['type'] != 'notes'
     ]
-    # ic(len(relevant_div_annotations))
-    # ic(relevant_div_annotations[42])
-    iforest = defaultdict(lambda: IntervalTree())
-    for da in relevant_div_annotations:
-        physical_source, start, end = _physical_range(da)
-        iforest[physical_source][start:end] = da
+    div_index = _EnvelopIndex((*_physical_range(da), da) for da in relevant_div_annotations)
 
     letter_body_annotations = []
-
     for fa in file_annotations:
         physical_source, start, end = _physical_range(fa)
         physical_base = physical_source.replace('/contents', '')
-        enveloped_annos = [a.data for a in sorted(iforest[physical_source].envelop(start, end))]
-
-        min_physical_start = sys.maxsize
-        max_physical_end = 0
-        min_logical_start = sys.maxsize
-        max_logical_end = 0
-        l_begin_char_offset = sys.maxsize
-        l_end_char_offset = 0
-        for da in enveloped_annos:
-            p_selector = da["target"][0]["selector"]
-            p_start = p_selector["start"]
-            p_end = p_selector["end"]
-            l_selector = da["target"][2]["selector"]
-            l_start = l_selector["start"]
-            l_end = l_selector["end"]
-            l_char_start = l_selector["beginCharOffset"]
-            l_char_end = l_selector["endCharOffset"]
-
-            if p_start < min_physical_start:
-                min_physical_start = p_start
-                min_logical_start = l_start
-                l_begin_char_offset = l_char_start
-
-            if p_end > max_physical_end:
-                max_physical_end = p_end
-                max_logical_end = l_end
-                l_end_char_offset = l_char_end
-
-        letter_body_annotation = copy.deepcopy(fa)
-        letter_body_annotation["id"] = letter_body_annotation["id"] + ":letter_body"
-        body = letter_body_annotation['body']
-        body.pop('tf:textfabric_node')
+        enveloped_annos = div_index.envelop(physical_source, start, end)
+        min_physical_start, max_physical_end, min_logical_start, max_logical_end, \
+            l_begin_char_offset, l_end_char_offset = _text_bounds(enveloped_annos)
+
+        # only the parts that change are copied, the rest is shared with the file annotation
+        metadata = dict(fa['body']['metadata'])
+        body = {k: v for k, v in fa['body'].items() if k != 'tf:textfabric_node'}
         body["id"] = body["id"].replace('file', 'letter_body')
         body["type"] = "LetterBody"
-        metadata = body["metadata"]
+        body["metadata"] = metadata
         metadata["type"] = "LetterBodyMetadata"
         if "prevFile" in metadata:
             metadata['prevLetterBody'] = metadata['prevFile'].replace('file', 'letter_body')
@@ -1139,7 +1267,7 @@ def _generate_suriano_letter_body_annotations(web_annotations: list[dict[str, An
             metadata['nextLetterBody'] = metadata['nextFile'].replace('file', 'letter_body')
             metadata.pop('nextFile')
 
-        canvas_target = letter_body_annotation["target"][4]
+        canvas_target = dict(fa["target"][4])
 
         logical_source, _, _ = _logical_range(fa)
         logical_base = logical_source.replace('/contents', '')
@@ -1150,13 +1278,79 @@ def _generate_suriano_letter_body_annotations(web_annotations: list[dict[str, An
             _text_targets("LogicalText", logical_base, min_logical_start, max_logical_end, l_begin_char_offset,
                           l_end_char_offset))
         new_targets.append(canvas_target)
+
+        letter_body_annotation = dict(fa)
+        letter_body_annotation["id"] = fa["id"] + ":letter_body"
+        letter_body_annotation['body'] = body
         letter_body_annotation['target'] = new_targets
-        # ic(letter_body_annotation)
         letter_body_annotations.append(letter_body_annotation)
 
     return letter_body_annotations
 
 
+class _EnvelopIndex:
+    """
+    Index on annotations with a text range per source, for repeated envelop queries.
+
+    Gives the annotations with a range within the queried range, sorted by (start, end) like the sorted
+    envelop result of an IntervalTree, but only visits the annotations that start within the queried range.
+    """
+
+    def __init__(self, ranged_annotations: Iterable[tuple[str, int, int, dict[str, Any]]]):
+        per_source = defaultdict(list)
+        for source, start, end, annotation in ranged_annotations:
+            per_source[source].append((start, end, annotation))
+        self.ranges = {}
+        self.starts = {}
+        for source, ranges in per_source.items():
+            ranges.sort(key=lambda r: (r[0], r[1]))
+            self.ranges[source] = ranges
+            self.starts[source] = [r[0] for r in ranges]
+
+    def envelop(self, source: str, start: int, end: int) -> list[dict[str, Any]]:
+        if source not in self.ranges:
+            return []
+        starts = self.starts[source]
+        candidates = self.ranges[source][bisect.bisect_left(starts, start):bisect.bisect_left(starts, end)]
+        return [annotation for _, r_end, annotation in candidates if r_end <= end]
+
+
+def _text_bounds(enveloped_annos: list[dict[str, Any]]) -> tuple[int, int, int, int, int, int]:
+    """
+    The min physical start and max physical end anchor of the (sorted) annotations, with the logical start anchor
+    and begin char offset of the first annotation with that start, and the logical end anchor and end char offset
+    of the first annotation with that end.
+    """
+    min_physical_start = sys.maxsize
+    max_physical_end = 0
+    min_logical_start = sys.maxsize
+    max_logical_end = 0
+    l_begin_char_offset = sys.maxsize
+    l_end_char_offset = 0
+    for da in enveloped_annos:
+        p_selector = da["target"][0]["selector"]
+        p_start = p_selector["start"]
+        p_end = p_selector["end"]
+        l_selector = da["target"][2]["selector"]
+
+        if p_start < min_physical_start:
+            min_physical_start = p_start
+            min_logical_start = l_selector["start"]
+            l_begin_char_offset = l_selector["beginCharOffset"]
+
+        if p_end > max_physical_end:
+            max_physical_end = p_end
+            max_logical_end = l_selector["end"]
+            l_end_char_offset = l_selector["endCharOffset"]
+    return (min_physical_start, max_physical_end, min_logical_start, max_logical_end,
+            l_begin_char_offset, l_end_char_offset)
+
+
+def _target_key(target: dict[str, Any]) -> str:
+    # a hashable key for comparing targets, equal for equal targets
+    return json.dumps(target, sort_keys=True)
+
+
 def _extend_tier0_annotations(
         web_annotations: list[dict[str, Any]],
         tier0_type: str):
@@ -1164,55 +1358,31 @@ def _extend_tier0_annotations(
     tier0_annotations = [wa for wa in web_annotations if wa['body']['type'] == tier0_type]
 
     # the annotations to copy targets from
-    text_annotations = [wa for wa in web_annotations if wa['body']['type'] == 'tei:Text']
-    iforest = defaultdict(lambda: IntervalTree())
-    for da in text_annotations:
-        physical_source, start, end = _physical_range(da)
-        iforest[physical_source][start:end] = da
+    text_index = _EnvelopIndex(
+        (*_physical_range(wa), wa) for wa in web_annotations if wa['body']['type'] == 'tei:Text')
 
     # the annotations to get pageUrl, xywh from
-    page_annotations = [wa for wa in web_annotations if wa['body']['type'] == 'tf:Page']
-    page_forest = defaultdict(lambda: IntervalTree())
-    for pa in page_annotations:
+    page_ranges = []
+    for pa in web_annotations:
+        if pa['body']['type'] != 'tf:Page':
+            continue
         physical_source, start, end = _physical_range(pa)
         if start == end:
             logger.warning(f'tf:Page without text: {pa}')
             end = start + 1
-        page_forest[physical_source][start:end] = pa
+        page_ranges.append((physical_source, start, end, pa))
+    page_index = _EnvelopIndex(page_ranges)
 
     for t0_annotation in tier0_annotations:
         physical_source, start, end = _physical_range(t0_annotation)
         physical_base = physical_source.replace('/contents', '')
-        enveloped_text_annos = [a.data for a in sorted(iforest[physical_source].envelop(start, end))]
+        enveloped_text_annos = text_index.envelop(physical_source, start, end)
         text_anno = enveloped_text_annos[0]
 
-        enveloped_page_annos = [a.data for a in sorted(page_forest[physical_source].envelop(start, end))]
-
-        min_physical_start = sys.maxsize
-        max_physical_end = 0
-        min_logical_start = sys.maxsize
-        max_logical_end = 0
-        l_begin_char_offset = sys.maxsize
-        l_end_char_offset = 0
-        for da in enveloped_text_annos:
-            p_selector = da["target"][0]["selector"]
-            p_start = p_selector["start"]
-            p_end = p_selector["end"]
-            l_selector = da["target"][2]["selector"]
-            l_start = l_selector["start"]
-            l_end = l_selector["end"]
-            l_char_start = l_selector["beginCharOffset"]
-            l_char_end = l_selector["endCharOffset"]
-
-            if p_start < min_physical_start:
-                min_physical_start = p_start
-                min_logical_start = l_start
-                l_begin_char_offset = l_char_start
-
-            if p_end > max_physical_end:
-                max_physical_end = p_end
-                max_logical_end = l_end
-                l_end_char_offset = l_char_end
+        enveloped_page_annos = page_index.envelop(physical_source, start, end)
+
+        min_physical_start, max_physical_end, min_logical_start, max_logical_end, \
+            l_begin_char_offset, l_end_char_offset = _text_bounds(enveloped_text_annos)
 
         logical_source, _, _ = _logical_range(text_anno)
         logical_base = logical_source.replace('/contents', '')
@@ -1222,20 +1392,22 @@ def _extend_tier0_annotations(
         new_targets.extend(
             _text_targets("LogicalText", logical_base, min_logical_start, max_logical_end, l_begin_char_offset,
                           l_end_char_offset))
+        target_keys = {_target_key(t) for t in new_targets}
         for pa in enveloped_page_annos:
             canvas_targets = [t for t in pa["target"] if t['type'] == 'Canvas']
             if len(canvas_targets) > 1:
                 raise Exception("unexpected situation: multiple canvas targets")
             canvas_target = canvas_targets[0]
-            if canvas_target not in new_targets:
-                new_targets.append(canvas_target)
 
             pa_metadata = pa["body"]["metadata"]
             page_url = pa_metadata["pageUrl"]
             xywh = pa_metadata["xywh"]
-            for it in _image_targets(page_url, xywh):
-                if it not in new_targets:  # avoid duplicate image targets
-                    new_targets.append(it)
+            # avoid duplicate canvas and image targets
+            for t in [canvas_target, *_image_targets(page_url, xywh)]:
+                key = _target_key(t)
+                if key not in target_keys:
+                    target_keys.add(key)
+                    new_targets.append(t)
 
         t0_annotation['target'] += [nt for nt in new_targets if nt["type"] in ["Canvas", "Image"]]
 
@@ -1316,9 +1488,18 @@ def _sanity_check1(web_annotations: list, tier0_type: str, expect_manifest: bool
     return errors
 
 
-def _print_report(config, text_files, filtered_web_annotations, start, end):
+def _print_report(config, text_files, annotation_count, type_counts, start, end):
     print(f"untangling {config.project_name} took {end - start:0.4f} seconds")
     print(f"text files: {len(text_files)}")
-    print(f"annotations: {len(filtered_web_annotations)}")
+    print(f"annotations: {annotation_count}")
     print(f"tier0 = {config.tier0_type}")
-    ut.show_annotation_counts(filtered_web_annotations, config.excluded_types)
+    ut.show_type_counts(type_counts, config.excluded_types)
+
+
+def _print_stages(timer: StageTimer):
+    print("Stages:")
+    for s in timer.stages:
+        items = f" ({s.items} items)" if s.items is not None else ""
+        print(f"{s.name:16}: {s.wall_time:8.2f}s wall, {s.cpu_time:8.2f}s cpu, "
+              f"peak rss {s.peak_rss_kb / 1024:8.1f} MB (+{s.peak_rss_delta_kb / 1024:.1f}){items}")
+    print()
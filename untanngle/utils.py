@@ -1,14 +1,21 @@
+import io
 import itertools
 import json
+import os
 import re
-from collections import defaultdict
-from itertools import zip_longest
-from typing import Any, Callable, Tuple
+import threading
+import uuid
+from collections import defaultdict, Counter
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from typing import Any, Callable, Iterable, Iterator, Optional, Tuple
 from typing import List, Dict
 
 import progressbar
 from loguru import logger
-from textrepo.client import TextRepoClient
+from textrepo.client import TextRepoClient, VersionInfo
+
+from untanngle.checkpoints import file_digest
 
 
 def default_progress_bar(max_value):
@@ -33,44 +40,199 @@ def trc_has_document_with_external_id(trc: TextRepoClient, external_id: str) ->
 
 
 def add_segmented_text_type_if_missing(client: TextRepoClient):
-    name = "segmented_text"
-    available_type_names = [t.name for t in client.read_file_types()]
-    if name not in available_type_names:
-        client.create_file_type(name=name, mimetype="application/json")
+    add_file_types_if_missing(client, ["segmented_text"])
 
 
 def add_logical_segmented_text_type_if_missing(client: TextRepoClient):
-    name = "logical_segmented_text"
-    available_type_names = [t.name for t in client.read_file_types()]
-    if name not in available_type_names:
-        client.create_file_type(name=name, mimetype="application/json")
+    add_file_types_if_missing(client, ["logical_segmented_text"])
 
 
-def upload_to_tr(textrepo_base_uri: str, project_name: str, tf_text_files: list[str]) -> dict[str, dict[str, str]]:
-    trc = TextRepoClient(textrepo_base_uri)
-    add_segmented_text_type_if_missing(trc)
-    add_logical_segmented_text_type_if_missing(trc)
-    versions = defaultdict(lambda: {})
+def add_file_types_if_missing(client: TextRepoClient, names: List[str], mimetype: str = "application/json"):
+    available_type_names = {t.name for t in client.read_file_types()}
+    for name in names:
+        if name not in available_type_names:
+            client.create_file_type(name=name, mimetype=mimetype)
+
+
+def textrepo_type_for_file(tf_text_file: str) -> Tuple[str, str]:
+    if "logical" in tf_text_file:
+        return "logical", "logical_segmented_text"
+    else:
+        return "physical", "segmented_text"
+
+
+class TextRepoVersionCache:
+    """
+    Sidecar json file recording, per external_id and file type, the sha256 digest of the contents last uploaded
+    to TextRepo and the version id it got, so uploading byte-identical contents again can be skipped and
+    the existing version id reused.
+    The cache assumes the versions it records are still the latest ones in TextRepo.
+    upload_to_tr counts the files it could skip (hits) and the files it uploaded (uploads), so after an upload
+    `unchanged` tells whether every file was byte-identical to its previous upload.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.entries = read_json(path) if os.path.exists(path) else {}
+        self.hits = 0
+        self.uploads = 0
+
+    @property
+    def unchanged(self) -> bool:
+        return self.uploads == 0
+
+    @staticmethod
+    def key(external_id: str, type_name: str) -> str:
+        return f"{external_id}/{type_name}"
+
+    def version_id(self, external_id: str, type_name: str, digest: str) -> Optional[str]:
+        entry = self.entries.get(self.key(external_id, type_name))
+        if entry and entry["sha256"] == digest:
+            return entry["version_id"]
+        return None
+
+    def update(self, external_id: str, type_name: str, digest: str, version_id: str):
+        self.entries[self.key(external_id, type_name)] = {"sha256": digest, "version_id": version_id}
+
+    def save(self):
+        write_json(self.entries, self.path)
+
+
+class _MultipartFileBody:
+    """
+    A multipart/form-data request body with the contents of a file as its only field. requests sends file-like
+    bodies of a known length in blocks as they are read, so the file is streamed instead of read into memory.
+    """
+
+    def __init__(self, field_name: str, path: str):
+        boundary = uuid.uuid4().hex
+        self.content_type = f"multipart/form-data; boundary={boundary}"
+        head = (f'--{boundary}\r\nContent-Disposition: form-data; name="{field_name}";'
+                f' filename="{os.path.basename(path)}"\r\n\r\n').encode('utf8')
+        tail = f'\r\n--{boundary}--\r\n'.encode('utf8')
+        self.len = len(head) + os.path.getsize(path) + len(tail)
+        self._file = open(path, 'rb')
+        self._parts = [io.BytesIO(head), self._file, io.BytesIO(tail)]
+
+    def read(self, size: int = -1) -> bytes:
+        data = b''
+        while self._parts and (size < 0 or len(data) < size):
+            block = self._parts[0].read(size - len(data) if size >= 0 else -1)
+            if block:
+                data += block
+            else:
+                self._parts.pop(0)
+        return data
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def import_version_from_file(trc: TextRepoClient, external_id: str, type_name: str, path: str,
+                             as_latest_version: bool = False) -> VersionInfo:
+    """TextRepoClient.import_version, with the contents streamed from the file at path."""
+    url = f'{trc.base_uri}/task/import/documents/{external_id}/{type_name}'
+    params = {'allowNewDocument': False, 'asLatestVersion': as_latest_version}
+    with _MultipartFileBody('contents', path) as body:
+        response = trc._post(url=url, params=params, data=body, headers={'Content-Type': body.content_type})
+    return trc._handle_response(response, {
+        HTTPStatus.OK: lambda r: VersionInfo.from_dict(r.json()),
+        HTTPStatus.CREATED: lambda r: VersionInfo.from_dict(r.json())
+    })
+
+
+def upload_to_tr(textrepo_base_uri: str, project_name: str, tf_text_files: list[str],
+                 workers: int = 4, version_cache: Optional[TextRepoVersionCache] = None) -> dict[str, dict[str, str]]:
+    """
+    Upload the text files to TextRepo as the latest versions of the documents `{project_name}-{file_num}`,
+    creating the documents when they don't exist yet, using up to `workers` concurrent connections.
+    With a version_cache, files with the same contents as their previous upload are not uploaded again,
+    and version_cache.unchanged tells whether any file was uploaded at all.
+    Returns the version ids per file_num and type ("physical"/"logical").
+    When uploading a document fails, the other documents are still uploaded (and cached) before the error is raised.
+    """
+    # the files of a document are uploaded by the same worker, so a document is checked and created only once
+    files_per_external_id = defaultdict(list)
     for tf_text_file in tf_text_files:
         file_num = get_file_num(tf_text_file)
-        external_id = f"{project_name}-{file_num}"
-        logger.info(f"<= {tf_text_file}")
-        with open(tf_text_file) as f:
-            content = f.read()
-        if not trc_has_document_with_external_id(trc, external_id):
-            document_identifier = trc.create_document(external_id)
-            trc.set_document_metadata(document_identifier.id, "project", project_name)
-        if "logical" in tf_text_file:
-            type = "logical"
-            tr_type = "logical_segmented_text"
-        else:
-            type = "physical"
-            tr_type = "segmented_text"
-        version_id = trc.import_version(external_id=external_id,
-                                        type_name=tr_type,
-                                        contents=content,
-                                        as_latest_version=True)
-        versions[file_num][type] = version_id.version_id
+        files_per_external_id[f"{project_name}-{file_num}"].append((file_num, tf_text_file))
+
+    local = threading.local()
+    clients = []
+    clients_lock = threading.Lock()
+
+    def client() -> TextRepoClient:
+        # TextRepoClient uses a requests.Session, which is not thread-safe, so use one client per thread
+        if not hasattr(local, 'trc'):
+            local.trc = TextRepoClient(textrepo_base_uri)
+            with clients_lock:
+                clients.append(local.trc)
+        return local.trc
+
+    # the workers only read the version_cache: it is updated (and the hits counted) in the main thread
+    def upload_document(external_id: str, files: List[Tuple[str, str]]) -> List[Tuple[str, str, str, str, str, bool]]:
+        uploaded = []
+        to_upload = []
+        for file_num, tf_text_file in files:
+            type, tr_type = textrepo_type_for_file(tf_text_file)
+            digest = file_digest(tf_text_file) if version_cache else None
+            version_id = version_cache.version_id(external_id, tr_type, digest) if version_cache else None
+            if version_id:
+                logger.info(f"{tf_text_file} unchanged, keeping version {version_id}")
+                uploaded.append((file_num, type, tr_type, digest, version_id, True))
+            else:
+                to_upload.append((file_num, tf_text_file, type, tr_type, digest))
+        if not to_upload:
+            return uploaded
+
+        doc_client = client()
+        if doc_client.read_document_by_external_id(external_id) is None:
+            document_identifier = doc_client.create_document(external_id)
+            doc_client.set_document_metadata(document_identifier.id, "project", project_name)
+        for file_num, tf_text_file, type, tr_type, digest in to_upload:
+            logger.info(f"<= {tf_text_file}")
+            version_info = import_version_from_file(doc_client, external_id=external_id, type_name=tr_type,
+                                                    path=tf_text_file, as_latest_version=True)
+            uploaded.append((file_num, type, tr_type, digest, version_info.version_id, False))
+        return uploaded
+
+    versions = defaultdict(lambda: {})
+    error = None
+    try:
+        add_file_types_if_missing(client(), ["segmented_text", "logical_segmented_text"])
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(upload_document, external_id, files): external_id
+                       for external_id, files in files_per_external_id.items()}
+            for future, external_id in futures.items():
+                try:
+                    uploaded = future.result()
+                except Exception as e:
+                    logger.error(f"uploading {external_id} failed: {e}")
+                    error = error or e
+                    continue
+                for file_num, type, tr_type, digest, version_id, cached in uploaded:
+                    versions[file_num][type] = version_id
+                    if not version_cache:
+                        continue
+                    if cached:
+                        version_cache.hits += 1
+                    else:
+                        version_cache.uploads += 1
+                        version_cache.update(external_id, tr_type, digest, version_id)
+    finally:
+        # keep the versions uploaded so far, so they are not uploaded again next time
+        if version_cache:
+            version_cache.save()
+        for c in clients:
+            c.close()
+    if error:
+        raise error
     return versions
 
 
@@ -90,21 +252,31 @@ def get_file_num(tf_text_file: str) -> str:
             return ""
 
 
-def store_web_annotations(web_annotations, export_path: str):
+def store_web_annotations(web_annotations: Iterable[Dict[str, Any]], export_path: str) -> int:
+    """
+    Write the web annotations as a json list, formatted as json.dump with indent=2 would,
+    one annotation at a time, so web_annotations can be a generator. Returns the number of annotations written.
+    """
     logger.info(f"=> {export_path}")
+    count = 0
     with open(export_path, "w", encoding="utf-8") as f:
-        json.dump(obj=web_annotations, fp=f, indent=2, ensure_ascii=False)
+        f.write("[")
+        for web_annotation in web_annotations:
+            f.write(",\n  " if count else "\n  ")
+            f.write(json.dumps(web_annotation, indent=2, ensure_ascii=False).replace("\n", "\n  "))
+            count += 1
+        f.write("\n]" if count else "]")
+    return count
 
 
 def show_annotation_counts(web_annotations: List[Dict[str, Any]], excluded_types):
+    show_type_counts(Counter(a['body']['type'] for a in web_annotations if "type" in a["body"]), excluded_types)
+
+
+def show_type_counts(type_counts: Dict[str, int], excluded_types):
     print()
     print("Annotation types:")
-    typed_annotations = [a for a in web_annotations if "type" in a["body"]]
-    typed_annotations.sort(key=lambda a: a['body']['type'])
-    grouped = itertools.groupby(typed_annotations, lambda a: a['body']['type'])
-    counts = []
-    for atype, anno_group in grouped:
-        counts.append([atype, len([a for a in anno_group])])
+    counts = sorted(type_counts.items())
     counts.sort(key=lambda t: t[1])
     max_type_name_size = max([len(t[0]) for t in counts])
     for t in counts:
@@ -125,7 +297,39 @@ def trim_trailing_slash(url: str):
 
 
 def chunk_list(big_list: List[Any], chunk_size: int) -> List[List[Any]]:
-    return [[i for i in item if i] for item in list(zip_longest(*[iter(big_list)] * chunk_size))]
+    return list(iter_chunks(big_list, chunk_size))
+
+
+def iter_chunks(items: Iterable[Any], chunk_size: int) -> Iterator[List[Any]]:
+    """Lazily split items into consecutive lists of (at most) chunk_size items."""
+    iterator = iter(items)
+    while chunk := list(itertools.islice(iterator, chunk_size)):
+        yield chunk
+
+
+def json_size(item: Any) -> int:
+    # the size of the item in a json array as requests sends it (ascii only), including the separating comma
+    return len(json.dumps(item)) + 1
+
+
+def iter_chunks_by_size(items: Iterable[Any], max_bytes: int, max_items: Optional[int] = None,
+                        size: Callable[[Any], int] = json_size) -> Iterator[List[Any]]:
+    """
+    Lazily split items into consecutive lists with a json encoding of at most max_bytes (and at most max_items
+    items, when given). An item that is larger than max_bytes by itself gets a chunk of its own.
+    """
+    chunk = []
+    chunk_bytes = 2  # []
+    for item in items:
+        item_bytes = size(item)
+        if chunk and (chunk_bytes + item_bytes > max_bytes or (max_items and len(chunk) >= max_items)):
+            yield chunk
+            chunk = []
+            chunk_bytes = 2
+        chunk.append(item)
+        chunk_bytes += item_bytes
+    if chunk:
+        yield chunk
 
 
 def read_json(path: str) -> Any:
@@ -135,10 +339,10 @@ def read_json(path: str) -> Any:
     return data
 
 
-# def write_json(output_path: str):
-#     logger.info(f"=> {version_id_idx_path}")
-#     with open(version_id_idx_path, "w") as f:
-#         json.dump(output_path, fp=f, ensure_ascii=False)
+def write_json(data: Any, path: str):
+    logger.info(f"=> {path}")
+    with open(path, "w") as f:
+        json.dump(data, fp=f, ensure_ascii=False)
 
 
 def transform_dict_entries(